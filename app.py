@@ -5,6 +5,7 @@ import os
 import plotly.express as px
 from datetime import datetime, date # Asegurar importar date tambien
 import io
+from contextlib import contextmanager
 import logging # Importar logging
 from textwrap import dedent # Para prompts multilínea
 
@@ -12,9 +13,23 @@ from textwrap import dedent # Para prompts multilínea
 # Asumiendo que están en el mismo directorio o PYTHONPATH
 from price_updaters import update_insumo_prices, update_competitor_prices
 from snapshot_creator import create_financial_snapshot # Asume que devuelve (bool, str)
-from db_connection import connect_db # Asume que devuelve conexión o None
+from history_queries import get_latest_slice, get_top_platos, get_plato_series, HISTORY_METRICS, DEFAULT_TARGET_POINTS
+from history_store import get_history_store
+from financial_history import HistorySchemaError, check_history_param_column
+from kpi_rollups import update_kpi_rollups, get_kpi_rollups, get_rollup_categories, ROLLUP_TABLES, ALL_CATEGORIES
+from db_connection import get_pooled_connection # Asume que devuelve conexión del pool o None
+from materialized_views import materialized_source, get_materialization_version, refresh_all_materialized, refresh_campaign_simulation
+from costing_engine import CostingEngine, fetch_financial_params
+from exposure_index import COMPOSITION_VERSION
+from scenario_simulator import simulate_price_shocks
+from margin_risk import margin_at_risk
 # --- Importar módulos de campaña y LLM ---
 from campaign_analyzer import get_campaign_simulation_data, analyze_campaigns_simplified, generate_campaign_brief # Asumen que devuelven (bool, str/data) o DataFrame
+from campaign_analyzer import get_simulation_dimensions, get_exclusivity_membership
+from exclusivity_index import get_conflict_snapshot
+from simulation_filter import SimulationFilter
+from simulation_index import SimulationIndex
+from campaign_optimizer import optimize_campaign_assignment
 import LLM_integrator # Importa tu nuevo módulo
 import google.generativeai as genai # Necesario para el manejo del modelo
 
@@ -35,11 +50,22 @@ if 'campaign_results' not in st.session_state:
 if 'gemini_model' not in st.session_state:
     st.session_state.gemini_model = None # Objeto del modelo Gemini inicializado
 
-# --- Crear conexión (Cacheada) ---
-@st.cache_resource
+# --- Obtener conexión (Pool compartido por todas las sesiones) ---
+# Cada ejecución del script toma su propia conexión del pool (page_connection) y la devuelve
+# al salir de la página, así las sesiones concurrentes no se serializan sobre un único socket.
 def get_connection():
-    conn = connect_db()
-    return conn
+    return get_pooled_connection()
+
+# Cada página usa la conexión dentro de un with: vuelve al pool aunque la página termine con
+# st.stop() o con una excepción (antes solo se devolvía al final del script)
+@contextmanager
+def page_connection():
+    conn = get_connection()
+    try:
+        yield conn
+    finally:
+        if conn is not None:
+            conn.close()
 
 # --- Funciones auxiliares (si se necesitan) ---
 def show_data_preview(df, title):
@@ -49,11 +75,22 @@ def show_data_preview(df, title):
     else:
         st.info(f"No hay datos para mostrar en '{title}'.")
 
+# Motor de costeo compartido entre sesiones. La clave lleva la versión de PLATOS_FINANCIALS_MAT
+# (precios y parámetros) y la de COMPOSITION (recetas, subrecetas y packaging, que no cambian la
+# anterior); una versión None (tablas aún no creadas) deja el caché al ttl.
+@st.cache_resource(ttl=600)
+def load_costing_engine(_conn, data_version=None):
+    return CostingEngine.from_db(_conn)
+
+def costing_data_version(conn):
+    return (get_materialization_version(conn, "PLATOS_FINANCIALS_MAT"),
+            get_materialization_version(conn, COMPOSITION_VERSION))
+
 # --- Barra Lateral de Navegación ---
 st.sidebar.title("Navegación")
 option = st.sidebar.radio(
     "Selecciona una opción:",
-    ("Ver Datos Actuales", "Actualizar Precios", "Crear Snapshot", "Ver Historial", "Análisis de Campañas", "Chat con Asistente") # Opción añadida
+    ("Ver Datos Actuales", "Actualizar Precios", "Crear Snapshot", "Ver Historial", "Análisis de Campañas", "Simulador de Escenarios", "Riesgo de Margen", "Chat con Asistente") # Opción añadida
 )
 
 # --- Placeholder para mensajes de estado ---
@@ -64,83 +101,96 @@ status_placeholder = st.empty()
 # ==============================================================================
 if option == "Ver Datos Actuales":
     st.header("Visualización de Datos Actuales")
-    conn = get_connection()
-    if conn and conn.is_connected():
-        try:
-            available_views = [
-                "INSUMOS", "PLATOS", "CAMPAIGNS", "FINANCIAL_PARAMS",
-                "V_PLATOS_COSTOS", "V_PLATOS_FINANCIALS", "V_CAMPAIGN_SIMULATION",
-                "PLATOS_FINANCIALS_HISTORY" # Añadido historial aquí también
-            ]
-            view_option = st.selectbox(
-                "Selecciona una tabla o vista para visualizar:",
-                available_views
-            )
-
-            if view_option:
-                query = f"SELECT * FROM {view_option} LIMIT 500;"
-                df_view = pd.read_sql_query(query, conn) # Advertencia Pandas aquí
-                st.dataframe(df_view, use_container_width=True)
-                st.caption(f"Mostrando hasta 500 filas de '{view_option}'.")
+    with page_connection() as conn:
+        if conn and conn.is_connected():
+            try:
+                available_views = [
+                    "INSUMOS", "PLATOS", "CAMPAIGNS", "FINANCIAL_PARAMS",
+                    "V_PLATOS_COSTOS", "V_PLATOS_FINANCIALS", "V_CAMPAIGN_SIMULATION",
+                    "PLATOS_FINANCIALS_HISTORY" # Añadido historial aquí también
+                ]
+                view_option = st.selectbox(
+                    "Selecciona una tabla o vista para visualizar:",
+                    available_views
+                )
 
-        except mysql.connector.Error as err:
-            status_placeholder.error(f"Error de base de datos al cargar vista '{view_option}': {err}")
-        except Exception as e:
-            status_placeholder.error(f"Error inesperado al cargar vista '{view_option}': {e}")
-    else:
-        status_placeholder.error("Error de conexión a la base de datos.")
+                if view_option:
+                    # Las vistas materializadas se leen de su tabla (lectura por clave primaria)
+                    source = materialized_source(conn, view_option)
+                    query = f"SELECT * FROM {source} LIMIT 500;"
+                    df_view = pd.read_sql_query(query, conn) # Advertencia Pandas aquí
+                    st.dataframe(df_view, use_container_width=True)
+                    if source != view_option:
+                        st.caption(f"Mostrando hasta 500 filas de '{view_option}' (materializada en {source}, versión {get_materialization_version(conn, source)}).")
+                    else:
+                        st.caption(f"Mostrando hasta 500 filas de '{view_option}'.")
 
-# ==============================================================================
-# --- SECCIÓN: Actualizar Precios ---
-# ==============================================================================
-elif option == "Actualizar Precios":
-    st.header("Actualización de Precios Base")
-    conn = get_connection()
-    if not (conn and conn.is_connected()):
-        status_placeholder.error("Error de conexión a la base de datos. No se pueden actualizar precios.")
-    else:
-        # --- Actualizar Insumos ---
-        st.subheader("1. Actualizar Precios de Insumos desde CSV")
-        uploaded_insumos_csv = st.file_uploader("Carga archivo CSV de insumos (nuevos_precios_insumos.csv)", type="csv", key="ins_upload")
-        if uploaded_insumos_csv is not None:
-            if st.button("Actualizar Precios de Insumos", key="ins_update_btn"):
-                with st.spinner("Actualizando precios de insumos..."):
-                    try:
-                        # Guardar temporalmente y pasar ruta (o adaptar función)
-                        with open("temp_insumos.csv", "wb") as f:
-                            f.write(uploaded_insumos_csv.getbuffer())
-                        # Asume que la función devuelve (bool, message)
-                        success, message = update_insumo_prices(conn, file_path="temp_insumos.csv")
-                        os.remove("temp_insumos.csv")
+                if st.button("Refrescar tablas materializadas", key="mat_refresh_btn"):
+                    with st.spinner("Refrescando tablas materializadas..."):
+                        success, message = refresh_all_materialized(conn)
                         if success:
                             status_placeholder.success(message)
                         else:
                             status_placeholder.error(message)
-                    except Exception as e:
-                        status_placeholder.error(f"Error procesando archivo de insumos: {e}")
 
-        st.divider()
+            except mysql.connector.Error as err:
+                status_placeholder.error(f"Error de base de datos al cargar vista '{view_option}': {err}")
+            except Exception as e:
+                status_placeholder.error(f"Error inesperado al cargar vista '{view_option}': {e}")
+        else:
+            status_placeholder.error("Error de conexión a la base de datos.")
 
-        # --- Actualizar Competencia ---
-        st.subheader("2. Actualizar Precios de Competencia desde Excel/CSV")
-        uploaded_competencia = st.file_uploader("Carga archivo Excel/CSV de competencia (precios_competencia.xlsx/csv)", type=["xlsx", "csv"], key="comp_upload")
-        if uploaded_competencia is not None:
-             if st.button("Actualizar Precios de Competencia", key="comp_update_btn"):
-                with st.spinner("Actualizando precios de competencia..."):
-                    try:
-                        # Guardar temporalmente y pasar ruta (o adaptar función)
-                        file_ext = uploaded_competencia.name.split('.')[-1]
-                        temp_comp_file = f"temp_competencia.{file_ext}"
-                        with open(temp_comp_file, "wb") as f:
-                            f.write(uploaded_competencia.getbuffer())
-                        success, message = update_competitor_prices(conn, file_path=temp_comp_file)
-                        os.remove(temp_comp_file)
-                        if success:
-                            status_placeholder.success(message)
-                        else:
-                            status_placeholder.error(message)
-                    except Exception as e:
-                        status_placeholder.error(f"Error procesando archivo de competencia: {e}")
+# ==============================================================================
+# --- SECCIÓN: Actualizar Precios ---
+# ==============================================================================
+elif option == "Actualizar Precios":
+    st.header("Actualización de Precios Base")
+    with page_connection() as conn:
+        if not (conn and conn.is_connected()):
+            status_placeholder.error("Error de conexión a la base de datos. No se pueden actualizar precios.")
+        else:
+            # --- Actualizar Insumos ---
+            st.subheader("1. Actualizar Precios de Insumos desde CSV")
+            uploaded_insumos_csv = st.file_uploader("Carga archivo CSV de insumos (nuevos_precios_insumos.csv)", type="csv", key="ins_upload")
+            if uploaded_insumos_csv is not None:
+                if st.button("Actualizar Precios de Insumos", key="ins_update_btn"):
+                    with st.spinner("Actualizando precios de insumos..."):
+                        try:
+                            # Guardar temporalmente y pasar ruta (o adaptar función)
+                            with open("temp_insumos.csv", "wb") as f:
+                                f.write(uploaded_insumos_csv.getbuffer())
+                            # Asume que la función devuelve (bool, message)
+                            success, message = update_insumo_prices(conn, file_path="temp_insumos.csv")
+                            os.remove("temp_insumos.csv")
+                            if success:
+                                status_placeholder.success(message)
+                            else:
+                                status_placeholder.error(message)
+                        except Exception as e:
+                            status_placeholder.error(f"Error procesando archivo de insumos: {e}")
+
+            st.divider()
+
+            # --- Actualizar Competencia ---
+            st.subheader("2. Actualizar Precios de Competencia desde Excel/CSV")
+            uploaded_competencia = st.file_uploader("Carga archivo Excel/CSV de competencia (precios_competencia.xlsx/csv)", type=["xlsx", "csv"], key="comp_upload")
+            if uploaded_competencia is not None:
+                 if st.button("Actualizar Precios de Competencia", key="comp_update_btn"):
+                    with st.spinner("Actualizando precios de competencia..."):
+                        try:
+                            # Guardar temporalmente y pasar ruta (o adaptar función)
+                            file_ext = uploaded_competencia.name.split('.')[-1]
+                            temp_comp_file = f"temp_competencia.{file_ext}"
+                            with open(temp_comp_file, "wb") as f:
+                                f.write(uploaded_competencia.getbuffer())
+                            success, message = update_competitor_prices(conn, file_path=temp_comp_file)
+                            os.remove(temp_comp_file)
+                            if success:
+                                status_placeholder.success(message)
+                            else:
+                                status_placeholder.error(message)
+                        except Exception as e:
+                            status_placeholder.error(f"Error procesando archivo de competencia: {e}")
 
 # ==============================================================================
 # --- SECCIÓN: Crear Snapshot ---
@@ -148,292 +198,584 @@ elif option == "Actualizar Precios":
 elif option == "Crear Snapshot":
     st.header("Crear Snapshot Financiero")
     st.write("Esto consultará los datos financieros actuales (basados en V_PLATOS_FINANCIALS) y los guardará en la tabla de historial (`PLATOS_FINANCIALS_HISTORY`).")
-    conn = get_connection()
-    if not (conn and conn.is_connected()):
-        status_placeholder.error("Error de conexión a la base de datos. No se puede crear snapshot.")
-    else:
-        if st.button("Crear Snapshot Ahora", key="snap_create_btn"):
-            with st.spinner("Creando snapshot..."):
-                try:
-                    success, message = create_financial_snapshot(conn) # Asume que devuelve (bool, message)
-                    if success:
-                        status_placeholder.success(message)
-                        # Limpiar caché de historial si es relevante
-                        # load_history_data_cached.clear()
-                    else:
-                        status_placeholder.error(message)
-                except Exception as e:
-                    status_placeholder.error(f"Error inesperado al crear snapshot: {e}")
+    with page_connection() as conn:
+        if not (conn and conn.is_connected()):
+            status_placeholder.error("Error de conexión a la base de datos. No se puede crear snapshot.")
+        else:
+            snap_delta = st.checkbox("Guardar solo los platos que cambiaron (snapshot delta)", value=True, key="snap_delta_chk")
+            if st.button("Crear Snapshot Ahora", key="snap_create_btn"):
+                with st.spinner("Creando snapshot..."):
+                    try:
+                        success, message = create_financial_snapshot(conn, delta=snap_delta) # Asume que devuelve (bool, message)
+                        if success:
+                            # Rollups de KPIs: solo los períodos del nuevo snapshot
+                            rollup_ok, rollup_message = update_kpi_rollups(conn)
+                            if rollup_ok:
+                                status_placeholder.success(f"{message} {rollup_message}")
+                            else:
+                                status_placeholder.warning(f"{message} {rollup_message}")
+                            # "Ver Historial" lo muestra en el próximo rerun (history_store.refresh)
+                        else:
+                            status_placeholder.error(message)
+                    except Exception as e:
+                        status_placeholder.error(f"Error inesperado al crear snapshot: {e}")
 
 # ==============================================================================
 # --- SECCIÓN: Ver Historial ---
 # ==============================================================================
 elif option == "Ver Historial":
     st.header("📊 Historial Financiero")
-    conn = get_connection()
-    if not (conn and conn.is_connected()):
-        status_placeholder.error("Error de conexión a la base de datos.")
-    else:
-        # --- Cargar Datos Históricos (Cacheado) ---
-        @st.cache_data(ttl=600) # Cachear por 10 mins
-        def load_history_data_cached():
-            _conn = get_connection()
-            if _conn:
-                # Incluir Nombre_Plato en la consulta
-                query = """
-                    SELECT
-                        h.*, p.Nombre_Plato
-                    FROM PLATOS_FINANCIALS_HISTORY h
-                    LEFT JOIN PLATOS p ON h.ID_Plato = p.ID_Plato
-                    ORDER BY h.SnapshotTimestamp DESC, h.ID_Plato;
-                """
-                try:
-                    df = pd.read_sql_query(query, _conn) # Advertencia Pandas aquí
-                    # Convertir timestamp a datetime y formatear
-                    if 'SnapshotTimestamp' in df.columns:
-                        df['SnapshotTimestampDT'] = pd.to_datetime(df['SnapshotTimestamp'])
-                        df['SnapshotDate'] = df['SnapshotTimestampDT'].dt.date
-                    return df
-                except Exception as e:
-                    st.error(f"Error al cargar historial: {e}")
+    with page_connection() as conn:
+        if not (conn and conn.is_connected()):
+            status_placeholder.error("Error de conexión a la base de datos.")
+        else:
+            # Historiales creados antes de Param_Id: la migración la corre el job, no la app
+            try:
+                check_history_param_column(conn)
+            except HistorySchemaError as e:
+                st.error(str(e))
+                st.stop()
+
+            # --- Cargar Datos Históricos (incremental) ---
+            # El store del proceso guarda el historial (archivo Parquet + MySQL) y en cada rerun solo
+            # pregunta si hay snapshots nuevos; si los hay, trae únicamente esas filas.
+            @st.cache_resource(max_entries=2)
+            def load_history_view_cached(_store, version):
+                # `version` cambia con cada fila nueva del store; el frame se comparte entre sesiones
+                # (cache_resource no lo copia), la página no lo modifica
+                df = _store.df
+                if df is None or df.empty:
                     return pd.DataFrame()
-            return pd.DataFrame()
+                df = df.sort_values(['SnapshotTimestamp', 'ID_Plato'], ascending=[False, True]).reset_index(drop=True)
+                # Convertir timestamp a datetime y formatear
+                df['SnapshotTimestampDT'] = pd.to_datetime(df['SnapshotTimestamp'])
+                df['SnapshotDate'] = df['SnapshotTimestampDT'].dt.date
+                return df
+
+            history_store = get_history_store()
+            try:
+                history_store.refresh(conn)
+            except Exception as e:
+                st.error(f"Error al cargar historial: {e}")
+            df_history = load_history_view_cached(history_store, history_store.version)
+
+            # --- KPIs por período (lee solo las tablas de rollups) ---
+            @st.cache_data(max_entries=16)
+            def load_kpi_rollups_cached(_conn, granularity, categoria, version):
+                return get_kpi_rollups(_conn, granularity, categoria)
+
+            @st.cache_data(max_entries=4)
+            def load_rollup_categories_cached(_conn, version):
+                try:
+                    return get_rollup_categories(_conn)
+                except Exception:
+                    return [ALL_CATEGORIES] # Tablas de rollups todavía no creadas
+
+            st.subheader("KPIs por período")
+            col_k1, col_k2 = st.columns(2)
+            with col_k1:
+                kpi_granularity = st.radio("Período:", list(ROLLUP_TABLES), format_func={'day': 'Día', 'week': 'Semana', 'month': 'Mes'}.get, horizontal=True, key="hist_kpi_granularity")
+            with col_k2:
+                kpi_categoria = st.selectbox("Categoría:", load_rollup_categories_cached(conn, history_store.version), key="hist_kpi_categoria")
+            try:
+                df_kpi = load_kpi_rollups_cached(conn, kpi_granularity, kpi_categoria, history_store.version)
+            except Exception as e:
+                df_kpi = pd.DataFrame()
+                logging.warning(f"No se pudieron leer los rollups de KPIs: {e}")
+            if df_kpi.empty:
+                st.info("Todavía no hay rollups de KPIs. Se generan con cada snapshot (o con `snapshot_job.py --rebuild-rollups`).")
+            else:
+                kpi_last = df_kpi.iloc[-1]
+                kpi_prev = df_kpi.iloc[-2] if len(df_kpi) > 1 else None
+                m1, m2, m3, m4 = st.columns(4)
+                m1.metric("Margen promedio", f"{kpi_last['Avg_Margin_Pct']:.1%}" if pd.notna(kpi_last['Avg_Margin_Pct']) else "N/A",
+                          delta=f"{(kpi_last['Avg_Margin_Pct'] - kpi_prev['Avg_Margin_Pct']) * 100:.2f} pp" if kpi_prev is not None and pd.notna(kpi_last['Avg_Margin_Pct']) and pd.notna(kpi_prev['Avg_Margin_Pct']) else None)
+                m2.metric("Platos con margen negativo", f"{int(kpi_last['Negative_Margin_Platos'])} / {int(kpi_last['Platos'])}",
+                          delta=int(kpi_last['Negative_Margin_Platos'] - kpi_prev['Negative_Margin_Platos']) if kpi_prev is not None else None, delta_color="inverse")
+                m3.metric("Inflación de costo", f"{kpi_last['Cost_Inflation_Pct']:.2%}" if pd.notna(kpi_last['Cost_Inflation_Pct']) else "N/A")
+                m4.metric("Deriva precio competencia", f"{kpi_last['Price_Drift_Pct']:.2%}" if pd.notna(kpi_last['Price_Drift_Pct']) else "N/A")
+                st.caption(f"Período desde {kpi_last['Period_Start']:%Y-%m-%d} (último snapshot: {kpi_last['Last_Snapshot']}).")
+                tab_k1, tab_k2 = st.tabs(["Margen", "Costos y precios"])
+                with tab_k1:
+                    fig_k1 = px.line(
+                        df_kpi, x='Period_Start', y=['Avg_Margin_Pct', 'Min_Margin_Pct', 'Max_Margin_Pct'],
+                        title=f"Margen Bruto (%) por período - {kpi_categoria}",
+                        labels={'Period_Start': 'Período', 'value': 'Margen Bruto (%)', 'variable': ''},
+                    )
+                    fig_k1.update_layout(yaxis_tickformat=".0%")
+                    st.plotly_chart(fig_k1, use_container_width=True)
+                    fig_k2 = px.bar(df_kpi, x='Period_Start', y='Negative_Margin_Platos',
+                                    title="Platos con margen negativo", labels={'Period_Start': 'Período', 'Negative_Margin_Platos': 'Platos'})
+                    st.plotly_chart(fig_k2, use_container_width=True)
+                with tab_k2:
+                    fig_k3 = px.bar(
+                        df_kpi, x='Period_Start', y=['Cost_Inflation_Pct', 'Price_Drift_Pct'], barmode='group',
+                        title="Inflación de costo y deriva de precio de competencia vs. período anterior",
+                        labels={'Period_Start': 'Período', 'value': 'Variación', 'variable': ''},
+                    )
+                    fig_k3.update_layout(yaxis_tickformat=".1%")
+                    st.plotly_chart(fig_k3, use_container_width=True)
 
-        df_history = load_history_data_cached()
+            if df_history.empty:
+                st.warning("No hay datos en el historial financiero.")
+            else:
+                st.write(f"Total de registros en el historial: {len(df_history)}")
 
-        if df_history.empty:
-            st.warning("No hay datos en el historial financiero.")
-        else:
-            st.write(f"Total de registros en el historial: {len(df_history)}")
+                # --- Filtros para el historial ---
+                st.subheader("Filtrar Historial")
+                col1, col2 = st.columns(2)
+                with col1:
+                    platos_hist = ['Todos'] + sorted(df_history['ID_Plato'].unique())
+                    selected_plato_hist = st.selectbox("Selecciona un Plato:", platos_hist, key="hist_plato_select")
+                with col2:
+                    fechas_hist = ['Todas'] + sorted(df_history['SnapshotDate'].unique(), reverse=True)
+                    selected_fecha_hist = st.selectbox("Selecciona una Fecha (Snapshot):", fechas_hist, key="hist_fecha_select")
+
+                # Aplicar filtros al DataFrame del historial
+                filtered_history_df = df_history.copy()
+                if selected_plato_hist != 'Todos':
+                    filtered_history_df = filtered_history_df[filtered_history_df['ID_Plato'] == selected_plato_hist]
+                if selected_fecha_hist != 'Todas':
+                    filtered_history_df = filtered_history_df[filtered_history_df['SnapshotDate'] == selected_fecha_hist]
+
+
+                st.subheader("Datos Históricos Filtrados")
+                # Mostrar Timestamp formateado
+                display_cols_hist = [col for col in filtered_history_df.columns if col not in ['SnapshotTimestampDT', 'SnapshotDate']]
+                # Reordenar columnas si Nombre_Plato existe
+                if 'Nombre_Plato' in display_cols_hist:
+                     id_idx = display_cols_hist.index('ID_Plato')
+                     display_cols_hist.insert(id_idx + 1, display_cols_hist.pop(display_cols_hist.index('Nombre_Plato')))
+                # La tabla muestra las filas más recientes: mandar todo el historial al navegador no escala
+                max_rows_hist = 2000
+                st.dataframe(filtered_history_df[display_cols_hist].head(max_rows_hist))
+                if len(filtered_history_df) > max_rows_hist:
+                    st.caption(f"Mostrando las {max_rows_hist} filas más recientes de {len(filtered_history_df)}. Filtrá por plato o fecha para ver el resto.")
+
+                # --- Visualizaciones del Historial ---
+                # Los gráficos piden a MySQL solo lo que dibujan (history_queries): top-N y foto a la
+                # fecha con ORDER BY / LIMIT en el servidor y series por plato reducidas con LTTB.
+                # `version` (del store) invalida el caché cuando llega un snapshot nuevo.
+                @st.cache_data(max_entries=32)
+                def load_latest_slice_cached(_conn, as_of, plato_key, version):
+                    return get_latest_slice(_conn, as_of, list(plato_key) if plato_key else None)
+
+                @st.cache_data(max_entries=32)
+                def load_top_platos_cached(_conn, as_of, plato_key, n, version):
+                    return get_top_platos(_conn, n=n, as_of=as_of, plato_ids=list(plato_key) if plato_key else None)
+
+                @st.cache_data(max_entries=32)
+                def load_plato_series_cached(_conn, plato_key, metric, target_points, version):
+                    return get_plato_series(_conn, list(plato_key), metric=metric, target_points=target_points)
+
+                def with_plot_label(df):
+                    # Asegurar Nombre_Plato para graficos (usar ID si falta)
+                    if df.empty:
+                        return df
+                    df = df.copy()
+                    df['Plot_Label'] = df['Nombre_Plato'].astype(object).fillna(df['ID_Plato'].astype(object))
+                    return df
 
-            # --- Filtros para el historial ---
-            st.subheader("Filtrar Historial")
-            col1, col2 = st.columns(2)
-            with col1:
-                platos_hist = ['Todos'] + sorted(df_history['ID_Plato'].unique())
-                selected_plato_hist = st.selectbox("Selecciona un Plato:", platos_hist, key="hist_plato_select")
-            with col2:
-                fechas_hist = ['Todas'] + sorted(df_history['SnapshotDate'].unique(), reverse=True)
-                selected_fecha_hist = st.selectbox("Selecciona una Fecha (Snapshot):", fechas_hist, key="hist_fecha_select")
-
-            # Aplicar filtros al DataFrame del historial
-            filtered_history_df = df_history.copy()
-            if selected_plato_hist != 'Todos':
-                filtered_history_df = filtered_history_df[filtered_history_df['ID_Plato'] == selected_plato_hist]
-            if selected_fecha_hist != 'Todas':
-                filtered_history_df = filtered_history_df[filtered_history_df['SnapshotDate'] == selected_fecha_hist]
-
-
-            st.subheader("Datos Históricos Filtrados")
-            # Mostrar Timestamp formateado
-            display_cols_hist = [col for col in filtered_history_df.columns if col not in ['SnapshotTimestampDT', 'SnapshotDate']]
-            # Reordenar columnas si Nombre_Plato existe
-            if 'Nombre_Plato' in display_cols_hist:
-                 id_idx = display_cols_hist.index('ID_Plato')
-                 display_cols_hist.insert(id_idx + 1, display_cols_hist.pop(display_cols_hist.index('Nombre_Plato')))
-            st.dataframe(filtered_history_df[display_cols_hist])
-
-            # --- Visualizaciones del Historial ---
-            if not filtered_history_df.empty:
-                st.subheader("Visualizaciones (Basadas en datos filtrados)")
-                # Usar solo los datos del último snapshot disponible en el set filtrado
                 if not filtered_history_df.empty:
-                    last_snapshot_time_dt = filtered_history_df['SnapshotTimestampDT'].max()
-                    df_last_snap = filtered_history_df[filtered_history_df['SnapshotTimestampDT'] == last_snapshot_time_dt].copy() # Usar .copy()
-                    last_snapshot_time_str = last_snapshot_time_dt.strftime('%Y-%m-%d %H:%M:%S') if pd.notna(last_snapshot_time_dt) else "N/A"
-
-                    # Asegurar Nombre_Plato para graficos (usar ID si falta)
-                    df_last_snap['Plot_Label'] = df_last_snap['Nombre_Plato'].fillna(df_last_snap['ID_Plato'])
-
-
-                    tab1, tab2 = st.tabs(["Margen Bruto %", "Costos vs Precios"])
-
-                    with tab1:
-                        if not df_last_snap.empty:
-                            fig1 = px.bar(
-                                df_last_snap.sort_values('Porcentaje_Margen_Bruto_PctMBA_Hist', ascending=False).head(15), # Mostrar más?
-                                x='Plot_Label', # Usar etiqueta combinada
-                                y='Porcentaje_Margen_Bruto_PctMBA_Hist',
-                                title=f"Top Platos por Margen Bruto (%) - Snapshot {last_snapshot_time_str}",
-                                labels={'Porcentaje_Margen_Bruto_PctMBA_Hist': 'Margen Bruto (%)', 'Plot_Label': 'Plato'},
-                                color='Porcentaje_Margen_Bruto_PctMBA_Hist',
-                                color_continuous_scale=px.colors.sequential.Blues_r, # Invertido
-                                text_auto='.1%'
-                            )
-                            fig1.update_layout(yaxis_tickformat=".0%")
-                            st.plotly_chart(fig1, use_container_width=True)
-                        else: st.info("No hay datos del último snapshot filtrado para graficar.")
-
-                    with tab2:
-                        if not df_last_snap.empty:
-                            # Ajuste para tamaño no negativo
-                            df_last_snap['Size_For_Plot'] = df_last_snap['Margen_Bruto_Actual_MBA_Hist'].clip(lower=0).fillna(0) # Asegura no negativos y no NaN
-
-                            fig2 = px.scatter(
-                                df_last_snap,
-                                x='Costo_Plato_Hist', y='Precio_Competencia_Hist',
-                                hover_name='Plot_Label', # Usar etiqueta combinada
-                                size='Size_For_Plot', # Usar tamaño ajustado
-                                color='Porcentaje_Margen_Bruto_PctMBA_Hist',
-                                color_continuous_scale=px.colors.sequential.Viridis,
-                                title=f"Relación Costo vs Precio Competencia - Snapshot {last_snapshot_time_str}",
-                                labels={
-                                    'Costo_Plato_Hist': 'Costo del Plato ($)',
-                                    'Precio_Competencia_Hist': 'Precio de Competencia ($)',
-                                    'Size_For_Plot': 'Margen Bruto ($) (Tamaño >= 0)', # Etiqueta actualizada
-                                    'Porcentaje_Margen_Bruto_PctMBA_Hist': 'Margen Bruto (%)',
-                                    'Plot_Label': 'Plato'
-                                }
+                    st.subheader("Visualizaciones (Basadas en datos filtrados)")
+                    # Estado de los platos al último snapshot del set filtrado: con snapshots delta
+                    # cada snapshot trae solo los cambios, así que se toma la última fila de cada
+                    # plato hasta ese momento (ver financial_history.get_financials_as_of)
+                    if not filtered_history_df.empty:
+                        last_snapshot_time_dt = filtered_history_df['SnapshotTimestampDT'].max()
+                        last_snapshot_time_str = last_snapshot_time_dt.strftime('%Y-%m-%d %H:%M:%S') if pd.notna(last_snapshot_time_dt) else "N/A"
+                        plato_key = (selected_plato_hist,) if selected_plato_hist != 'Todos' else None
+                        as_of_hist = last_snapshot_time_dt.to_pydatetime()
+                        try:
+                            df_last_snap = with_plot_label(load_latest_slice_cached(conn, as_of_hist, plato_key, history_store.version))
+                            df_top_snap = with_plot_label(load_top_platos_cached(conn, as_of_hist, plato_key, 15, history_store.version))
+                        except Exception as e:
+                            st.error(f"Error al consultar el historial: {e}")
+                            df_last_snap = df_top_snap = pd.DataFrame()
+
+                        tab1, tab2, tab3 = st.tabs(["Margen Bruto %", "Costos vs Precios", "Margen en el tiempo"])
+
+                        with tab1:
+                            if not df_top_snap.empty:
+                                fig1 = px.bar(
+                                    df_top_snap, # Top 15 ya ordenado en MySQL
+                                    x='Plot_Label', # Usar etiqueta combinada
+                                    y='Porcentaje_Margen_Bruto_PctMBA_Hist',
+                                    title=f"Top Platos por Margen Bruto (%) - Snapshot {last_snapshot_time_str}",
+                                    labels={'Porcentaje_Margen_Bruto_PctMBA_Hist': 'Margen Bruto (%)', 'Plot_Label': 'Plato'},
+                                    color='Porcentaje_Margen_Bruto_PctMBA_Hist',
+                                    color_continuous_scale=px.colors.sequential.Blues_r, # Invertido
+                                    text_auto='.1%'
+                                )
+                                fig1.update_layout(yaxis_tickformat=".0%")
+                                st.plotly_chart(fig1, use_container_width=True)
+                            else: st.info("No hay datos del último snapshot filtrado para graficar.")
+
+                        with tab2:
+                            if not df_last_snap.empty:
+                                # Ajuste para tamaño no negativo
+                                df_last_snap['Size_For_Plot'] = pd.to_numeric(df_last_snap['Margen_Bruto_Actual_MBA_Hist'], errors='coerce').clip(lower=0).fillna(0) # Asegura no negativos y no NaN
+
+                                fig2 = px.scatter(
+                                    df_last_snap,
+                                    x='Costo_Plato_Hist', y='Precio_Competencia_Hist',
+                                    hover_name='Plot_Label', # Usar etiqueta combinada
+                                    size='Size_For_Plot', # Usar tamaño ajustado
+                                    color='Porcentaje_Margen_Bruto_PctMBA_Hist',
+                                    color_continuous_scale=px.colors.sequential.Viridis,
+                                    title=f"Relación Costo vs Precio Competencia - Snapshot {last_snapshot_time_str}",
+                                    labels={
+                                        'Costo_Plato_Hist': 'Costo del Plato ($)',
+                                        'Precio_Competencia_Hist': 'Precio de Competencia ($)',
+                                        'Size_For_Plot': 'Margen Bruto ($) (Tamaño >= 0)', # Etiqueta actualizada
+                                        'Porcentaje_Margen_Bruto_PctMBA_Hist': 'Margen Bruto (%)',
+                                        'Plot_Label': 'Plato'
+                                    }
+                                )
+                                fig2.update_layout(coloraxis_colorbar_tickformat=".0%")
+                                st.plotly_chart(fig2, use_container_width=True)
+                            else: st.info("No hay datos del último snapshot filtrado para graficar.")
+
+                        with tab3:
+                            # Por defecto: el plato filtrado o los 5 de mayor margen
+                            default_series = [selected_plato_hist] if selected_plato_hist != 'Todos' else (
+                                df_top_snap['ID_Plato'].astype(str).head(5).tolist() if not df_top_snap.empty else []
                             )
-                            fig2.update_layout(coloraxis_colorbar_tickformat=".0%")
-                            st.plotly_chart(fig2, use_container_width=True)
-                        else: st.info("No hay datos del último snapshot filtrado para graficar.")
-                else:
-                    st.info("No hay datos históricos filtrados para visualizar.")
+                            col_s1, col_s2, col_s3 = st.columns([3, 2, 1])
+                            with col_s1:
+                                series_platos = st.multiselect("Platos:", platos_hist[1:], default=[p for p in default_series if p in platos_hist], key="hist_series_platos")
+                            with col_s2:
+                                series_metric = st.selectbox("Métrica:", list(HISTORY_METRICS), format_func=HISTORY_METRICS.get, key="hist_series_metric")
+                            with col_s3:
+                                series_points = st.number_input("Puntos por plato:", min_value=20, max_value=2000, value=DEFAULT_TARGET_POINTS, step=20, key="hist_series_points")
+                            if series_platos:
+                                try:
+                                    df_series = load_plato_series_cached(conn, tuple(sorted(series_platos)), series_metric, int(series_points), history_store.version)
+                                except Exception as e:
+                                    st.error(f"Error al consultar series: {e}")
+                                    df_series = pd.DataFrame()
+                                if not df_series.empty:
+                                    labels = dict(zip(df_last_snap['ID_Plato'].astype(str), df_last_snap['Plot_Label'])) if not df_last_snap.empty else {}
+                                    df_series['Plot_Label'] = df_series['ID_Plato'].map(lambda p: labels.get(str(p), p))
+                                    # Con snapshots delta cada punto es un cambio: línea escalonada
+                                    fig3 = px.line(
+                                        df_series, x='SnapshotTimestamp', y=series_metric, color='Plot_Label',
+                                        line_shape='hv', markers=len(df_series) < 500,
+                                        title=f"{HISTORY_METRICS[series_metric]} en el tiempo",
+                                        labels={series_metric: HISTORY_METRICS[series_metric], 'SnapshotTimestamp': 'Fecha', 'Plot_Label': 'Plato'},
+                                    )
+                                    if series_metric == 'Porcentaje_Margen_Bruto_PctMBA_Hist':
+                                        fig3.update_layout(yaxis_tickformat=".0%")
+                                    st.plotly_chart(fig3, use_container_width=True)
+                                    st.caption(f"{len(df_series)} puntos graficados (LTTB, hasta {int(series_points)} por plato).")
+                                else: st.info("No hay historial para los platos seleccionados.")
+                            else: st.info("Seleccioná al menos un plato.")
+                    else:
+                        st.info("No hay datos históricos filtrados para visualizar.")
 
 # ==============================================================================
 # --- SECCIÓN: Análisis de Campañas ---
 # ==============================================================================
 elif option == "Análisis de Campañas":
     st.header("📢 Simulación y Análisis de Campañas")
-    conn = get_connection()
-    if not (conn and conn.is_connected()):
-        status_placeholder.error("Error de conexión a la base de datos.")
-    else:
-        # --- Cargar Datos de Simulación (Cacheado) ---
-        @st.cache_data(ttl=300) # Cachear por 5 minutos
-        def load_simulation_data_cached():
-            _conn = get_connection()
-            if _conn:
-                df = get_campaign_simulation_data(_conn) # Llama a la función del analyzer
+    with page_connection() as conn:
+        if not (conn and conn.is_connected()):
+            status_placeholder.error("Error de conexión a la base de datos.")
+        else:
+            # CAMPAIGNS se edita fuera de la app: tras cambiar campañas, refrescar su simulación
+            # materializada (sube la versión y con ella se invalidan los cachés de abajo)
+            if st.button("Refrescar campañas", key="campaign_refresh_btn", help="Recalcula CAMPAIGN_SIMULATION_MAT desde CAMPAIGNS."):
+                with st.spinner("Refrescando simulación de campañas..."):
+                    success, message = refresh_campaign_simulation(conn)
+                    if success: status_placeholder.success(message)
+                    else: status_placeholder.error(message)
+
+            # --- Cargar Datos de Simulación (Cacheado) ---
+            # Las versiones de las tablas materializadas forman parte de la clave del caché:
+            # cuando un cambio de precios o de parámetros las refresca, se vuelve a calcular.
+            # Los filtros se envían a la fuente (SimulationFilter): cada combinación de filtros
+            # trae solo sus filas y queda cacheada con su propia clave. La simulación se calcula en
+            # memoria (campaign_engine.py), sin el producto cruzado de V_CAMPAIGN_SIMULATION.
+            data_version = (
+                get_materialization_version(conn, "PLATOS_FINANCIALS_MAT"),
+                get_materialization_version(conn, "CAMPAIGN_SIMULATION_MAT"),
+            )
+
+            @st.cache_data(ttl=300) # Cachear por 5 minutos
+            def load_simulation_dimensions_cached(_conn, data_version=None):
+                return get_simulation_dimensions(_conn, source="engine")
+
+            @st.cache_resource(ttl=300)
+            def load_exclusivity_index_cached(_conn, data_version=None):
+                # Conflictos sobre todas las campañas (solo CampaignID, ID_Plato, IsExclusive);
+                # se guarda una copia congelada, no el índice compartido que otras sesiones sincronizan
+                return get_conflict_snapshot(get_exclusivity_membership(_conn, source="engine"))
+
+            @st.cache_resource(ttl=300, max_entries=20)
+            def load_simulation_index_cached(_conn, spec_key, data_version=None):
+                # Una lectura (con los filtros gruesos enviados a la fuente) y un índice por conjunto;
+                # campaña, margen, conflictos y top-N se resuelven después sobre el índice.
+                df = get_campaign_simulation_data(_conn, source="engine", spec=SimulationFilter.from_key(spec_key)) # Llama a la función del analyzer
                 if df is not None and not df.empty:
                     # Aplicar análisis simplificado para obtener flag de conflicto
-                    df_analyzed = analyze_campaigns_simplified(df) # Llama a la función del analyzer
-                    return df_analyzed
+                    df_analyzed = analyze_campaigns_simplified(df, index=load_exclusivity_index_cached(_conn, data_version))
+                    return SimulationIndex(df_analyzed)
                 else:
                     logging.warning("get_campaign_simulation_data devolvió vacío o None.")
-                    return pd.DataFrame() # Devolver vacío si falla la carga
-            logging.error("No se pudo obtener conexión en load_simulation_data_cached.")
-            return pd.DataFrame()
+                    return None
 
-        sim_df_analyzed = load_simulation_data_cached()
+            campaign_dims, category_options = load_simulation_dimensions_cached(conn, data_version)
 
-        if sim_df_analyzed.empty:
-            st.warning("No se pudieron cargar los datos de simulación o no hay campañas/platos elegibles.")
-        else:
-            # --- Filtros Interactivos (en área principal) ---
-            with st.expander("Filtros de Simulación", expanded=True):
-                 # (Mismos filtros que antes: Platform, Campaign, Category, Margin Slider, Conflict Checkbox)
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    platforms = ['Todas'] + sorted(sim_df_analyzed['PlatformName'].unique())
-                    selected_platform = st.selectbox("Plataforma", platforms, key="camp_platform")
-                with col2:
-                    available_campaigns = ['Todas']
-                    temp_df_camp = sim_df_analyzed # Usar df analizado aqui
-                    if selected_platform != 'Todas':
-                         temp_df_camp = sim_df_analyzed[sim_df_analyzed['PlatformName'] == selected_platform]
-                    # Asegurar que CampaignName existe antes de llamar a unique()
-                    if 'CampaignName' in temp_df_camp.columns:
-                         available_campaigns += sorted(temp_df_camp['CampaignName'].unique())
-                    selected_campaign = st.selectbox("Campaña", available_campaigns, key="camp_campaign")
-                with col3:
-                     # Asegurar que Categoria_Plato existe antes de llamar a unique()
-                    if 'Categoria_Plato' in sim_df_analyzed.columns:
-                         categories = ['Todas'] + sorted(sim_df_analyzed['Categoria_Plato'].dropna().unique())
-                    else:
-                         categories = ['Todas']
-                    selected_category = st.selectbox("Categoría Plato", categories, key="camp_category")
-
-                min_margin_pct = st.slider(
-                    "Margen Bruto Mínimo Aceptable (%)",
-                     min_value=-100.0, # Rango fijo para evitar errores si min() es NaN
-                     max_value=100.0,  # Rango fijo
-                     value=0.0, # Por defecto mostrar solo rentables >= 0%
-                     step=1.0,
-                     key="camp_margin_slider"
-                )
-                show_conflicts_filter = st.checkbox("Mostrar Solo Conflictos de Exclusividad", value=False, key="camp_conflict_check")
-
-
-            # --- Aplicar Filtros al DataFrame ---
-            filtered_sim_df = sim_df_analyzed.copy()
-            if selected_platform != 'Todas':
-                filtered_sim_df = filtered_sim_df[filtered_sim_df['PlatformName'] == selected_platform]
-            if selected_campaign != 'Todas' and 'CampaignName' in filtered_sim_df.columns:
-                filtered_sim_df = filtered_sim_df[filtered_sim_df['CampaignName'] == selected_campaign]
-            if selected_category != 'Todas' and 'Categoria_Plato' in filtered_sim_df.columns:
-                filtered_sim_df = filtered_sim_df[filtered_sim_df['Categoria_Plato'] == selected_category]
-
-            # Filtrar por margen solo si la columna existe y es numérica
-            if 'Pct_Margen_Bruto_Campaign' in filtered_sim_df.columns:
-                 filtered_sim_df['Pct_Margen_Bruto_Campaign'] = pd.to_numeric(filtered_sim_df['Pct_Margen_Bruto_Campaign'], errors='coerce')
-                 filtered_sim_df = filtered_sim_df[filtered_sim_df['Pct_Margen_Bruto_Campaign'] >= (min_margin_pct / 100.0)]
+            if campaign_dims.empty:
+                st.warning("No se pudieron cargar los datos de simulación o no hay campañas/platos elegibles.")
             else:
-                 st.warning("Columna 'Pct_Margen_Bruto_Campaign' no encontrada para filtrar por margen.")
-
+                # --- Filtros Interactivos (en área principal) ---
+                with st.expander("Filtros de Simulación", expanded=True):
+                     # (Mismos filtros que antes: Platform, Campaign, Category, Margin Slider, Conflict Checkbox)
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        platforms = ['Todas'] + sorted(campaign_dims['PlatformName'].dropna().unique())
+                        selected_platform = st.selectbox("Plataforma", platforms, key="camp_platform")
+                    with col3:
+                        categories = ['Todas'] + category_options
+                        selected_category = st.selectbox("Categoría Plato", categories, key="camp_category")
+
+                    # Plataforma y categoría se envían a la fuente; el resto se resuelve con el índice
+                    spec = SimulationFilter(
+                        platforms=None if selected_platform == 'Todas' else [selected_platform],
+                        categories=None if selected_category == 'Todas' else [selected_category],
+                    )
+                    sim_index = load_simulation_index_cached(conn, spec.key(), data_version)
+
+                    with col2:
+                        available_campaigns = ['Todas']
+                        if sim_index is not None:
+                            available_campaigns += sim_index.campaigns_for(None if selected_platform == 'Todas' else selected_platform)
+                        selected_campaign = st.selectbox("Campaña", available_campaigns, key="camp_campaign")
+
+                    min_margin_pct = st.slider(
+                        "Margen Bruto Mínimo Aceptable (%)",
+                         min_value=-100.0, # Rango fijo para evitar errores si min() es NaN
+                         max_value=100.0,  # Rango fijo
+                         value=0.0, # Por defecto mostrar solo rentables >= 0%
+                         step=1.0,
+                         key="camp_margin_slider"
+                    )
+                    show_conflicts_filter = st.checkbox("Mostrar Solo Conflictos de Exclusividad", value=False, key="camp_conflict_check")
+                    top_n = st.number_input("Mostrar solo el top N por margen (0 = todas)", min_value=0, value=0, step=10, key="camp_top_n")
 
-            if show_conflicts_filter and 'Exclusivity_Conflict' in filtered_sim_df.columns:
-                 filtered_sim_df = filtered_sim_df[filtered_sim_df['Exclusivity_Conflict'] == True]
 
-            # --- GUARDAR RESULTADOS FILTRADOS EN SESSION STATE ---
-            st.session_state['campaign_results'] = filtered_sim_df
-            if not filtered_sim_df.empty:
-                st.success("Resultados del análisis filtrados y listos para consultar en la sección 'Chat con Asistente'.")
-            # --- FIN GUARDAR EN SESSION STATE ---
+                # --- Aplicar Filtros (intersección de posiciones del índice, ya ordenadas por margen) ---
+                if sim_index is None:
+                    filtered_sim_df = pd.DataFrame()
+                else:
+                    filtered_sim_df = sim_index.select(
+                        campaign=None if selected_campaign == 'Todas' else selected_campaign,
+                        min_margin_pct=min_margin_pct / 100.0,
+                        only_conflicts=show_conflicts_filter,
+                        top_n=int(top_n) or None,
+                    )
 
+                # --- GUARDAR RESULTADOS FILTRADOS EN SESSION STATE ---
+                st.session_state['campaign_results'] = filtered_sim_df
+                if not filtered_sim_df.empty:
+                    st.success("Resultados del análisis filtrados y listos para consultar en la sección 'Chat con Asistente'.")
+                # --- FIN GUARDAR EN SESSION STATE ---
 
-            # --- Mostrar Tabla Filtrada ---
-            st.subheader("Resultados de Simulación Filtrados")
-            st.write(f"Mostrando {len(filtered_sim_df)} combinaciones Plato-Campaña.")
-            st.dataframe(
-                filtered_sim_df.sort_values(by='Pct_Margen_Bruto_Campaign', ascending=False) if 'Pct_Margen_Bruto_Campaign' in filtered_sim_df else filtered_sim_df,
-                use_container_width=True
-            )
-            if 'Exclusivity_Conflict' in filtered_sim_df.columns and filtered_sim_df['Exclusivity_Conflict'].any():
-                 st.info("⚠️ Algunos platos mostrados tienen conflictos de exclusividad. Revise antes de generar el brief.")
 
+                # --- Mostrar Tabla Filtrada ---
+                st.subheader("Resultados de Simulación Filtrados")
+                st.write(f"Mostrando {len(filtered_sim_df)} combinaciones Plato-Campaña.")
+                st.dataframe(filtered_sim_df, use_container_width=True) # Ya viene ordenado por margen desde el índice
+                if 'Exclusivity_Conflict' in filtered_sim_df.columns and filtered_sim_df['Exclusivity_Conflict'].any():
+                     st.info("⚠️ Algunos platos mostrados tienen conflictos de exclusividad. Revise antes de generar el brief.")
 
-            # --- Selección para el Brief ---
-            st.subheader("Selección para Generar Brief")
-            st.markdown("Selecciona las combinaciones deseadas para incluir en el archivo CSV del brief.")
 
-            if not filtered_sim_df.empty:
-                if {'CampaignID', 'ID_Plato', 'Nombre_Plato'}.issubset(filtered_sim_df.columns):
-                    filtered_sim_df['SelectionID'] = filtered_sim_df['CampaignID'] + ' | ' + filtered_sim_df['ID_Plato'] + ' (' + filtered_sim_df['Nombre_Plato'].fillna('?') + ')' # Handle potential NaN in Nombre_Plato
-                    options = sorted(filtered_sim_df['SelectionID'].tolist())
+                # --- Selección para el Brief ---
+                st.subheader("Selección para Generar Brief")
+                st.markdown("Selecciona las combinaciones deseadas para incluir en el archivo CSV del brief.")
 
-                    selected_options = st.multiselect(
-                        "Confirmar Selección para Brief:",
-                        options=options,
-                        key="camp_brief_select"
-                    )
+                if not filtered_sim_df.empty:
+                    if {'CampaignID', 'ID_Plato', 'Nombre_Plato'}.issubset(filtered_sim_df.columns):
+                        # Las dimensiones son category: se pasan a str para concatenar
+                        filtered_sim_df['SelectionID'] = filtered_sim_df['CampaignID'].astype(str) + ' | ' + filtered_sim_df['ID_Plato'].astype(str) + ' (' + filtered_sim_df['Nombre_Plato'].astype(str).replace('nan', '?') + ')' # Handle potential NaN in Nombre_Plato
+                        options = sorted(filtered_sim_df['SelectionID'].tolist())
 
-                    # --- Generar Brief ---
-                    if st.button("Generar Brief de Campaña", key="camp_brief_button"):
-                        if selected_options:
-                            final_selection_df = filtered_sim_df[filtered_sim_df['SelectionID'].isin(selected_options)].copy()
-                            output_filename = f"campaign_brief_{date.today()}.csv"
-                            try:
-                                success_brief, message_brief = generate_campaign_brief(final_selection_df, output_filename)
-                                if success_brief:
-                                    with open(output_filename, "rb") as fp:
-                                        st.download_button(
-                                            label="Descargar Brief Generado (CSV)",
-                                            data=fp, file_name=output_filename, mime="text/csv"
-                                        )
-                                    status_placeholder.success(message_brief)
-                                else:
-                                     status_placeholder.error(message_brief)
-                            except Exception as e:
-                                status_placeholder.error(f"Error al generar o descargar el brief: {e}")
-                        else:
-                            status_placeholder.warning("Por favor, selecciona al menos una combinación para generar el brief.")
+                        # --- Sugerencia automática: asignación de máximo margen ---
+                        with st.expander("Sugerir selección óptima"):
+                            st.caption(
+                                "Elige, para cada plato, las campañas que maximizan el margen total respetando la "
+                                "exclusividad, el margen mínimo del filtro y un tope opcional por plataforma."
+                            )
+                            caps = {}
+                            for platform in sorted(filtered_sim_df['PlatformName'].dropna().unique()):
+                                cap = st.number_input(
+                                    f"Máximo de combinaciones en {platform} (0 = sin tope)",
+                                    min_value=0, value=0, step=1, key=f"camp_cap_{platform}"
+                                )
+                                if cap > 0:
+                                    caps[platform] = int(cap)
+                            if st.button("Calcular selección óptima", key="camp_optimize_button"):
+                                try:
+                                    optimal_df = optimize_campaign_assignment(
+                                        filtered_sim_df, platform_caps=caps, min_margin_pct=min_margin_pct / 100.0
+                                    )
+                                    st.session_state['camp_brief_select'] = sorted(optimal_df['SelectionID'].tolist())
+                                    status_placeholder.success(
+                                        f"Selección óptima: {len(optimal_df)} combinaciones, margen total "
+                                        f"${optimal_df['Margen_Bruto_Campaign'].sum():,.2f}."
+                                    )
+                                except Exception as e:
+                                    status_placeholder.error(f"Error calculando la selección óptima: {e}")
+
+                        # Descartar selecciones que ya no están entre las opciones filtradas
+                        if 'camp_brief_select' in st.session_state:
+                            st.session_state['camp_brief_select'] = [
+                                o for o in st.session_state['camp_brief_select'] if o in set(options)
+                            ]
+                        selected_options = st.multiselect(
+                            "Confirmar Selección para Brief:",
+                            options=options,
+                            key="camp_brief_select"
+                        )
+
+                        # --- Generar Brief ---
+                        if st.button("Generar Brief de Campaña", key="camp_brief_button"):
+                            if selected_options:
+                                final_selection_df = filtered_sim_df[filtered_sim_df['SelectionID'].isin(selected_options)].copy()
+                                output_filename = f"campaign_brief_{date.today()}.csv"
+                                try:
+                                    success_brief, message_brief = generate_campaign_brief(final_selection_df, output_filename)
+                                    if success_brief:
+                                        with open(output_filename, "rb") as fp:
+                                            st.download_button(
+                                                label="Descargar Brief Generado (CSV)",
+                                                data=fp, file_name=output_filename, mime="text/csv"
+                                            )
+                                        status_placeholder.success(message_brief)
+                                    else:
+                                         status_placeholder.error(message_brief)
+                                except Exception as e:
+                                    status_placeholder.error(f"Error al generar o descargar el brief: {e}")
+                            else:
+                                status_placeholder.warning("Por favor, selecciona al menos una combinación para generar el brief.")
+                    else:
+                        st.error("Faltan columnas (CampaignID, ID_Plato, Nombre_Plato) en datos filtrados para selección del brief.")
                 else:
-                    st.error("Faltan columnas (CampaignID, ID_Plato, Nombre_Plato) en datos filtrados para selección del brief.")
+                    st.info("No hay datos filtrados disponibles para seleccionar.")
+
+
+# ==============================================================================
+# --- SECCIÓN: Simulador de Escenarios ---
+# ==============================================================================
+elif option == "Simulador de Escenarios":
+    st.header("🧪 Simulador de Escenarios de Precios")
+    st.write("Aplica variaciones porcentuales a los costos de insumos y compara los márgenes de todos los platos, sin modificar la base de datos.")
+    with page_connection() as conn:
+        if not (conn and conn.is_connected()):
+            status_placeholder.error("Error de conexión a la base de datos.")
+        else:
+            try:
+                engine = load_costing_engine(conn, costing_data_version(conn))
+                params = fetch_financial_params(conn)
+                insumos_df = pd.read_sql_query("SELECT ID_Insumo, Nombre_Insumo FROM INSUMOS ORDER BY Nombre_Insumo;", conn)
+            except Exception as e:
+                status_placeholder.error(f"Error al cargar el motor de costeo: {e}")
+                st.stop()
+            if not params:
+                status_placeholder.error("No se encontraron parámetros financieros en FINANCIAL_PARAMS.")
+                st.stop()
+
+            labels = dict(zip(insumos_df['ID_Insumo'], insumos_df['ID_Insumo'] + ' - ' + insumos_df['Nombre_Insumo'].fillna('?')))
+            mode = st.radio("Definir escenarios", ("Editar en pantalla", "Cargar CSV"), horizontal=True, key="scen_mode")
+            scenarios_pct = None
+            if mode == "Editar en pantalla":
+                col1, col2 = st.columns([3, 1])
+                with col1:
+                    selected_insumos = st.multiselect("Insumos a variar", options=list(labels), format_func=labels.get, key="scen_insumos")
+                with col2:
+                    n_scenarios = st.number_input("Cantidad de escenarios", min_value=1, max_value=50, value=3, key="scen_n")
+                if selected_insumos:
+                    st.caption("Variación en % sobre el costo actual (ej: 30 = +30%, -10 = -10%).")
+                    template = pd.DataFrame(0.0, index=[f"Escenario {i + 1}" for i in range(int(n_scenarios))], columns=selected_insumos)
+                    scenarios_pct = st.data_editor(template, use_container_width=True, key="scen_editor")
             else:
-                st.info("No hay datos filtrados disponibles para seleccionar.")
+                st.caption("CSV con una columna 'Escenario' y una columna por ID_Insumo con la variación en %.")
+                uploaded_scen = st.file_uploader("Archivo de escenarios", type="csv", key="scen_upload")
+                if uploaded_scen is not None:
+                    scenarios_pct = pd.read_csv(uploaded_scen).set_index('Escenario')
+
+            if scenarios_pct is not None and st.button("Simular", key="scen_run_btn"):
+                with st.spinner("Simulando escenarios..."):
+                    # "Base" (sin cambios) siempre primero para comparar
+                    multipliers = pd.concat([
+                        pd.DataFrame(1.0, index=["Base"], columns=scenarios_pct.columns),
+                        1 + scenarios_pct.astype(float) / 100.0,
+                    ])
+                    result = simulate_price_shocks(engine, multipliers, params)
+                    st.session_state['scenario_result'] = result
+
+            result = st.session_state.get('scenario_result')
+            if result is not None:
+                st.subheader("Resumen por Escenario")
+                summary = result.summary()
+                st.dataframe(summary, use_container_width=True)
+                fig = px.bar(summary, x='Escenario', y='Pct_Margen_Promedio', title='% Margen Bruto Promedio por Escenario')
+                fig.update_layout(yaxis_tickformat=".1%")
+                st.plotly_chart(fig, use_container_width=True)
+
+                st.subheader("Detalle por Plato")
+                chosen = st.selectbox("Escenario", result.scenario_names[1:] or result.scenario_names, key="scen_detail")
+                detail = result.to_frame([chosen])
+                base = result.to_frame(["Base"])
+                detail['Delta_Margen_vs_Base'] = detail['Margen_Bruto_Actual_MBA'] - base['Margen_Bruto_Actual_MBA']
+                st.dataframe(detail.sort_values('Delta_Margen_vs_Base'), use_container_width=True)
+
+# ==============================================================================
+# --- SECCIÓN: Riesgo de Margen (Monte Carlo) ---
+# ==============================================================================
+elif option == "Riesgo de Margen":
+    st.header("🎲 Riesgo de Margen (Monte Carlo)")
+    st.write("Simula la evolución de los costos de insumos a partir de la volatilidad observada en el historial de snapshots y estima la distribución del margen de cada plato y campaña.")
+    with page_connection() as conn:
+        if not (conn and conn.is_connected()):
+            status_placeholder.error("Error de conexión a la base de datos.")
+        else:
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                n_paths = st.number_input("Caminos simulados", min_value=1000, max_value=100000, value=20000, step=1000, key="risk_paths")
+            with col2:
+                horizon_days = st.number_input("Horizonte (días)", min_value=1, max_value=365, value=30, key="risk_horizon")
+            with col3:
+                include_campaigns = st.checkbox("Incluir campañas", value=True, key="risk_campaigns")
 
+            if st.button("Calcular Riesgo", key="risk_run_btn"):
+                with st.spinner("Simulando caminos de costos..."):
+                    try:
+                        campaigns = get_campaign_simulation_data(conn) if include_campaigns else None
+                        # margin_at_risk cachea por versión de snapshot: repetir el cálculo sin
+                        # nuevos snapshots ni cambios de costos o recetas devuelve el resultado guardado.
+                        st.session_state['risk_result'] = margin_at_risk(
+                            conn, n_paths=int(n_paths), horizon_days=int(horizon_days),
+                            campaigns=campaigns if campaigns is not None and not campaigns.empty else None,
+                        )
+                    except Exception as e:
+                        status_placeholder.error(f"Error al calcular el riesgo de margen: {e}")
+
+            risk_result = st.session_state.get('risk_result')
+            if risk_result is not None:
+                risk_platos, risk_campaigns = risk_result
+                st.subheader("Riesgo por Plato")
+                st.dataframe(risk_platos.sort_values('Prob_Margen_Negativo', ascending=False), use_container_width=True)
+                fig = px.bar(
+                    risk_platos.nlargest(15, 'Prob_Margen_Negativo'), x='ID_Plato', y='Prob_Margen_Negativo',
+                    hover_data=['Nombre_Plato'], title='Platos con Mayor Probabilidad de Margen Negativo'
+                )
+                fig.update_layout(yaxis_tickformat=".0%")
+                st.plotly_chart(fig, use_container_width=True)
+                if not risk_campaigns.empty:
+                    st.subheader("Riesgo por Campaña")
+                    st.dataframe(risk_campaigns.sort_values('Prob_Margen_Negativo', ascending=False), use_container_width=True)
 
 # ==============================================================================
 # --- SECCIÓN: Chat con Asistente ---
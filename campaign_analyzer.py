@@ -1,19 +1,108 @@
 import pandas as pd
-from .db_connection import connect_db # Asumiendo que tienes esta función en db_connection.py
+from db_connection import connect_db, get_pooled_connection # Asumiendo que tienes esta función en db_connection.py
+from materialized_views import materialized_source
+from campaign_engine import CampaignSimulationEngine
+from exclusivity_index import ExclusivityIndex, get_conflict_snapshot
+from simulation_schema import apply_simulation_schema, SimulationSchemaError
+from simulation_filter import SimulationFilter, ALWAYS_COLUMNS as MEMBERSHIP_COLUMNS
 import logging
 
-def get_campaign_simulation_data(conn):
-    """Obtiene los datos de simulación de la vista V_CAMPAIGN_SIMULATION."""
+def _typed(df, spec=None):
+    """Aplica el esquema de columnas (category / float32) una sola vez, al cargar."""
+    try:
+        # Con proyección no están todas las columnas obligatorias: solo se convierten tipos
+        return apply_simulation_schema(df, validate=spec is None or spec.columns is None)
+    except SimulationSchemaError as e:
+        logging.warning(f"{e}. Se devuelven los datos sin validar.")
+        return apply_simulation_schema(df, validate=False)
+
+def get_campaign_simulation_data(conn=None, source="view", spec=None):
+    """
+    Obtiene los datos de simulación plato x campaña.
+    source="view" (por defecto): se leen de V_CAMPAIGN_SIMULATION (o de su tabla materializada
+    CAMPAIGN_SIMULATION_MAT si existe).
+    source="engine": se calculan en memoria con CampaignSimulationEngine (campaign_engine.py),
+    sin armar el producto cruzado en MySQL (lo usa la página de campañas); si falla (ej:
+    CAMPAIGNS sin las columnas esperadas) se lee la vista. La paridad con la vista se controla
+    fuera de la app: snapshot_job.py --verify-campaign-engine.
+    `spec` (SimulationFilter, opcional): plataformas, campañas, categorías, margen mínimo y
+    columnas; se aplica antes de traer los datos (WHERE + proyección, o antes del broadcast).
+    Si no se pasa conexión, se toma una del pool compartido y se devuelve al terminar.
+    """
     logging.info("Obteniendo datos de simulación de campañas...")
+    own_conn = conn is None
     try:
+        if own_conn:
+            conn = get_pooled_connection()
+            if conn is None:
+                return pd.DataFrame()
+        if source == "engine":
+            try:
+                df = CampaignSimulationEngine.from_db(conn).simulate(spec=spec)
+                logging.info(f"Se obtuvieron {len(df)} filas de la simulación (motor en memoria).")
+                return _typed(df, spec)
+            except Exception as e:
+                logging.warning(f"Falló el motor de simulación en memoria, se lee V_CAMPAIGN_SIMULATION: {e}")
         # Usar pandas para leer directamente la query en un DataFrame
-        query = "SELECT * FROM V_CAMPAIGN_SIMULATION;"
-        df = pd.read_sql_query(query, conn)
+        view_source = materialized_source(conn, "V_CAMPAIGN_SIMULATION")
+        query, values = (spec or SimulationFilter()).select_query(view_source)
+        df = pd.read_sql_query(query, conn, params=values or None)
         logging.info(f"Se obtuvieron {len(df)} filas de la simulación.")
-        return df
+        return _typed(df, spec)
     except Exception as e:
         logging.error(f"Error al obtener datos de simulación: {e}")
         return pd.DataFrame() # Devolver DataFrame vacío en caso de error
+    finally:
+        if own_conn and conn is not None:
+            conn.close() # Devuelve la conexión al pool
+
+def get_simulation_dimensions(conn=None, source="view"):
+    """
+    Valores posibles de los filtros sin traer la simulación: DataFrame (PlatformName,
+    CampaignName) y lista de Categoria_Plato. Devuelve (campañas, categorías).
+    """
+    own_conn = conn is None
+    try:
+        if own_conn:
+            conn = get_pooled_connection()
+            if conn is None:
+                return pd.DataFrame(columns=['PlatformName', 'CampaignName']), []
+        if source == "engine":
+            try:
+                campaigns = pd.read_sql_query("SELECT DISTINCT PlatformName, CampaignName FROM CAMPAIGNS;", conn)
+                platos = pd.read_sql_query("SELECT * FROM PLATOS LIMIT 0;", conn)
+                categories = []
+                if 'Categoria_Plato' in platos.columns:
+                    categories = pd.read_sql_query(
+                        "SELECT DISTINCT Categoria_Plato FROM PLATOS WHERE Categoria_Plato IS NOT NULL;", conn
+                    )['Categoria_Plato'].tolist()
+                return campaigns, sorted(categories)
+            except Exception as e:
+                logging.warning(f"No se pudieron leer CAMPAIGNS/PLATOS, se usa V_CAMPAIGN_SIMULATION: {e}")
+        view_source = materialized_source(conn, "V_CAMPAIGN_SIMULATION")
+        campaigns = pd.read_sql_query(f"SELECT DISTINCT PlatformName, CampaignName FROM {view_source};", conn)
+        try:
+            categories = pd.read_sql_query(
+                f"SELECT DISTINCT Categoria_Plato FROM {view_source} WHERE Categoria_Plato IS NOT NULL;", conn
+            )['Categoria_Plato'].tolist()
+        except Exception:
+            categories = []  # la vista no tiene Categoria_Plato
+        return campaigns, sorted(categories)
+    except Exception as e:
+        logging.error(f"Error al obtener los filtros de simulación: {e}")
+        return pd.DataFrame(columns=['PlatformName', 'CampaignName']), []
+    finally:
+        if own_conn and conn is not None:
+            conn.close()
+
+def get_exclusivity_membership(conn=None, source="view"):
+    """
+    Solo (CampaignID, ID_Plato, IsExclusive) de toda la simulación: alcanza para sincronizar
+    el índice de exclusividad, así los conflictos se calculan sobre todas las campañas aunque
+    la página lea datos filtrados. Con source="engine" no se calculan márgenes: las filas se
+    arman directamente desde los arrays de campañas y platos del motor.
+    """
+    return get_campaign_simulation_data(conn, source, SimulationFilter(columns=MEMBERSHIP_COLUMNS))
 
 def analyze_campaigns(simulation_df):
     """Analiza el DataFrame de simulación para ayudar a la decisión."""
@@ -31,17 +120,11 @@ def analyze_campaigns(simulation_df):
     profitable_df = profitable_df.sort_values(by='Pct_Margen_Bruto_Campaign', ascending=False)
 
     # 3. Manejo de Exclusividad (Ejemplo simple: Marcar conflictos)
-    # Encuentra platos que están en campañas exclusivas Y otras campañas
-    exclusive_options = profitable_df[profitable_df['IsExclusive'] == True]
-    non_exclusive_options = profitable_df[profitable_df['IsExclusive'] == False]
+    # Platos que están en campañas exclusivas Y otras campañas (índice de bitmaps, sin merge)
+    index = ExclusivityIndex.from_simulation(profitable_df)
+    conflicting_platos = index.conflicting_platos()
 
-    conflicting_platos = pd.merge(
-        exclusive_options[['ID_Plato']].drop_duplicates(),
-        non_exclusive_options[['ID_Plato']].drop_duplicates(),
-        on='ID_Plato'
-    )['ID_Plato'].unique()
-
-    profitable_df['Exclusivity_Conflict'] = profitable_df['ID_Plato'].isin(conflicting_platos)
+    profitable_df['Exclusivity_Conflict'] = index.conflict_flags(profitable_df['ID_Plato'])
     if len(conflicting_platos) > 0:
          logging.warning(f"Platos con conflictos de exclusividad detectados: {list(conflicting_platos)}")
          # Aquí podrías decidir eliminar las opciones no exclusivas para esos platos,
@@ -55,17 +138,21 @@ def analyze_campaigns(simulation_df):
     logging.info("Análisis de campañas completado.")
     return profitable_df # Devolver el DF analizado
 
-def analyze_campaigns_simplified(simulation_df: pd.DataFrame) -> pd.DataFrame:
+def analyze_campaigns_simplified(simulation_df: pd.DataFrame, index: ExclusivityIndex = None) -> pd.DataFrame:
     """
     Analiza el DataFrame de simulación para añadir una marca de conflicto
     si un plato está en una campaña exclusiva y también en otras.
 
     Args:
-        simulation_df: DataFrame con los datos de V_CAMPAIGN_SIMULATION.
-                       Debe contener 'ID_Plato' y 'IsExclusive'.
+        simulation_df: DataFrame con los datos de simulación plato x campaña.
+                       Debe contener 'CampaignID', 'ID_Plato' y 'IsExclusive'.
+        index: ExclusivityIndex o ConflictSnapshot ya sincronizado (ej: con
+               get_exclusivity_membership), para marcar un DataFrame filtrado según todas las
+               campañas. Por defecto se sincroniza el índice compartido del proceso con
+               `simulation_df` y se usa un ConflictSnapshot tomado bajo su lock.
 
     Returns:
-        El mismo DataFrame con una columna adicional 'Exclusivity_Conflict' (boolean).
+        El mismo DataFrame (sin copiar) con una columna adicional 'Exclusivity_Conflict' (boolean).
     """
     if simulation_df.empty:
         logging.warning("DataFrame de simulación vacío en analyze_campaigns_simplified.")
@@ -75,34 +162,27 @@ def analyze_campaigns_simplified(simulation_df: pd.DataFrame) -> pd.DataFrame:
         return simulation_df
 
     # Asegurarse de que las columnas necesarias existen
-    if 'ID_Plato' not in simulation_df.columns or 'IsExclusive' not in simulation_df.columns:
-        logging.error("Faltan las columnas 'ID_Plato' o 'IsExclusive' en el DataFrame.")
+    if not {'CampaignID', 'ID_Plato', 'IsExclusive'}.issubset(simulation_df.columns):
+        logging.error("Faltan las columnas 'CampaignID', 'ID_Plato' o 'IsExclusive' en el DataFrame.")
         # Añadir columna vacía para consistencia si no existe
         if 'Exclusivity_Conflict' not in simulation_df.columns:
             simulation_df['Exclusivity_Conflict'] = False
         return simulation_df
 
     logging.info("Identificando conflictos de exclusividad...")
-    analyzed_df = simulation_df.copy() # Trabajar sobre una copia
-
-    # Platos que están en al menos una campaña exclusiva
-    exclusive_platos = set(analyzed_df.loc[analyzed_df['IsExclusive'] == True, 'ID_Plato'].unique())
-
-    # Platos que están en al menos una campaña NO exclusiva
-    non_exclusive_platos = set(analyzed_df.loc[analyzed_df['IsExclusive'] == False, 'ID_Plato'].unique())
-
-    # Platos que están en AMBOS grupos (el conflicto)
-    conflicting_platos = exclusive_platos.intersection(non_exclusive_platos)
+    if index is None:
+        index = get_conflict_snapshot(simulation_df)
 
     # Marcar TODAS las filas correspondientes a platos en conflicto
-    analyzed_df['Exclusivity_Conflict'] = analyzed_df['ID_Plato'].isin(conflicting_platos)
+    simulation_df['Exclusivity_Conflict'] = index.conflict_flags(simulation_df['ID_Plato'])
 
-    if conflicting_platos:
-        logging.warning(f"Detectados {len(conflicting_platos)} platos con conflicto de exclusividad.")
+    n_conflicts = int(simulation_df.loc[simulation_df['Exclusivity_Conflict'], 'ID_Plato'].nunique())
+    if n_conflicts:
+        logging.warning(f"Detectados {n_conflicts} platos con conflicto de exclusividad.")
     else:
         logging.info("No se detectaron conflictos de exclusividad.")
 
-    return analyzed_df
+    return simulation_df
 
 # --- Ejemplo de cómo la usarías en app.py ---
 # import campaign_analyzer
@@ -113,10 +193,14 @@ def analyze_campaigns_simplified(simulation_df: pd.DataFrame) -> pd.DataFrame:
 # ... la columna 'Exclusivity_Conflict' te sirve para destacar filas o filtrar ...
 
 def generate_campaign_brief(selected_df, output_file='campaign_brief.csv'):
-    """Genera un archivo CSV con el brief de campaña."""
+    """
+    Genera un archivo CSV con el brief de campaña. Acepta la selección manual o la salida
+    de campaign_optimizer.optimize_campaign_assignment. Devuelve (bool, str).
+    """
     if selected_df.empty:
-        logging.warning("No hay campañas seleccionadas para generar el brief.")
-        return
+        message = "No hay campañas seleccionadas para generar el brief."
+        logging.warning(message)
+        return False, message
 
     logging.info(f"Generando brief de campaña en {output_file}...")
     try:
@@ -128,9 +212,13 @@ def generate_campaign_brief(selected_df, output_file='campaign_brief.csv'):
         brief_df = selected_df[brief_columns].copy()
         brief_df.rename(columns={'Precio_Bruto_Campaign': 'Precio_Final_Publicar'}, inplace=True)
         brief_df.to_csv(output_file, index=False)
-        logging.info("Brief de campaña generado exitosamente.")
+        message = f"Brief de campaña generado exitosamente ({len(brief_df)} combinaciones en {output_file})."
+        logging.info(message)
+        return True, message
     except Exception as e:
-        logging.error(f"Error al generar el brief de campaña: {e}")
+        message = f"Error al generar el brief de campaña: {e}"
+        logging.error(message)
+        return False, message
 
 # --- Ejemplo de cómo usarlo en run_campaign_analysis.py ---
 # if __name__ == "__main__":
@@ -0,0 +1,232 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+# Motor de simulación de campañas en Python: reemplaza el producto cruzado plato x campaña que
+# V_CAMPAIGN_SIMULATION arma dentro de MySQL en cada lectura. Carga una sola vez los platos con
+# su costo, CAMPAIGNS y FINANCIAL_PARAMS, y calcula todas las combinaciones como arrays
+# (campañas x platos) por broadcast.
+#
+# Fórmulas (por campaña c y plato p):
+#   PBA_p                     = market_discount * Precio_Competencia_p   (precio habitual en la plataforma)
+#   Precio_Bruto_Campaign     = PBA_p * (1 - Discount_Pct_c)
+#   Precio_Neto_Campaign      = Precio_Bruto_Campaign / (1 + iva_rate)
+#   Margen_Bruto_Campaign     = Precio_Neto_Campaign - (Costo_Plato_p + Precio_Bruto_Campaign * commission_rate)
+#   Pct_Margen_Bruto_Campaign = Margen_Bruto_Campaign / Precio_Neto_Campaign
+# Discount_Pct se guarda como fracción (0.20 = 20% off).
+# Estas fórmulas y la semántica de CAMPAIGNS (fracción de descuento, todas las campañas aplican
+# a todos los platos) son una reconstrucción de la vista: verify_against_view las compara con
+# V_CAMPAIGN_SIMULATION fuera de la app (snapshot_job.py --verify-campaign-engine).
+# Los platos se leen de V_PLATOS_FINANCIALS (no de PLATOS_FINANCIALS_MAT, que solo se refresca
+# con cambios de precios o parámetros): igual que la vista, el costo refleja las recetas actuales.
+
+CAMPAIGN_FIELDS = ['CampaignID', 'PlatformName', 'CampaignName', 'IsExclusive', 'Discount_Pct']
+
+# Columnas que salen de margin_arrays (las demás se arman con los arrays de campañas y platos)
+MARGIN_COLUMNS = ('Precio_Bruto_Campaign', 'Precio_Neto_Campaign', 'Margen_Bruto_Campaign', 'Pct_Margen_Bruto_Campaign')
+
+# Columnas comparadas contra la vista (la clave es CampaignID + ID_Plato)
+VERIFY_COLUMNS = [
+    'IsExclusive', 'Discount_Pct', 'Costo_Plato', 'Precio_Competencia',
+    'Precio_Bruto_Campaign', 'Precio_Neto_Campaign', 'Margen_Bruto_Campaign', 'Pct_Margen_Bruto_Campaign',
+]
+
+SIMULATION_COLUMNS = [
+    'CampaignID', 'PlatformName', 'CampaignName', 'IsExclusive', 'Discount_Pct',
+    'ID_Plato', 'Nombre_Plato', 'Categoria_Plato', 'Costo_Plato', 'Precio_Competencia',
+    'Precio_Bruto_Campaign', 'Precio_Neto_Campaign', 'Margen_Bruto_Campaign', 'Pct_Margen_Bruto_Campaign',
+]
+
+
+def _categorical(values, rows):
+    """Columna category con values[rows], construida desde códigos enteros."""
+    codes, categories = pd.factorize(values)
+    return pd.Categorical.from_codes(codes[rows], categories=categories)
+
+
+class CampaignSimulationEngine:
+    """
+    Simulación plato x campaña en memoria.
+    `platos`: DataFrame con ID_Plato, Nombre_Plato, Costo_Plato, Precio_Competencia
+    (y opcionalmente Categoria_Plato). `campaigns`: DataFrame con CAMPAIGN_FIELDS.
+    `params`: dict de FINANCIAL_PARAMS.
+    """
+
+    def __init__(self, platos, campaigns, params):
+        precio = pd.to_numeric(platos['Precio_Competencia'], errors='coerce')
+        platos = platos[precio > 0].reset_index(drop=True)
+        self.plato_ids = platos['ID_Plato'].to_numpy(dtype=object)
+        self.plato_names = platos['Nombre_Plato'].to_numpy(dtype=object)
+        self.plato_categories = (
+            platos['Categoria_Plato'].to_numpy(dtype=object) if 'Categoria_Plato' in platos.columns
+            else np.full(len(platos), None, dtype=object)
+        )
+        self.costo = pd.to_numeric(platos['Costo_Plato'], errors='coerce').to_numpy(dtype='float64')
+        self.precio = pd.to_numeric(platos['Precio_Competencia'], errors='coerce').to_numpy(dtype='float64')
+
+        campaigns = campaigns.reset_index(drop=True)
+        self.campaign_ids = campaigns['CampaignID'].to_numpy(dtype=object)
+        self.platform_names = campaigns['PlatformName'].to_numpy(dtype=object)
+        self.campaign_names = campaigns['CampaignName'].to_numpy(dtype=object)
+        self.is_exclusive = campaigns['IsExclusive'].fillna(0).astype(bool).to_numpy()
+        self.discount = pd.to_numeric(campaigns['Discount_Pct'], errors='coerce').fillna(0).to_numpy(dtype='float64')
+
+        self.market_discount = float(params['market_discount'])
+        self.iva_rate = float(params['iva_rate'])
+        self.commission_rate = float(params['commission_rate'])
+        self._plato_pos = {id_: i for i, id_ in enumerate(self.plato_ids)}
+        self._campaign_pos = {id_: i for i, id_ in enumerate(self.campaign_ids)}
+
+    @classmethod
+    def from_db(cls, conn, param_id=1):
+        """
+        Carga platos (costo y precio desde V_PLATOS_FINANCIALS), CAMPAIGNS
+        y el juego `param_id` de FINANCIAL_PARAMS.
+        """
+        platos = pd.read_sql_query(
+            "SELECT ID_Plato, Nombre_Plato, Costo_Plato, Precio_Competencia FROM V_PLATOS_FINANCIALS;", conn
+        )
+        # Categoria_Plato es opcional en PLATOS: se agrega solo si existe (LIMIT 0 trae solo columnas)
+        if 'Categoria_Plato' in pd.read_sql_query("SELECT * FROM PLATOS LIMIT 0;", conn).columns:
+            extra = pd.read_sql_query("SELECT ID_Plato, Categoria_Plato FROM PLATOS;", conn)
+            platos = platos.merge(extra, on='ID_Plato', how='left')
+        campaigns = pd.read_sql_query(f"SELECT {', '.join(CAMPAIGN_FIELDS)} FROM CAMPAIGNS;", conn)
+        params_df = pd.read_sql_query(
+            "SELECT market_discount, iva_rate, commission_rate FROM FINANCIAL_PARAMS WHERE param_id = %s;",
+            conn, params=(param_id,),
+        )
+        if params_df.empty:
+            raise ValueError(f"No existe FINANCIAL_PARAMS con param_id = {param_id}.")
+        return cls(platos, campaigns, params_df.iloc[0].to_dict())
+
+    def _positions(self, ids, pos, kind):
+        if ids is None:
+            return np.arange(len(pos))
+        missing = [i for i in ids if i not in pos]
+        if missing:
+            logging.warning(f"{kind} desconocidos (ignorados): {missing[:50]}")
+        return np.array([pos[i] for i in ids if i in pos], dtype='int64')
+
+    def margin_arrays(self, campaign_ids=None, plato_ids=None):
+        """
+        Arrays (campañas x platos) de Precio_Bruto_Campaign, Precio_Neto_Campaign,
+        Margen_Bruto_Campaign y Pct_Margen_Bruto_Campaign, más las posiciones usadas.
+        """
+        c_idx = self._positions(campaign_ids, self._campaign_pos, "Campañas")
+        p_idx = self._positions(plato_ids, self._plato_pos, "Platos")
+        pba = self.market_discount * self.precio[p_idx]
+        bruto = (1 - self.discount[c_idx])[:, None] * pba[None, :]
+        neto = bruto / (1 + self.iva_rate)
+        margen = neto - (self.costo[p_idx][None, :] + bruto * self.commission_rate)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pct = margen / np.where(neto == 0, np.nan, neto)
+        return {
+            'campaigns': c_idx, 'platos': p_idx,
+            'Precio_Bruto_Campaign': bruto, 'Precio_Neto_Campaign': neto,
+            'Margen_Bruto_Campaign': margen, 'Pct_Margen_Bruto_Campaign': pct,
+        }
+
+    def _spec_positions(self, spec):
+        """Campañas y platos que pasan los filtros de plataforma, campaña y categoría."""
+        c_keep = np.ones(len(self.campaign_ids), dtype=bool)
+        if spec.platforms is not None:
+            c_keep &= np.isin(self.platform_names.astype(str), spec.platforms)
+        if spec.campaigns is not None:
+            c_keep &= np.isin(self.campaign_names.astype(str), spec.campaigns)
+        p_keep = np.ones(len(self.plato_ids), dtype=bool)
+        if spec.categories is not None:
+            p_keep &= np.isin(self.plato_categories.astype(str), spec.categories)
+        return [self.campaign_ids[i] for i in np.flatnonzero(c_keep)], [self.plato_ids[i] for i in np.flatnonzero(p_keep)]
+
+    def simulate(self, campaign_ids=None, plato_ids=None, spec=None):
+        """
+        DataFrame con una fila por (campaña, plato) y las columnas de SIMULATION_COLUMNS,
+        compatibles con lo que espera la página de campañas (ex V_CAMPAIGN_SIMULATION).
+        Con `spec` (SimulationFilter) los filtros se aplican antes de armar el frame: se
+        eligen campañas y platos, se descartan las combinaciones bajo el margen mínimo y
+        solo se construyen las columnas pedidas; si no se pide ninguna medida ni margen mínimo
+        (ej: la pertenencia CampaignID, ID_Plato, IsExclusive), no se calculan los márgenes.
+        """
+        if spec is not None and any(v is not None for v in (spec.platforms, spec.campaigns, spec.categories)):
+            campaign_ids, plato_ids = self._spec_positions(spec)
+        columns = SIMULATION_COLUMNS
+        if spec is not None and spec.columns is not None:
+            columns = [c for c in SIMULATION_COLUMNS if c in spec.columns]
+        if (spec is not None and spec.min_margin_pct is not None) or any(c in MARGIN_COLUMNS for c in columns):
+            arrays = self.margin_arrays(campaign_ids, plato_ids)
+            c_idx, p_idx = arrays['campaigns'], arrays['platos']
+        else:
+            c_idx = self._positions(campaign_ids, self._campaign_pos, "Campañas")
+            p_idx = self._positions(plato_ids, self._plato_pos, "Platos")
+        n_c, n_p = len(c_idx), len(p_idx)
+        if spec is not None and spec.min_margin_pct is not None:
+            ci, pi = np.nonzero(arrays['Pct_Margen_Bruto_Campaign'] >= spec.min_margin_pct)
+            measure = lambda m: arrays[m][ci, pi]
+        else:
+            ci, pi = np.repeat(np.arange(n_c), n_p), np.tile(np.arange(n_p), n_c)
+            measure = lambda m: arrays[m].reshape(-1)
+        rows_c, rows_p = c_idx[ci], p_idx[pi]
+        # Las dimensiones se arman como category directamente desde los códigos (sin
+        # materializar millones de strings); ver simulation_schema.py
+        builders = {
+            'CampaignID': lambda: _categorical(self.campaign_ids, rows_c),
+            'PlatformName': lambda: _categorical(self.platform_names, rows_c),
+            'CampaignName': lambda: _categorical(self.campaign_names, rows_c),
+            'IsExclusive': lambda: self.is_exclusive[rows_c],
+            'Discount_Pct': lambda: self.discount[rows_c],
+            'ID_Plato': lambda: _categorical(self.plato_ids, rows_p),
+            'Nombre_Plato': lambda: _categorical(self.plato_names, rows_p),
+            'Categoria_Plato': lambda: _categorical(self.plato_categories, rows_p),
+            'Costo_Plato': lambda: self.costo[rows_p],
+            'Precio_Competencia': lambda: self.precio[rows_p],
+        }
+        for m in MARGIN_COLUMNS:
+            builders[m] = lambda m=m: measure(m)
+        df = pd.DataFrame({col: builders[col]() for col in columns}, columns=columns)
+        logging.info(f"Simulación de campañas en memoria: {n_c} campañas x {n_p} platos -> {len(df)} filas.")
+        return df
+
+
+def verify_against_view(conn, engine=None, tolerance=1e-4):
+    """
+    Compara la simulación del motor con V_CAMPAIGN_SIMULATION (la vista, no su tabla
+    materializada): mismas combinaciones (CampaignID, ID_Plato) y mismos valores en
+    VERIFY_COLUMNS. Devuelve (bool, mensaje, DataFrame con las diferencias encontradas).
+    """
+    engine = engine or CampaignSimulationEngine.from_db(conn)
+    ours = engine.simulate()
+    theirs = pd.read_sql_query("SELECT * FROM V_CAMPAIGN_SIMULATION;", conn)
+    key = ['CampaignID', 'ID_Plato']
+    for df in (ours, theirs):
+        for col in key:
+            df[col] = df[col].astype(str)
+    columns = [c for c in VERIFY_COLUMNS if c in theirs.columns]
+    merged = ours[key + columns].merge(theirs[key + columns], on=key, how='outer',
+                                       suffixes=('_Motor', '_Vista'), indicator=True)
+    diffs = []
+    missing = merged[merged['_merge'] != 'both']
+    if len(missing):
+        diffs.append(pd.DataFrame({
+            'CampaignID': missing['CampaignID'], 'ID_Plato': missing['ID_Plato'], 'Columna': 'Fila',
+            'Motor': missing['_merge'] != 'right_only', 'Vista_Valor': missing['_merge'] != 'left_only',
+        }))
+    both = merged[merged['_merge'] == 'both']
+    for col in columns:
+        a = pd.to_numeric(both[f'{col}_Motor'].astype(object), errors='coerce').to_numpy(dtype='float64')
+        b = pd.to_numeric(both[f'{col}_Vista'].astype(object), errors='coerce').to_numpy(dtype='float64')
+        bad = (np.isnan(a) != np.isnan(b)) | (np.abs(np.nan_to_num(a) - np.nan_to_num(b)) > tolerance)
+        if bad.any():
+            diffs.append(pd.DataFrame({
+                'CampaignID': both['CampaignID'][bad], 'ID_Plato': both['ID_Plato'][bad], 'Columna': col,
+                'Motor': a[bad], 'Vista_Valor': b[bad],
+            }))
+    diff_df = pd.concat(diffs, ignore_index=True) if diffs else pd.DataFrame(
+        columns=['CampaignID', 'ID_Plato', 'Columna', 'Motor', 'Vista_Valor'])
+    if diff_df.empty:
+        message = f"El motor de campañas coincide con V_CAMPAIGN_SIMULATION ({len(ours)} combinaciones)."
+        logging.info(message)
+        return True, message, diff_df
+    message = f"El motor de campañas difiere de V_CAMPAIGN_SIMULATION en {len(diff_df)} valores."
+    logging.warning(message)
+    return False, message, diff_df
@@ -0,0 +1,198 @@
+import logging
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.optimize import Bounds, LinearConstraint, milp
+
+# Asignación óptima de platos a campañas: para cada plato elige el conjunto de campañas que
+# maximiza el Margen_Bruto_Campaign total, respetando:
+#   - IsExclusive: si un plato entra en una campaña exclusiva, no puede estar en ninguna otra.
+#   - Topes por plataforma: máximo de combinaciones plato-campaña por PlatformName.
+#   - Margen mínimo: se descartan las opciones con Pct_Margen_Bruto_Campaign < min_margin_pct
+#     (y las de margen <= 0, que nunca suman).
+# Dos caminos: ILP exacto (scipy.optimize.milp) para catálogos chicos, y relajación
+# lagrangiana de los topes + reparación greedy, vectorizada, para cientos de miles de opciones.
+# Sin topes por plataforma el problema se separa por plato y el camino rápido es exacto.
+
+ILP_MAX_OPTIONS = 20000
+LAGRANGE_ITERATIONS = 60
+
+
+def _prepare_options(simulation_df, min_margin_pct):
+    margen = pd.to_numeric(simulation_df['Margen_Bruto_Campaign'], errors='coerce')
+    pct = pd.to_numeric(simulation_df['Pct_Margen_Bruto_Campaign'], errors='coerce')
+    keep = (margen > 0) & (pct >= min_margin_pct)
+    options = simulation_df[keep]
+    return options, margen[keep].to_numpy(dtype='float64')
+
+
+def _encode(options, platform_caps):
+    plato_codes, _ = pd.factorize(options['ID_Plato'])
+    platform_codes, platforms = pd.factorize(options['PlatformName'])
+    exclusive = options['IsExclusive'].fillna(False).astype(bool).to_numpy()
+    caps = np.array([
+        (platform_caps or {}).get(p, np.inf) for p in platforms
+    ], dtype='float64')
+    return plato_codes, platform_codes, exclusive, caps
+
+
+def _solve_ilp(margen, plato_codes, platform_codes, exclusive, caps, time_limit=None):
+    """ILP exacto. Devuelve máscara booleana de opciones elegidas."""
+    n = len(margen)
+    rows, cols = [], []
+    n_rows = 0
+    exclusive_idx = np.flatnonzero(exclusive)
+    excl_by_plato = pd.Series(exclusive_idx).groupby(plato_codes[exclusive_idx]).apply(list).to_dict()
+    # Por plato: a lo sumo una exclusiva, y ninguna otra opción si se eligió una exclusiva
+    for plato, excl in excl_by_plato.items():
+        rows.extend([n_rows] * len(excl))
+        cols.extend(excl)
+        n_rows += 1
+    for o in np.flatnonzero(~exclusive):
+        excl = excl_by_plato.get(plato_codes[o])
+        if excl:
+            rows.extend([n_rows] * (len(excl) + 1))
+            cols.extend([o, *excl])
+            n_rows += 1
+    constraints = []
+    if n_rows:
+        A = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n_rows, n))
+        constraints.append(LinearConstraint(A, -np.inf, 1))
+    capped = np.flatnonzero(np.isfinite(caps))
+    if len(capped):
+        sel = np.isin(platform_codes, capped)
+        remap = {k: i for i, k in enumerate(capped)}
+        r = np.array([remap[k] for k in platform_codes[sel]], dtype='int64')
+        A_cap = sparse.csr_matrix((np.ones(sel.sum()), (r, np.flatnonzero(sel))), shape=(len(capped), n))
+        constraints.append(LinearConstraint(A_cap, -np.inf, caps[capped]))
+    options = {'time_limit': time_limit} if time_limit else {}
+    res = milp(-margen, integrality=np.ones(n), bounds=Bounds(0, 1), constraints=constraints, options=options)
+    if res.x is None:
+        raise RuntimeError(f"El ILP no encontró solución: {res.message}")
+    return res.x > 0.5
+
+
+def _group_rank(sorted_codes):
+    """Posición de cada elemento dentro de su grupo, para códigos ya ordenados."""
+    if not len(sorted_codes):
+        return sorted_codes
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    sizes = np.diff(np.r_[starts, len(sorted_codes)])
+    return np.arange(len(sorted_codes)) - np.repeat(starts, sizes)
+
+
+class _Structure:
+    """Ordenamientos que no cambian entre iteraciones (se calculan una vez)."""
+
+    def __init__(self, margen, plato_codes, platform_codes, exclusive):
+        self.n_platos = plato_codes.max() + 1 if len(plato_codes) else 0
+        # exclusivas ordenadas por plato, para reduceat
+        excl_idx = np.flatnonzero(exclusive)
+        self.excl_sorted = excl_idx[np.argsort(plato_codes[excl_idx], kind='stable')]
+        excl_platos = plato_codes[self.excl_sorted]
+        self.excl_starts = np.flatnonzero(np.r_[True, excl_platos[1:] != excl_platos[:-1]]) if len(excl_platos) else excl_platos
+        self.excl_platos = excl_platos[self.excl_starts]
+        # todas las opciones por (plataforma, margen descendente), para recortar y rellenar topes
+        self.by_platform = np.lexsort((-margen, platform_codes))
+
+
+def _best_per_plato(values, plato_codes, exclusive, st):
+    """
+    Solución exacta por plato para márgenes `values` (sin topes): todas las no exclusivas
+    positivas, o la mejor exclusiva si vale más. Devuelve máscara de opciones elegidas.
+    """
+    positive_non = np.where(~exclusive & (values > 0), values, 0.0)
+    sum_non = np.bincount(plato_codes, weights=positive_non, minlength=st.n_platos)
+    best_excl = np.zeros(st.n_platos)
+    best_excl_opt = np.full(st.n_platos, -1, dtype='int64')
+    if len(st.excl_sorted):
+        best_excl[st.excl_platos] = np.maximum.reduceat(values[st.excl_sorted], st.excl_starts)
+        winners = st.excl_sorted[values[st.excl_sorted] == best_excl[plato_codes[st.excl_sorted]]]
+        best_excl_opt[plato_codes[winners]] = winners
+    use_excl = (best_excl > sum_non) & (best_excl > 0)
+    chosen = ~exclusive & (values > 0) & ~use_excl[plato_codes]
+    chosen[best_excl_opt[use_excl]] = True
+    return chosen
+
+
+def _repair(chosen, plato_codes, platform_codes, exclusive, caps, st):
+    """Quita las opciones de menor margen de las plataformas excedidas y rellena el cupo libre."""
+    chosen = chosen.copy()
+    # 1) Recortar plataformas excedidas (se conservan las de mayor margen)
+    order = st.by_platform[chosen[st.by_platform]]
+    rank = _group_rank(platform_codes[order])
+    chosen[order[rank >= caps[platform_codes[order]]]] = False
+    # 2) Rellenar con no exclusivas de platos sin exclusiva elegida, hasta el tope
+    used = np.bincount(platform_codes[chosen], minlength=len(caps))
+    has_excl = np.zeros(st.n_platos, dtype=bool)
+    has_excl[plato_codes[chosen & exclusive]] = True
+    cand = ~chosen & ~exclusive & ~has_excl[plato_codes]
+    order = st.by_platform[cand[st.by_platform]]
+    if len(order):
+        rank = _group_rank(platform_codes[order])
+        room = caps[platform_codes[order]] - used[platform_codes[order]]
+        chosen[order[rank < room]] = True
+    return chosen
+
+
+def _solve_lagrangian(margen, plato_codes, platform_codes, exclusive, caps, iterations=LAGRANGE_ITERATIONS):
+    """Relajación lagrangiana de los topes por plataforma con subgradiente y reparación greedy."""
+    st = _Structure(margen, plato_codes, platform_codes, exclusive)
+    chosen = _best_per_plato(margen, plato_codes, exclusive, st)
+    if not np.isfinite(caps).any():
+        return chosen  # sin topes la solución por plato es óptima
+    capped = np.isfinite(caps)
+    finite_caps = np.where(capped, caps, 0.0)
+    lam = np.zeros(len(caps))
+    best = _repair(chosen, plato_codes, platform_codes, exclusive, caps, st)
+    best_value = margen[best].sum()
+    step0 = float(np.median(margen)) if len(margen) else 0.0
+    for it in range(iterations):
+        chosen = _best_per_plato(margen - lam[platform_codes], plato_codes, exclusive, st)
+        usage = np.bincount(platform_codes[chosen], minlength=len(caps))
+        candidate = _repair(chosen, plato_codes, platform_codes, exclusive, caps, st)
+        value = margen[candidate].sum()
+        if value > best_value:
+            best, best_value = candidate, value
+        violation = np.where(capped, usage - finite_caps, 0.0)
+        if not (violation > 0).any() and (lam[violation < 0] == 0).all():
+            break  # factible y con holguras complementarias: óptimo de la relajación
+        scale = np.maximum(finite_caps, 1.0)
+        lam = np.maximum(0.0, lam + step0 / (it + 1) * violation / scale)
+    return best
+
+
+def optimize_campaign_assignment(simulation_df, platform_caps=None, min_margin_pct=0.0, method="auto",
+                                 time_limit=None):
+    """
+    Elige las combinaciones plato-campaña que maximizan el margen total.
+
+    `simulation_df`: salida de get_campaign_simulation_data (ID_Plato, PlatformName, IsExclusive,
+    Margen_Bruto_Campaign, Pct_Margen_Bruto_Campaign, ...). `platform_caps`: dict
+    {PlatformName: máximo de combinaciones}. `min_margin_pct`: fracción (0.15 = 15%).
+    `method`: "ilp", "greedy" o "auto" (ILP hasta ILP_MAX_OPTIONS opciones con topes).
+    Devuelve las filas elegidas de `simulation_df`, listas para generate_campaign_brief.
+    """
+    if simulation_df is None or simulation_df.empty:
+        return pd.DataFrame() if simulation_df is None else simulation_df.iloc[0:0]
+    options, margen = _prepare_options(simulation_df, min_margin_pct)
+    if options.empty:
+        logging.info("No hay opciones plato-campaña que cumplan el margen mínimo.")
+        return options
+    plato_codes, platform_codes, exclusive, caps = _encode(options, platform_caps)
+    if method == "auto":
+        method = "ilp" if np.isfinite(caps).any() and len(options) <= ILP_MAX_OPTIONS else "greedy"
+    if method == "ilp":
+        chosen = _solve_ilp(margen, plato_codes, platform_codes, exclusive, caps, time_limit)
+    elif method == "greedy":
+        chosen = _solve_lagrangian(margen, plato_codes, platform_codes, exclusive, caps)
+    else:
+        raise ValueError(f"Método desconocido: {method}")
+    selected = options[chosen]
+    logging.info(
+        f"Asignación de campañas ({method}): {len(selected)} de {len(options)} opciones, "
+        f"{selected['ID_Plato'].nunique()} platos, margen total {margen[chosen].sum():.2f}."
+    )
+    order = [c for c in ('PlatformName', 'CampaignName', 'ID_Plato') if c in selected.columns]
+    return selected.sort_values(order).reset_index(drop=True)
@@ -8,6 +8,11 @@ class Config:
     DB_USER = os.getenv('DB_USER', 'root')
     DB_PASSWORD = os.getenv('DB_PASSWORD', 'password')
     DB_NAME = os.getenv('DB_NAME', 'atomick')
+
+    # Pool de conexiones (ver db_connection.ConnectionPool)
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
     
     # Rutas de archivos
     INSUMOS_PRICES_FILE = '4-Brief/Gemini/nuevos_precios_insumos.csv'
@@ -0,0 +1,206 @@
+import logging
+from collections import defaultdict
+
+# Propagación incremental de costos: cuando cambia el Costo_Por_Unidad_Uso de algunos insumos,
+# recalcula y persiste solo las columnas de costo cacheadas que dependen de ellos
+# (SUBRECETAS_COMPOSICION -> SUBRECETAS_DEFINICION -> RECETAS_COMPOSICION -> RECETAS_DEFINICION
+#  -> PLATOS, y PLATOS_PACKAGING -> PLATOS). Las fórmulas replican las vistas V_*_COSTOS.
+
+
+class CostDependencyIndex:
+    """
+    Índice de dependencias insumo -> subreceta -> receta -> plato (y insumo -> plato vía packaging),
+    construido a partir de las tablas de composición.
+    """
+
+    def __init__(self, subreceta_rows, receta_rows, plato_rows, packaging_rows):
+        self.insumo_subrecetas = defaultdict(set)
+        self.subreceta_recetas = defaultdict(set)
+        self.insumo_recetas = defaultdict(set)
+        self.receta_platos = defaultdict(set)
+        self.insumo_packaging_platos = defaultdict(set)
+
+        for id_subreceta, id_insumo in subreceta_rows:
+            self.insumo_subrecetas[id_insumo].add(id_subreceta)
+        for id_receta, id_componente, tipo in receta_rows:
+            if tipo == 'Subreceta':
+                self.subreceta_recetas[id_componente].add(id_receta)
+            elif tipo == 'Insumo':
+                self.insumo_recetas[id_componente].add(id_receta)
+        for id_plato, id_receta in plato_rows:
+            if id_receta is not None:
+                self.receta_platos[id_receta].add(id_plato)
+        for id_plato, id_insumo in packaging_rows:
+            self.insumo_packaging_platos[id_insumo].add(id_plato)
+
+    @classmethod
+    def from_db(cls, conn):
+        """Carga las tablas de composición (solo columnas de IDs) y arma el índice."""
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT ID_Subreceta, ID_Insumo FROM SUBRECETAS_COMPOSICION;")
+            subreceta_rows = cursor.fetchall()
+            cursor.execute("SELECT ID_Receta, ID_Componente, Tipo_Componente FROM RECETAS_COMPOSICION;")
+            receta_rows = cursor.fetchall()
+            cursor.execute("SELECT ID_Plato, ID_Receta FROM PLATOS;")
+            plato_rows = cursor.fetchall()
+            cursor.execute("SELECT ID_Plato, ID_Insumo_Packaging FROM PLATOS_PACKAGING;")
+            packaging_rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        return cls(subreceta_rows, receta_rows, plato_rows, packaging_rows)
+
+    def all_insumos(self):
+        return set(self.insumo_subrecetas) | set(self.insumo_recetas) | set(self.insumo_packaging_platos)
+
+    def affected(self, insumo_ids):
+        """Devuelve los IDs alcanzables desde los insumos dados, por nivel."""
+        insumos = set(insumo_ids)
+        subrecetas = set().union(*(self.insumo_subrecetas.get(i, ()) for i in insumos))
+        recetas = set().union(
+            *(self.insumo_recetas.get(i, ()) for i in insumos),
+            *(self.subreceta_recetas.get(s, ()) for s in subrecetas),
+        )
+        platos = set().union(
+            *(self.receta_platos.get(r, ()) for r in recetas),
+            *(self.insumo_packaging_platos.get(i, ()) for i in insumos),
+        )
+        return {'insumos': insumos, 'subrecetas': subrecetas, 'recetas': recetas, 'platos': platos}
+
+
+def _in_clause(values):
+    return ", ".join(["%s"] * len(values))
+
+
+def propagate_cost_changes(conn, insumo_ids, index=None):
+    """
+    Recalcula y persiste las columnas de costo alcanzables desde `insumo_ids`.
+    Debe llamarse después de escribir los nuevos Costo_Por_Unidad_Uso y dentro de la misma
+    transacción (no hace commit: el commit lo hace quien actualizó los precios).
+    Devuelve un dict con la cantidad de subrecetas, recetas y platos recalculados, y en
+    'plato_ids' los IDs de los platos afectados.
+    """
+    insumo_ids = [i for i in dict.fromkeys(insumo_ids) if i is not None]
+    if not insumo_ids:
+        return {'subrecetas': 0, 'recetas': 0, 'platos': 0, 'plato_ids': []}
+    index = index or CostDependencyIndex.from_db(conn)
+    reach = index.affected(insumo_ids)
+    insumos = sorted(reach['insumos'])
+    subrecetas = sorted(reach['subrecetas'])
+    recetas = sorted(reach['recetas'])
+    platos = sorted(reach['platos'])
+
+    cursor = conn.cursor()
+    try:
+        # 1) Líneas de subreceta que usan los insumos modificados
+        cursor.execute(f"""
+            UPDATE SUBRECETAS_COMPOSICION sc
+            JOIN INSUMOS i ON sc.ID_Insumo = i.ID_Insumo
+            SET sc.Costo_Insumo_En_Subreceta = sc.Cantidad_Insumo * i.Costo_Por_Unidad_Uso
+            WHERE sc.ID_Insumo IN ({_in_clause(insumos)});
+        """, insumos)
+
+        # 2) Totales de las subrecetas afectadas (misma fórmula que V_SUBRECETAS_COSTOS)
+        if subrecetas:
+            cursor.execute(f"""
+                UPDATE SUBRECETAS_DEFINICION sd
+                JOIN (
+                    SELECT sc.ID_Subreceta, SUM(sc.Cantidad_Insumo * i.Costo_Por_Unidad_Uso) AS Total
+                    FROM SUBRECETAS_COMPOSICION sc
+                    JOIN INSUMOS i ON sc.ID_Insumo = i.ID_Insumo
+                    WHERE sc.ID_Subreceta IN ({_in_clause(subrecetas)})
+                    GROUP BY sc.ID_Subreceta
+                ) x ON sd.ID_Subreceta = x.ID_Subreceta
+                SET sd.Costo_Total_Subreceta = x.Total,
+                    sd.Costo_Unitario_Subreceta = CASE
+                        WHEN sd.Rendimiento_Produccion IS NULL OR sd.Rendimiento_Produccion = 0 THEN NULL
+                        ELSE x.Total / sd.Rendimiento_Produccion
+                    END;
+            """, subrecetas)
+
+        # 3) Líneas de receta cuyo componente (insumo o subreceta) cambió
+        if recetas:
+            conditions = [f"(rc.Tipo_Componente = 'Insumo' AND rc.ID_Componente IN ({_in_clause(insumos)}))"]
+            if subrecetas:
+                conditions.append(
+                    f"(rc.Tipo_Componente = 'Subreceta' AND rc.ID_Componente IN ({_in_clause(subrecetas)}))"
+                )
+            cursor.execute(f"""
+                UPDATE RECETAS_COMPOSICION rc
+                LEFT JOIN SUBRECETAS_DEFINICION sd
+                    ON rc.Tipo_Componente = 'Subreceta' AND rc.ID_Componente = sd.ID_Subreceta
+                LEFT JOIN INSUMOS i
+                    ON rc.Tipo_Componente = 'Insumo' AND rc.ID_Componente = i.ID_Insumo
+                SET rc.Costo_Componente_En_Receta = rc.Cantidad_Componente * CASE rc.Tipo_Componente
+                        WHEN 'Subreceta' THEN sd.Costo_Unitario_Subreceta
+                        WHEN 'Insumo' THEN i.Costo_Por_Unidad_Uso
+                        ELSE 0
+                    END
+                WHERE {' OR '.join(conditions)};
+            """, insumos + subrecetas)
+
+            # 4) Totales de las recetas afectadas (misma fórmula que V_RECETAS_COSTOS)
+            cursor.execute(f"""
+                UPDATE RECETAS_DEFINICION rd
+                JOIN (
+                    SELECT ID_Receta, SUM(Costo_Componente_En_Receta) AS Total
+                    FROM RECETAS_COMPOSICION
+                    WHERE ID_Receta IN ({_in_clause(recetas)})
+                    GROUP BY ID_Receta
+                ) x ON rd.ID_Receta = x.ID_Receta
+                SET rd.Costo_Total_Receta = x.Total,
+                    rd.Costo_Unitario_Receta = CASE
+                        WHEN rd.Rendimiento_Receta IS NULL OR rd.Rendimiento_Receta = 0 THEN NULL
+                        ELSE x.Total / rd.Rendimiento_Receta
+                    END;
+            """, recetas)
+
+        # 5) Ítems de packaging con insumos modificados
+        cursor.execute(f"""
+            UPDATE PLATOS_PACKAGING pp
+            JOIN INSUMOS i ON pp.ID_Insumo_Packaging = i.ID_Insumo
+            SET pp.Costo_Item_Packaging = pp.Cantidad_Packaging * i.Costo_Por_Unidad_Uso
+            WHERE pp.ID_Insumo_Packaging IN ({_in_clause(insumos)});
+        """, insumos)
+
+        # 6) Costos cacheados de los platos afectados (misma fórmula que V_PLATOS_COSTOS)
+        if platos:
+            cursor.execute(f"""
+                UPDATE PLATOS p
+                LEFT JOIN RECETAS_DEFINICION rd ON p.ID_Receta = rd.ID_Receta
+                LEFT JOIN (
+                    SELECT ID_Plato, SUM(Costo_Item_Packaging) AS Total
+                    FROM PLATOS_PACKAGING
+                    WHERE ID_Plato IN ({_in_clause(platos)})
+                    GROUP BY ID_Plato
+                ) pk ON p.ID_Plato = pk.ID_Plato
+                SET p.Costo_Receta_Base = rd.Costo_Unitario_Receta,
+                    p.Costo_Total_Packaging = COALESCE(pk.Total, 0),
+                    p.Costo_Total_Plato = rd.Costo_Unitario_Receta + COALESCE(pk.Total, 0)
+                WHERE p.ID_Plato IN ({_in_clause(platos)});
+            """, platos + platos)
+    finally:
+        cursor.close()
+
+    counts = {'subrecetas': len(subrecetas), 'recetas': len(recetas), 'platos': len(platos)}
+    logging.info(
+        f"Propagación de costos desde {len(insumos)} insumos: {counts['subrecetas']} subrecetas, "
+        f"{counts['recetas']} recetas, {counts['platos']} platos recalculados."
+    )
+    counts['plato_ids'] = platos
+    return counts
+
+
+def rebuild_all_costs(conn):
+    """
+    Recalcula todas las columnas de costo cacheadas (útil una vez para corregir valores viejos).
+    Hace commit; en caso de error revierte y relanza la excepción.
+    """
+    index = CostDependencyIndex.from_db(conn)
+    try:
+        counts = propagate_cost_changes(conn, sorted(index.all_insumos()), index=index)
+        conn.commit()
+        return counts
+    except Exception:
+        conn.rollback()
+        raise
@@ -0,0 +1,352 @@
+import logging
+from collections import deque
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Motor de costeo en Python: carga una vez las tablas de composición como matrices dispersas
+# (bill of materials) y calcula el costo de todos los platos con unos pocos productos
+# matriz-vector, en lugar de re-agregar las vistas V_SUBRECETAS_COSTOS -> V_RECETAS_COSTOS
+# -> V_PLATOS_COSTOS -> V_PLATOS_FINANCIALS en cada consulta.
+#
+# Semántica de NULL igual a las vistas: SUM ignora los términos NULL y da NULL si todos lo son;
+# rendimiento 0/NULL da costo unitario NULL; el packaging sin costo cuenta como 0.
+#
+# Anidamiento: además de 'Insumo' y 'Subreceta', RECETAS_COMPOSICION acepta componentes
+# de tipo 'Receta' (receta dentro de receta, a cualquier profundidad). Las vistas actuales
+# valúan ese tipo en 0, así que solo en ese caso el motor y las vistas difieren.
+
+TIPO_INSUMO = 'Insumo'
+TIPO_SUBRECETA = 'Subreceta'
+TIPO_RECETA = 'Receta'
+
+FINANCIAL_COLUMNS = [
+    'ID_Plato', 'Nombre_Plato', 'Costo_Plato', 'Precio_Competencia', 'PBA', 'PNA',
+    'COGS_Partner_Actual', 'Comision_Plataforma', 'Costo_Total_CT',
+    'Margen_Bruto_Actual_MBA', 'Porcentaje_Margen_Bruto_PctMBA',
+]
+
+
+class CostGraphCycleError(ValueError):
+    """La composición de recetas tiene un ciclo (una preparación se contiene a sí misma)."""
+
+
+def _num(series):
+    return pd.to_numeric(series, errors='coerce').astype('float64')
+
+
+class CostingEngine:
+    """
+    Grafo de costos como matrices dispersas.
+
+    Nodos "preparación" = subrecetas ('Subreceta', id) y recetas ('Receta', id), en un solo índice.
+    - Q_ins (preparaciones x insumos) y Q_prep (preparaciones x preparaciones): cantidades.
+    - B_ins / B_prep: 1 donde la cantidad no es NULL (para replicar la semántica de SUM en SQL).
+    - P_rec (platos x preparaciones) y Q_pack (platos x insumos): receta base y packaging.
+    Las preparaciones se evalúan por niveles topológicos: un producto matriz-vector por nivel.
+    """
+
+    def __init__(self, insumos, subrecetas_def, subrecetas_comp, recetas_def, recetas_comp, platos, packaging):
+        # --- Insumos ---
+        self.insumo_ids = list(insumos['ID_Insumo'])
+        self._insumo_pos = {id_: i for i, id_ in enumerate(self.insumo_ids)}
+        self.insumo_costs = _num(insumos['Costo_Por_Unidad_Uso']).to_numpy()
+
+        # --- Preparaciones (subrecetas y recetas) ---
+        self.prep_keys = ([(TIPO_SUBRECETA, s) for s in subrecetas_def['ID_Subreceta']]
+                          + [(TIPO_RECETA, r) for r in recetas_def['ID_Receta']])
+        self._prep_pos = {key: i for i, key in enumerate(self.prep_keys)}
+        self.prep_names = (list(subrecetas_def['Nombre_Subreceta']) + list(recetas_def['Nombre_Receta']))
+        self.rendimiento = np.concatenate([
+            _num(subrecetas_def['Rendimiento_Produccion']).to_numpy(),
+            _num(recetas_def['Rendimiento_Receta']).to_numpy(),
+        ])
+
+        n_prep, n_ins = len(self.prep_keys), len(self.insumo_ids)
+        ins_rows, ins_cols, ins_qty = [], [], []
+        prep_rows, prep_cols, prep_qty = [], [], []
+        # Filas de composición que las vistas cuentan aunque valgan 0 (tipo desconocido)
+        self._has_rows = np.zeros(n_prep, dtype=bool)
+        zero_rows = []
+
+        # SUBRECETAS_COMPOSICION: solo insumos existentes (la vista hace JOIN con INSUMOS)
+        for id_sub, id_ins, qty in zip(subrecetas_comp['ID_Subreceta'], subrecetas_comp['ID_Insumo'],
+                                       _num(subrecetas_comp['Cantidad_Insumo'])):
+            row = self._prep_pos.get((TIPO_SUBRECETA, id_sub))
+            col = self._insumo_pos.get(id_ins)
+            if row is None or col is None:
+                continue
+            self._has_rows[row] = True
+            ins_rows.append(row), ins_cols.append(col), ins_qty.append(qty)
+
+        # RECETAS_COMPOSICION: LEFT JOIN a subrecetas/insumos, cualquier otro tipo vale 0
+        for id_rec, id_comp, tipo, qty in zip(recetas_comp['ID_Receta'], recetas_comp['ID_Componente'],
+                                              recetas_comp['Tipo_Componente'],
+                                              _num(recetas_comp['Cantidad_Componente'])):
+            row = self._prep_pos.get((TIPO_RECETA, id_rec))
+            if row is None:
+                continue
+            self._has_rows[row] = True
+            if tipo == TIPO_INSUMO:
+                col = self._insumo_pos.get(id_comp)
+                if col is not None:
+                    ins_rows.append(row), ins_cols.append(col), ins_qty.append(qty)
+            elif tipo in (TIPO_SUBRECETA, TIPO_RECETA):
+                col = self._prep_pos.get((tipo, id_comp))
+                if col is not None:
+                    prep_rows.append(row), prep_cols.append(col), prep_qty.append(qty)
+            elif not np.isnan(qty):
+                zero_rows.append(row)
+
+        ins_qty = np.asarray(ins_qty, dtype='float64')
+        prep_qty = np.asarray(prep_qty, dtype='float64')
+        self.Q_ins = sparse.csr_matrix((np.nan_to_num(ins_qty), (ins_rows, ins_cols)), shape=(n_prep, n_ins))
+        self.B_ins = sparse.csr_matrix(((~np.isnan(ins_qty)).astype('float64'), (ins_rows, ins_cols)),
+                                       shape=(n_prep, n_ins))
+        self.Q_prep = sparse.csr_matrix((np.nan_to_num(prep_qty), (prep_rows, prep_cols)), shape=(n_prep, n_prep))
+        self.B_prep = sparse.csr_matrix(((~np.isnan(prep_qty)).astype('float64'), (prep_rows, prep_cols)),
+                                        shape=(n_prep, n_prep))
+        # Componentes de tipo desconocido: término 0 no NULL en el SUM de la vista
+        self._zero_terms = np.bincount(np.asarray(zero_rows, dtype='int64'), minlength=n_prep).astype('float64')
+
+        self.levels = self._topological_levels()
+
+        # --- Platos ---
+        self.plato_ids = list(platos['ID_Plato'])
+        self.plato_names = list(platos['Nombre_Plato'])
+        self.plato_recetas = list(platos['ID_Receta'])
+        self.precio_competencia = _num(platos['Precio_Competencia']).to_numpy()
+        self._plato_pos = {id_: i for i, id_ in enumerate(self.plato_ids)}
+        n_pl = len(self.plato_ids)
+        rec_cols = [self._prep_pos.get((TIPO_RECETA, r)) for r in self.plato_recetas]
+        rec_rows = [i for i, c in enumerate(rec_cols) if c is not None]
+        self.P_rec = sparse.csr_matrix((np.ones(len(rec_rows)), (rec_rows, [rec_cols[i] for i in rec_rows])),
+                                       shape=(n_pl, n_prep))
+
+        pk_rows, pk_cols, pk_qty = [], [], []
+        for id_pl, id_ins, qty in zip(packaging['ID_Plato'], packaging['ID_Insumo_Packaging'],
+                                      _num(packaging['Cantidad_Packaging'])):
+            row, col = self._plato_pos.get(id_pl), self._insumo_pos.get(id_ins)
+            if row is not None and col is not None:
+                pk_rows.append(row), pk_cols.append(col), pk_qty.append(qty)
+        self.Q_pack = sparse.csr_matrix((np.nan_to_num(np.asarray(pk_qty, dtype='float64')), (pk_rows, pk_cols)),
+                                        shape=(n_pl, n_ins))
+        self._W = None
+
+    @classmethod
+    def from_db(cls, conn):
+        """Carga las tablas de costeo (una consulta por tabla) y arma el motor."""
+        def q(sql):
+            return pd.read_sql_query(sql, conn)
+        engine = cls(
+            insumos=q("SELECT ID_Insumo, Costo_Por_Unidad_Uso FROM INSUMOS;"),
+            subrecetas_def=q("SELECT ID_Subreceta, Nombre_Subreceta, Rendimiento_Produccion FROM SUBRECETAS_DEFINICION;"),
+            subrecetas_comp=q("SELECT ID_Subreceta, ID_Insumo, Cantidad_Insumo FROM SUBRECETAS_COMPOSICION;"),
+            recetas_def=q("SELECT ID_Receta, Nombre_Receta, Rendimiento_Receta FROM RECETAS_DEFINICION;"),
+            recetas_comp=q("SELECT ID_Receta, ID_Componente, Tipo_Componente, Cantidad_Componente FROM RECETAS_COMPOSICION;"),
+            platos=q("SELECT ID_Plato, Nombre_Plato, ID_Receta, Precio_Competencia FROM PLATOS;"),
+            packaging=q("SELECT ID_Plato, ID_Insumo_Packaging, Cantidad_Packaging FROM PLATOS_PACKAGING;"),
+        )
+        logging.info(
+            f"Motor de costeo cargado: {len(engine.insumo_ids)} insumos, {len(engine.prep_keys)} preparaciones "
+            f"({len(engine.levels)} niveles), {len(engine.plato_ids)} platos."
+        )
+        return engine
+
+    def _topological_levels(self):
+        """Kahn sobre Q_prep: devuelve las preparaciones agrupadas por nivel; lanza error si hay ciclo."""
+        n = len(self.prep_keys)
+        deps = self.B_prep.tolil().rows if n else []
+        pending = np.array([len(set(d)) for d in deps], dtype='int64')
+        dependents = [[] for _ in range(n)]
+        for row, cols in enumerate(deps):
+            for col in set(cols):
+                dependents[col].append(row)
+        current = deque(i for i in range(n) if pending[i] == 0)
+        levels, done = [], 0
+        while current:
+            level = np.fromiter(current, dtype='int64')
+            levels.append(level)
+            done += len(level)
+            current = deque()
+            for node in level:
+                for parent in dependents[node]:
+                    pending[parent] -= 1
+                    if pending[parent] == 0:
+                        current.append(parent)
+        if done < n:
+            ciclo = [f"{t}:{i}" for (t, i), p in zip(self.prep_keys, pending) if p > 0]
+            raise CostGraphCycleError(f"Ciclo en la composición de recetas entre: {ciclo[:20]}")
+        return levels
+
+    def _insumo_vector(self, insumo_costs):
+        if insumo_costs is None:
+            return self.insumo_costs
+        if isinstance(insumo_costs, (pd.Series, dict)):
+            costs = self.insumo_costs.copy()
+            for id_, value in dict(insumo_costs).items():
+                pos = self._insumo_pos.get(id_)
+                if pos is not None:
+                    costs[pos] = np.nan if value is None else float(value)
+            return costs
+        costs = np.asarray(insumo_costs, dtype='float64')
+        if costs.shape != self.insumo_costs.shape:
+            raise ValueError(f"Se esperaban {len(self.insumo_ids)} costos de insumo, llegaron {costs.shape}.")
+        return costs
+
+    def preparation_unit_costs(self, insumo_costs=None):
+        """Costo unitario de cada preparación (NaN donde la vista daría NULL)."""
+        c = self._insumo_vector(insumo_costs)
+        c_val, c_ok = np.nan_to_num(c), (~np.isnan(c)).astype('float64')
+        base_sum = self.Q_ins @ c_val
+        base_cnt = self.B_ins @ c_ok + self._zero_terms
+        unit = np.full(len(self.prep_keys), np.nan)
+        for level in self.levels:
+            u_val, u_ok = np.nan_to_num(unit), (~np.isnan(unit)).astype('float64')
+            total = base_sum[level] + self.Q_prep[level] @ u_val
+            count = base_cnt[level] + self.B_prep[level] @ u_ok
+            rend = self.rendimiento[level]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                unit[level] = np.where((count > 0) & (rend != 0) & ~np.isnan(rend), total / rend, np.nan)
+        return unit
+
+    def plato_costs(self, insumo_costs=None):
+        """
+        Costos por plato con las mismas columnas que V_PLATOS_COSTOS.
+        Como la vista, omite los platos cuya receta no existe o no tiene composición.
+        """
+        c = self._insumo_vector(insumo_costs)
+        unit = self.preparation_unit_costs(c)
+        receta_base = self._receta_base(unit)
+        pack_cnt = self.Q_pack.sign() @ (~np.isnan(c)).astype('float64')
+        packaging = np.where(pack_cnt > 0, self.Q_pack @ np.nan_to_num(c), 0.0)
+        df = pd.DataFrame({
+            'ID_Plato': self.plato_ids,
+            'Nombre_Plato': self.plato_names,
+            'ID_Receta': self.plato_recetas,
+            'Costo_Receta_Base': receta_base,
+            'Costo_Packaging_Total': packaging,
+            'Costo_Total_Plato_Calculado': receta_base + packaging,
+        })
+        return df[self.plato_in_view_mask()].reset_index(drop=True)
+
+    def _receta_base(self, unit):
+        has_receta = np.asarray(self.P_rec.sum(axis=1)).ravel() > 0
+        base = self.P_rec @ np.nan_to_num(unit)
+        ok = self.P_rec @ (~np.isnan(unit)).astype('float64')
+        return np.where(has_receta & (ok > 0), base, np.nan)
+
+    def plato_in_view_mask(self):
+        # V_PLATOS_COSTOS hace JOIN con V_RECETAS_COSTOS: la receta debe tener filas de composición
+        return (self.P_rec @ self._has_rows.astype('float64')) > 0
+
+    def insumo_matrix(self):
+        """
+        Matriz aplanada W (platos x insumos): W @ costos_insumo = costo total del plato
+        (tomando NULL como 0). Sirve para simulaciones y sensibilidad sin recorrer el grafo.
+        """
+        if self._W is None:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                inv_rend = np.where((self.rendimiento != 0) & ~np.isnan(self.rendimiento), 1.0 / self.rendimiento, 0.0)
+            scale = sparse.diags(inv_rend)
+            X0 = (scale @ self.Q_ins).tocsr()
+            A = (scale @ self.Q_prep).tocsr()
+            # A es nilpotente (grafo sin ciclos): tantas iteraciones como niveles dan el valor exacto
+            X = X0
+            for _ in range(len(self.levels) - 1):
+                X = (X0 + A @ X).tocsr()
+            self._W = (self.P_rec @ X + self.Q_pack).tocsr()
+        return self._W
+
+    def financials(self, params, insumo_costs=None, precios=None):
+        """
+        Indicadores financieros por plato con las columnas de V_PLATOS_FINANCIALS.
+        `params`: dict con market_discount, iva_rate y commission_rate (como FINANCIAL_PARAMS).
+        `precios`: Serie/dict opcional ID_Plato -> Precio_Competencia para simular otros precios.
+        """
+        costos = self.plato_costs(insumo_costs)
+        precio = pd.Series(self.precio_competencia, index=self.plato_ids)
+        if precios is not None:
+            nuevos = pd.Series(precios, dtype='float64')
+            precio.update(nuevos[nuevos.index.isin(precio.index)])
+        costos['Precio_Competencia'] = precio.reindex(costos['ID_Plato']).to_numpy()
+        costos = costos[costos['Precio_Competencia'] > 0].reset_index(drop=True)
+
+        md = float(params['market_discount'])
+        iva = float(params['iva_rate'])
+        comm = float(params['commission_rate'])
+        costo = costos['Costo_Total_Plato_Calculado'].to_numpy()
+        pba = md * costos['Precio_Competencia'].to_numpy()
+        pna = pba / (1 + iva)
+        pna_safe = np.where(pna == 0, np.nan, pna)
+        ct = costo + pba * comm
+        return pd.DataFrame({
+            'ID_Plato': costos['ID_Plato'],
+            'Nombre_Plato': costos['Nombre_Plato'],
+            'Costo_Plato': costo,
+            'Precio_Competencia': costos['Precio_Competencia'],
+            'PBA': pba,
+            'PNA': pna,
+            'COGS_Partner_Actual': costo / pna_safe,
+            'Comision_Plataforma': comm,
+            'Costo_Total_CT': ct,
+            'Margen_Bruto_Actual_MBA': pna - ct,
+            'Porcentaje_Margen_Bruto_PctMBA': 1 - ct / pna_safe,
+        }, columns=FINANCIAL_COLUMNS)
+
+
+def fetch_financial_params(conn, param_id=1):
+    """Lee un juego de FINANCIAL_PARAMS como dict (None si no existe)."""
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(
+            "SELECT market_discount, iva_rate, commission_rate FROM FINANCIAL_PARAMS WHERE param_id = %s;",
+            (param_id,),
+        )
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+
+
+def verify_against_views(conn, engine=None, tolerance=1e-6):
+    """
+    Compara los resultados del motor con V_PLATOS_COSTOS y V_PLATOS_FINANCIALS.
+    Devuelve (bool, mensaje, DataFrame con las diferencias encontradas).
+    """
+    engine = engine or CostingEngine.from_db(conn)
+    params = fetch_financial_params(conn)
+    if not params:
+        return False, "No se encontraron parámetros financieros en FINANCIAL_PARAMS.", pd.DataFrame()
+
+    checks = [
+        ("V_PLATOS_COSTOS", engine.plato_costs(),
+         pd.read_sql_query("SELECT * FROM V_PLATOS_COSTOS;", conn),
+         ['Costo_Receta_Base', 'Costo_Packaging_Total', 'Costo_Total_Plato_Calculado']),
+        ("V_PLATOS_FINANCIALS", engine.financials(params),
+         pd.read_sql_query("SELECT * FROM V_PLATOS_FINANCIALS;", conn),
+         [c for c in FINANCIAL_COLUMNS if c not in ('ID_Plato', 'Nombre_Plato')]),
+    ]
+    diffs = []
+    for view, ours, theirs, columns in checks:
+        merged = ours.merge(theirs, on='ID_Plato', how='outer', suffixes=('_Motor', '_Vista'), indicator=True)
+        missing = merged[merged['_merge'] != 'both']
+        for _, row in missing.iterrows():
+            diffs.append({'Vista': view, 'ID_Plato': row['ID_Plato'], 'Columna': 'ID_Plato',
+                          'Motor': row['_merge'] != 'right_only', 'Vista_Valor': row['_merge'] != 'left_only'})
+        both = merged[merged['_merge'] == 'both']
+        for col in columns:
+            a = _num(both[f'{col}_Motor']).to_numpy()
+            b = _num(both[f'{col}_Vista']).to_numpy()
+            bad = (np.isnan(a) != np.isnan(b)) | (np.abs(np.nan_to_num(a) - np.nan_to_num(b)) > tolerance)
+            for id_, va, vb in zip(both['ID_Plato'][bad], a[bad], b[bad]):
+                diffs.append({'Vista': view, 'ID_Plato': id_, 'Columna': col, 'Motor': va, 'Vista_Valor': vb})
+
+    diff_df = pd.DataFrame(diffs, columns=['Vista', 'ID_Plato', 'Columna', 'Motor', 'Vista_Valor'])
+    if diff_df.empty:
+        message = f"El motor de costeo coincide con las vistas ({len(engine.plato_ids)} platos)."
+        logging.info(message)
+        return True, message, diff_df
+    message = f"El motor de costeo difiere de las vistas en {len(diff_df)} valores."
+    logging.warning(message)
+    return False, message, diff_df
@@ -1,6 +1,10 @@
 import mysql.connector
 from mysql.connector import Error
+from mysql.connector.errors import PoolError
 import logging
+import queue
+import threading
+import time
 from dotenv import load_dotenv
 import os
 load_dotenv()
@@ -11,6 +15,12 @@ DB_USER = os.getenv('DB_USER', 'root')
 DB_PASSWORD = os.getenv('DB_PASSWORD', 'password')
 DB_NAME = os.getenv('DB_NAME', 'atomick')
 
+# --- Configuración del Pool de Conexiones (config.Config, leída después de load_dotenv) ---
+from config import Config
+DB_POOL_SIZE = Config.DB_POOL_SIZE        # Máximo de conexiones abiertas a la vez
+DB_POOL_RECYCLE = Config.DB_POOL_RECYCLE  # Segundos antes de reabrir una conexión
+DB_POOL_TIMEOUT = Config.DB_POOL_TIMEOUT  # Segundos de espera por una conexión libre
+
 def connect_db():
     """Establece conexión con la base de datos."""
     conn = None
@@ -25,4 +35,160 @@ def connect_db():
         return conn
     except Error as e:
         logging.error(f"Error conectando a MySQL: {e}")
-        return None
\ No newline at end of file
+        return None
+
+
+class PooledConnection:
+    """
+    Envoltorio de una conexión prestada por el pool.
+    Delega todo en la conexión real; close() la devuelve al pool en vez de cerrarla.
+    """
+
+    def __init__(self, pool, cnx, created_at):
+        self._pool = pool
+        self._cnx = cnx
+        self._created_at = created_at
+
+    def __getattr__(self, attr):
+        if self._cnx is None:
+            raise PoolError("La conexión ya fue devuelta al pool.")
+        return getattr(self._cnx, attr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        # Red de seguridad: si el objeto se descarta sin close(), el cupo vuelve al pool.
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """Devuelve la conexión al pool (llamarlo varias veces es seguro)."""
+        cnx, self._cnx = self._cnx, None
+        if cnx is not None:
+            self._pool._release(cnx, self._created_at)
+
+
+class ConnectionPool:
+    """
+    Pool acotado de conexiones MySQL compartido por la app y el job.
+
+    - Como máximo `pool_size` conexiones prestadas a la vez.
+    - Al prestar una conexión se verifica con un ping; si murió (ej: corte por
+      inactividad de Cloud SQL) se descarta y se abre otra.
+    - Las conexiones con más de `recycle` segundos se cierran y se reabren.
+    - Si no hay cupo en `timeout` segundos se lanza PoolError.
+    """
+
+    def __init__(self, pool_size=DB_POOL_SIZE, recycle=DB_POOL_RECYCLE, timeout=DB_POOL_TIMEOUT, **connect_kwargs):
+        if pool_size < 1:
+            raise ValueError("pool_size debe ser al menos 1.")
+        self.pool_size = pool_size
+        self.recycle = recycle
+        self.timeout = timeout
+        self._connect_kwargs = connect_kwargs or {
+            'host': DB_HOST,
+            'user': DB_USER,
+            'password': DB_PASSWORD,
+            'database': DB_NAME,
+        }
+        self._idle = queue.LifoQueue()  # LIFO: reutilizar la conexión más "caliente"
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def _open(self):
+        cnx = mysql.connector.connect(**self._connect_kwargs)
+        logging.info("Pool: nueva conexión a MySQL establecida.")
+        return cnx, time.monotonic()
+
+    @staticmethod
+    def _discard(cnx):
+        try:
+            cnx.close()
+        except Error:
+            pass
+
+    @staticmethod
+    def _is_alive(cnx):
+        try:
+            cnx.ping(reconnect=False)
+            return True
+        except Error:
+            return False
+
+    def get_connection(self, timeout=None):
+        """Presta una conexión sana del pool. Usar con `with` o llamar a close() al terminar."""
+        wait = self.timeout if timeout is None else timeout
+        if not self._slots.acquire(timeout=wait):
+            raise PoolError(f"No hay conexiones libres en el pool tras esperar {wait}s (tamaño {self.pool_size}).")
+        try:
+            while True:
+                try:
+                    cnx, created_at = self._idle.get_nowait()
+                except queue.Empty:
+                    cnx, created_at = self._open()
+                    break
+                if self.recycle and time.monotonic() - created_at > self.recycle:
+                    logging.info("Pool: reciclando conexión por antigüedad.")
+                    self._discard(cnx)
+                    continue
+                if self._is_alive(cnx):
+                    break
+                logging.warning("Pool: conexión muerta descartada en el ping de préstamo.")
+                self._discard(cnx)
+        except BaseException:
+            self._slots.release()
+            raise
+        return PooledConnection(self, cnx, created_at)
+
+    def _release(self, cnx, created_at):
+        try:
+            if cnx.is_connected():
+                # No dejar transacciones abiertas para el próximo usuario de la conexión
+                if cnx.in_transaction:
+                    cnx.rollback()
+                self._idle.put((cnx, created_at))
+            else:
+                self._discard(cnx)
+        except Error as e:
+            logging.warning(f"Pool: conexión descartada al devolverla: {e}")
+            self._discard(cnx)
+        finally:
+            self._slots.release()
+
+    def close_all(self):
+        """Cierra las conexiones ociosas (las prestadas se cierran al devolverse)."""
+        while True:
+            try:
+                cnx, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(cnx)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Devuelve el pool compartido del proceso (se crea en el primer uso)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+def get_pooled_connection(timeout=None):
+    """
+    Presta una conexión del pool compartido.
+    Igual que connect_db(), devuelve None si no se pudo obtener (el error queda en el log).
+    """
+    try:
+        return get_pool().get_connection(timeout=timeout)
+    except Error as e:  # PoolError también hereda de Error
+        logging.error(f"Error obteniendo conexión del pool: {e}")
+        return None
@@ -0,0 +1,284 @@
+import hashlib
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Índice persistente de conflictos de exclusividad: un plato está en conflicto si participa en
+# al menos una campaña exclusiva y en al menos una no exclusiva.
+# Los platos se codifican como enteros (filas) y las campañas como bits; cada plato tiene dos
+# bitmaps de uint64 (campañas exclusivas y no exclusivas) y dos contadores, de modo que:
+#   - agregar, quitar o cambiar IsExclusive de una campaña toca solo su columna de bits,
+#   - "¿está en conflicto?" es una lectura O(1),
+#   - las marcas para una columna ID_Plato se obtienen con un get_indexer vectorizado,
+# sin copiar el DataFrame de simulación ni armar sets de Python en cada rerun de Streamlit.
+# El índice compartido del proceso se modifica en sync(): las lecturas desde otras sesiones
+# usan un ConflictSnapshot tomado bajo el lock (get_conflict_snapshot), que no cambia después.
+
+_ONE = np.uint64(1)
+
+
+class ExclusivityIndex:
+    """Bitmaps plato x campaña separados en exclusivas / no exclusivas, con actualización incremental."""
+
+    def __init__(self, capacity=1024, n_words=1):
+        self.plato_index = pd.Index([], dtype=object)
+        self._plato_ids = []
+        self._excl = np.zeros((capacity, n_words), dtype=np.uint64)
+        self._non = np.zeros((capacity, n_words), dtype=np.uint64)
+        self._excl_count = np.zeros(capacity, dtype=np.int32)
+        self._non_count = np.zeros(capacity, dtype=np.int32)
+        self._conflict = np.zeros(capacity, dtype=bool)
+        self.campaign_slots = {}      # CampaignID -> bit
+        self.campaign_exclusive = {}  # CampaignID -> bool
+        self.campaign_digests = {}    # CampaignID -> huella de sus platos (para detectar cambios en sync)
+        self._free_slots = []
+
+    # --- Construcción ---
+
+    @classmethod
+    def from_simulation(cls, simulation_df):
+        """Arma el índice a partir de filas (CampaignID, ID_Plato, IsExclusive)."""
+        index = cls()
+        index.sync(simulation_df)
+        return index
+
+    def _plato_rows(self, plato_ids):
+        """Posiciones de los platos, agregando los nuevos (creciendo los arrays si hace falta)."""
+        plato_ids = pd.Index(pd.unique(np.asarray(plato_ids, dtype=object)))
+        new = plato_ids.difference(self.plato_index, sort=False) if len(self.plato_index) else plato_ids
+        if len(new):
+            self._plato_ids.extend(new)
+            self.plato_index = pd.Index(self._plato_ids, dtype=object)
+            self._ensure_rows(len(self._plato_ids))
+        return self.plato_index.get_indexer(plato_ids)
+
+    def _ensure_rows(self, n):
+        capacity = len(self._excl_count)
+        if n <= capacity:
+            return
+        new_capacity = max(n, capacity * 2)
+        grow = new_capacity - capacity
+        self._excl = np.vstack([self._excl, np.zeros((grow, self._excl.shape[1]), dtype=np.uint64)])
+        self._non = np.vstack([self._non, np.zeros((grow, self._non.shape[1]), dtype=np.uint64)])
+        self._excl_count = np.concatenate([self._excl_count, np.zeros(grow, dtype=np.int32)])
+        self._non_count = np.concatenate([self._non_count, np.zeros(grow, dtype=np.int32)])
+        self._conflict = np.concatenate([self._conflict, np.zeros(grow, dtype=bool)])
+
+    def _allocate_slot(self):
+        if self._free_slots:
+            return self._free_slots.pop()
+        slot = len(self.campaign_slots)
+        if slot >= self._excl.shape[1] * 64:
+            extra = np.zeros((self._excl.shape[0], self._excl.shape[1]), dtype=np.uint64)
+            self._excl = np.hstack([self._excl, extra])
+            self._non = np.hstack([self._non, extra.copy()])
+        return slot
+
+    def _members(self, slot):
+        word, bit = divmod(slot, 64)
+        n = len(self._plato_ids)
+        bits = (self._excl[:n, word] | self._non[:n, word]) >> np.uint64(bit) & _ONE
+        return np.flatnonzero(bits)
+
+    def _refresh_conflict(self, rows):
+        self._conflict[rows] = (self._excl_count[rows] > 0) & (self._non_count[rows] > 0)
+
+    # --- Actualización incremental ---
+
+    def add_campaign(self, campaign_id, plato_ids, is_exclusive):
+        """Agrega (o reemplaza) una campaña con sus platos."""
+        self._add_rows(campaign_id, self._plato_rows(plato_ids), is_exclusive, _members_digest(plato_ids))
+
+    def _add_rows(self, campaign_id, rows, is_exclusive, digest):
+        if campaign_id in self.campaign_slots:
+            self.remove_campaign(campaign_id)
+        rows = np.unique(rows)
+        slot = self._allocate_slot()
+        word, bit = divmod(slot, 64)
+        mask = _ONE << np.uint64(bit)
+        if is_exclusive:
+            self._excl[rows, word] |= mask
+            self._excl_count[rows] += 1
+        else:
+            self._non[rows, word] |= mask
+            self._non_count[rows] += 1
+        self._refresh_conflict(rows)
+        self.campaign_slots[campaign_id] = slot
+        self.campaign_exclusive[campaign_id] = bool(is_exclusive)
+        self.campaign_digests[campaign_id] = digest
+
+    def remove_campaign(self, campaign_id):
+        """Quita una campaña (sus bits y contadores)."""
+        slot = self.campaign_slots.pop(campaign_id, None)
+        if slot is None:
+            return
+        rows = self._members(slot)
+        word, bit = divmod(slot, 64)
+        clear = ~(_ONE << np.uint64(bit))
+        if self.campaign_exclusive.pop(campaign_id):
+            self._excl[rows, word] &= clear
+            self._excl_count[rows] -= 1
+        else:
+            self._non[rows, word] &= clear
+            self._non_count[rows] -= 1
+        self._refresh_conflict(rows)
+        self.campaign_digests.pop(campaign_id, None)
+        self._free_slots.append(slot)
+
+    def set_exclusive(self, campaign_id, is_exclusive):
+        """Cambia IsExclusive de una campaña moviendo su columna de bits."""
+        is_exclusive = bool(is_exclusive)
+        if campaign_id not in self.campaign_slots or self.campaign_exclusive[campaign_id] == is_exclusive:
+            return
+        slot = self.campaign_slots[campaign_id]
+        rows = self._members(slot)
+        word, bit = divmod(slot, 64)
+        mask = _ONE << np.uint64(bit)
+        source, target = (self._non, self._excl) if is_exclusive else (self._excl, self._non)
+        source[rows, word] &= ~mask
+        target[rows, word] |= mask
+        delta = 1 if is_exclusive else -1
+        self._excl_count[rows] += delta
+        self._non_count[rows] -= delta
+        self._refresh_conflict(rows)
+        self.campaign_exclusive[campaign_id] = is_exclusive
+
+    def sync(self, simulation_df):
+        """
+        Lleva el índice al estado de `simulation_df` tocando solo las campañas que cambiaron:
+        nuevas o con otro conjunto de platos (se cargan), ausentes (se quitan) y con otro
+        IsExclusive (se mueven). Devuelve la cantidad de campañas actualizadas.
+        """
+        if simulation_df.empty:
+            changed = len(self.campaign_slots)
+            for campaign_id in list(self.campaign_slots):
+                self.remove_campaign(campaign_id)
+            return changed
+        codes, campaign_ids = pd.factorize(simulation_df['CampaignID'])
+        sizes = np.bincount(codes, minlength=len(campaign_ids))
+        first = np.unique(codes, return_index=True)[1]
+        exclusive = simulation_df['IsExclusive'].to_numpy()[first].astype(bool)
+        # Huella por campaña de sus platos ordenados: un plato cambiado por otro (misma
+        # cantidad de filas) también recarga la campaña
+        plato_hashes = pd.util.hash_pandas_object(simulation_df['ID_Plato'].astype(object), index=False).to_numpy()
+        by_members = np.lexsort((plato_hashes, codes))
+        bounds = np.r_[0, np.cumsum(sizes)]
+        digests = [hashlib.sha1(plato_hashes[by_members[bounds[c]:bounds[c + 1]]].tobytes()).hexdigest()
+                   for c in range(len(campaign_ids))]
+        changed = 0
+        reload_codes = []
+        for code, campaign_id in enumerate(campaign_ids):
+            if campaign_id not in self.campaign_slots or self.campaign_digests[campaign_id] != digests[code]:
+                reload_codes.append(code)
+            elif self.campaign_exclusive[campaign_id] != exclusive[code]:
+                self.set_exclusive(campaign_id, exclusive[code])
+                changed += 1
+        for campaign_id in set(self.campaign_slots) - set(campaign_ids):
+            self.remove_campaign(campaign_id)
+            changed += 1
+        if reload_codes:
+            # Posiciones de todos los platos de una vez; luego cada campaña es un slice
+            self._plato_rows(simulation_df['ID_Plato'])
+            positions = self.plato_index.get_indexer(simulation_df['ID_Plato'])
+            for code in reload_codes:
+                rows = positions[by_members[bounds[code]:bounds[code + 1]]]
+                self._add_rows(campaign_ids[code], rows, exclusive[code], digests[code])
+            changed += len(reload_codes)
+        if changed:
+            logging.info(f"Índice de exclusividad: {changed} campañas actualizadas, {self.conflict_count()} platos en conflicto.")
+        return changed
+
+    # --- Consultas ---
+
+    def is_conflict(self, plato_id):
+        """O(1): True si el plato está en una campaña exclusiva y en otra no exclusiva."""
+        pos = self.plato_index.get_loc(plato_id) if plato_id in self.plato_index else -1
+        return bool(pos >= 0 and self._conflict[pos])
+
+    def conflict_flags(self, plato_ids):
+        """Marcas de conflicto alineadas con `plato_ids` (array o Serie), sin copiar el DataFrame."""
+        pos = self.plato_index.get_indexer(np.asarray(plato_ids, dtype=object))
+        return np.where(pos >= 0, self._conflict[pos], False)
+
+    def conflicting_platos(self):
+        n = len(self._plato_ids)
+        return [self._plato_ids[i] for i in np.flatnonzero(self._conflict[:n])]
+
+    def conflict_count(self):
+        return int(self._conflict[:len(self._plato_ids)].sum())
+
+    def snapshot(self):
+        """Copia de solo lectura de las marcas de conflicto actuales (ver ConflictSnapshot)."""
+        return ConflictSnapshot(self.plato_index, self._conflict[:len(self._plato_ids)])
+
+    def campaigns_of(self, plato_id):
+        """Campañas (exclusivas, no exclusivas) en las que participa el plato."""
+        pos = self.plato_index.get_loc(plato_id)
+        exclusivas, no_exclusivas = [], []
+        for campaign_id, slot in self.campaign_slots.items():
+            word, bit = divmod(slot, 64)
+            target = exclusivas if self.campaign_exclusive[campaign_id] else no_exclusivas
+            if ((self._excl[pos, word] | self._non[pos, word]) >> np.uint64(bit)) & _ONE:
+                target.append(campaign_id)
+        return exclusivas, no_exclusivas
+
+
+def _members_digest(plato_ids):
+    """Huella de los platos de una campaña (ordenados), igual a la que calcula sync()."""
+    hashes = pd.util.hash_pandas_object(pd.Series(plato_ids, dtype=object), index=False).to_numpy()
+    return hashlib.sha1(np.sort(hashes).tobytes()).hexdigest()
+
+
+class ConflictSnapshot:
+    """
+    Marcas de conflicto congeladas de un ExclusivityIndex: mismas consultas, pero no cambian
+    si otra sesión sincroniza el índice compartido mientras se usan.
+    """
+
+    def __init__(self, plato_index, conflict):
+        self.plato_index = plato_index
+        self._conflict = conflict.copy()
+        self._conflict.setflags(write=False)
+
+    def is_conflict(self, plato_id):
+        pos = self.plato_index.get_loc(plato_id) if plato_id in self.plato_index else -1
+        return bool(pos >= 0 and self._conflict[pos])
+
+    def conflict_flags(self, plato_ids):
+        pos = self.plato_index.get_indexer(np.asarray(plato_ids, dtype=object))
+        return np.where(pos >= 0, self._conflict[pos], False)
+
+    def conflicting_platos(self):
+        return self.plato_index[self._conflict].tolist()
+
+    def conflict_count(self):
+        return int(self._conflict.sum())
+
+
+_shared_index = None
+_shared_lock = threading.Lock()
+
+def get_exclusivity_index(simulation_df=None):
+    """Índice compartido del proceso; si se pasa `simulation_df`, se sincroniza incrementalmente."""
+    global _shared_index
+    with _shared_lock:
+        if _shared_index is None:
+            _shared_index = ExclusivityIndex()
+        if simulation_df is not None:
+            _shared_index.sync(simulation_df)
+        return _shared_index
+
+def get_conflict_snapshot(simulation_df=None):
+    """
+    Como get_exclusivity_index, pero devuelve las marcas de conflicto como ConflictSnapshot
+    tomado bajo el mismo lock que la sincronización: otra sesión no puede cambiarlas en medio.
+    """
+    global _shared_index
+    with _shared_lock:
+        if _shared_index is None:
+            _shared_index = ExclusivityIndex()
+        if simulation_df is not None:
+            _shared_index.sync(simulation_df)
+        return _shared_index.snapshot()
@@ -0,0 +1,191 @@
+import hashlib
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+from costing_engine import CostingEngine
+from materialized_views import bump_version, get_materialization_version
+
+# Índice de exposición insumo -> plato: cantidad efectiva de cada insumo por unidad de plato,
+# ya aplanada a través de subrecetas/recetas y sus rendimientos (Rendimiento_*), más el
+# packaging. Es la matriz W de CostingEngine.insumo_matrix(), guardada en CSR (por plato)
+# y CSC (por insumo) para responder en ambas direcciones sin recorrer el grafo.
+#
+# Las cantidades solo dependen de las tablas de composición, así que el índice se reconstruye
+# únicamente cuando cambia su versión: la fila COMPOSITION de MATERIALIZATION_VERSIONS (una
+# lectura por clave primaria), que sube quien modifica recetas, subrecetas, packaging o la
+# receta de un plato (bump_composition_version, en la misma transacción). Con force=True se
+# compara además un digest completo de las tablas, para cambios hechos sin subir la versión.
+# Los costos y precios, que cambian seguido, se leen frescos en cada consulta.
+
+COMPOSITION_VERSION = "COMPOSITION"
+
+# tabla -> columnas que definen la estructura (se excluyen las columnas de costo cacheadas,
+# que cost_propagation reescribe con cada cambio de precios)
+FINGERPRINT_COLUMNS = {
+    "INSUMOS": ["ID_Insumo"],
+    "SUBRECETAS_DEFINICION": ["ID_Subreceta", "Rendimiento_Produccion"],
+    "SUBRECETAS_COMPOSICION": ["ID_Subreceta", "ID_Insumo", "Cantidad_Insumo"],
+    "RECETAS_DEFINICION": ["ID_Receta", "Rendimiento_Receta"],
+    "RECETAS_COMPOSICION": ["ID_Receta", "ID_Componente", "Tipo_Componente", "Cantidad_Componente"],
+    "PLATOS": ["ID_Plato", "ID_Receta"],
+    "PLATOS_PACKAGING": ["ID_Plato", "ID_Insumo_Packaging", "Cantidad_Packaging"],
+}
+
+
+def bump_composition_version(conn):
+    """
+    Marca la composición como modificada (no hace commit): llamarlo en la transacción que
+    cambia recetas, subrecetas, packaging o PLATOS.ID_Receta. Devuelve la nueva versión.
+    """
+    return bump_version(conn, COMPOSITION_VERSION)
+
+
+def composition_digest(conn):
+    """
+    SHA-256 de las columnas estructurales de las tablas de composición, en orden fijo.
+    Recorre las tablas completas: solo se usa al forzar la verificación (force=True).
+    """
+    digest = hashlib.sha256()
+    for table, columns in FINGERPRINT_COLUMNS.items():
+        df = pd.read_sql_query(f"SELECT {', '.join(columns)} FROM {table} ORDER BY {', '.join(columns)};", conn)
+        digest.update(f"{table}:{len(df)}|".encode())
+        # Valores como texto: el digest no depende de cómo el conector tipa cada columna
+        rows = df.astype(object).where(df.notna(), None).astype(str)
+        digest.update(pd.util.hash_pandas_object(rows, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+class ExposureIndex:
+    """Matriz platos x insumos de cantidades efectivas, con búsqueda por plato y por insumo."""
+
+    def __init__(self, engine, insumo_names=None, version=None, digest=None):
+        self.version = version  # versión COMPOSITION con la que se construyó
+        self.digest = digest
+        self.plato_ids = list(engine.plato_ids)
+        self.plato_names = list(engine.plato_names)
+        self.insumo_ids = list(engine.insumo_ids)
+        self.insumo_names = [(insumo_names or {}).get(i) for i in self.insumo_ids]
+        self._plato_pos = {id_: i for i, id_ in enumerate(self.plato_ids)}
+        self._insumo_pos = {id_: i for i, id_ in enumerate(self.insumo_ids)}
+        W = engine.insumo_matrix()
+        W.eliminate_zeros()
+        self.by_plato = W.tocsr()
+        self.by_insumo = W.tocsc()
+
+    def _plato_row(self, plato_id):
+        pos = self._plato_pos.get(plato_id)
+        if pos is None:
+            raise KeyError(f"Plato desconocido: {plato_id}")
+        return pos
+
+    def _insumo_col(self, insumo_id):
+        pos = self._insumo_pos.get(insumo_id)
+        if pos is None:
+            raise KeyError(f"Insumo desconocido: {insumo_id}")
+        return pos
+
+    def platos_for_insumo(self, insumo_id):
+        """Platos que usan el insumo y su cantidad efectiva (en unidad de uso) por plato."""
+        col = self._insumo_col(insumo_id)
+        start, end = self.by_insumo.indptr[col], self.by_insumo.indptr[col + 1]
+        rows = self.by_insumo.indices[start:end]
+        return pd.DataFrame({
+            'ID_Plato': [self.plato_ids[r] for r in rows],
+            'Nombre_Plato': [self.plato_names[r] for r in rows],
+            'Cantidad_Efectiva': self.by_insumo.data[start:end],
+        })
+
+    def insumos_for_plato(self, plato_id):
+        """Insumos de un plato (recetas, subrecetas y packaging) con su cantidad efectiva."""
+        row = self._plato_row(plato_id)
+        start, end = self.by_plato.indptr[row], self.by_plato.indptr[row + 1]
+        cols = self.by_plato.indices[start:end]
+        return pd.DataFrame({
+            'ID_Insumo': [self.insumo_ids[c] for c in cols],
+            'Nombre_Insumo': [self.insumo_names[c] for c in cols],
+            'Cantidad_Efectiva': self.by_plato.data[start:end],
+        })
+
+    def exposure_table(self):
+        """Todas las relaciones insumo-plato en formato largo."""
+        coo = self.by_plato.tocoo()
+        return pd.DataFrame({
+            'ID_Insumo': np.asarray(self.insumo_ids, dtype=object)[coo.col],
+            'ID_Plato': np.asarray(self.plato_ids, dtype=object)[coo.row],
+            'Cantidad_Efectiva': coo.data,
+        })
+
+    def cost_attribution(self, plato_id, insumo_costs):
+        """
+        Aporte de cada insumo al costo del plato y su participación (0-1).
+        `insumo_costs`: array alineado con insumo_ids (ver fetch_insumo_costs).
+        """
+        df = self.insumos_for_plato(plato_id)
+        cols = [self._insumo_pos[i] for i in df['ID_Insumo']]
+        df['Costo_Por_Unidad_Uso'] = insumo_costs[cols]
+        df['Costo_Aportado'] = df['Cantidad_Efectiva'] * np.nan_to_num(df['Costo_Por_Unidad_Uso'])
+        total = df['Costo_Aportado'].sum()
+        df['Participacion'] = df['Costo_Aportado'] / total if total else np.nan
+        return df.sort_values('Costo_Aportado', ascending=False).reset_index(drop=True)
+
+    def margin_sensitivity(self, insumo_id, insumo_costs, precios, params, pct_change=0.10):
+        """
+        Efecto de subir `pct_change` (0.10 = +10%) el costo del insumo sobre cada plato que lo usa:
+        variación de costo, de Margen_Bruto_Actual_MBA y de Porcentaje_Margen_Bruto_PctMBA.
+        `precios`: array de Precio_Competencia alineado con plato_ids.
+        """
+        df = self.platos_for_insumo(insumo_id)
+        col = self._insumo_col(insumo_id)
+        rows = np.array([self._plato_pos[p] for p in df['ID_Plato']], dtype='int64')
+        delta_costo = df['Cantidad_Efectiva'].to_numpy() * np.nan_to_num(insumo_costs[col]) * pct_change
+        pna = float(params['market_discount']) * precios[rows] / (1 + float(params['iva_rate']))
+        df['Delta_Costo'] = delta_costo
+        df['Delta_MBA'] = -delta_costo
+        with np.errstate(divide='ignore', invalid='ignore'):
+            df['Delta_PctMBA'] = np.where(pna > 0, -delta_costo / pna, np.nan)
+        return df.sort_values('Delta_MBA').reset_index(drop=True)
+
+
+def fetch_insumo_costs(conn, index):
+    """Costo_Por_Unidad_Uso actual alineado con index.insumo_ids (NaN si es NULL)."""
+    df = pd.read_sql_query("SELECT ID_Insumo, Costo_Por_Unidad_Uso FROM INSUMOS;", conn)
+    costs = pd.to_numeric(df['Costo_Por_Unidad_Uso'], errors='coerce')
+    return costs.set_axis(df['ID_Insumo']).reindex(index.insumo_ids).to_numpy(dtype='float64')
+
+
+def fetch_precios_competencia(conn, index):
+    """Precio_Competencia actual alineado con index.plato_ids (NaN si es NULL)."""
+    df = pd.read_sql_query("SELECT ID_Plato, Precio_Competencia FROM PLATOS;", conn)
+    precios = pd.to_numeric(df['Precio_Competencia'], errors='coerce')
+    return precios.set_axis(df['ID_Plato']).reindex(index.plato_ids).to_numpy(dtype='float64')
+
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_exposure_index(conn, force=False):
+    """
+    Devuelve el índice del proceso, reconstruyéndolo solo si cambió la versión COMPOSITION
+    (una lectura por clave primaria por llamada). Con force=True se calcula el digest completo
+    de las tablas de composición y se reconstruye si difiere del índice actual.
+    """
+    global _index
+    version = get_materialization_version(conn, COMPOSITION_VERSION)
+    with _index_lock:
+        if _index is not None and _index.version == version and not force:
+            return _index
+        digest = composition_digest(conn)
+        if _index is not None and _index.digest == digest:
+            _index.version = version
+            return _index
+        engine = CostingEngine.from_db(conn)
+        names = pd.read_sql_query("SELECT ID_Insumo, Nombre_Insumo FROM INSUMOS;", conn)
+        _index = ExposureIndex(engine, dict(zip(names['ID_Insumo'], names['Nombre_Insumo'])), version, digest)
+        logging.info(
+            f"Índice de exposición reconstruido: {_index.by_plato.nnz} relaciones insumo-plato "
+            f"({len(_index.insumo_ids)} insumos, {len(_index.plato_ids)} platos)."
+        )
+        return _index
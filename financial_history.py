@@ -0,0 +1,161 @@
+import logging
+
+import pandas as pd
+from mysql.connector import Error
+
+# Reconstrucción del estado financiero a una fecha a partir de PLATOS_FINANCIALS_HISTORY.
+# Con snapshots delta (ver snapshot_creator.create_financial_snapshot(delta=True)) cada
+# snapshot guarda solo los platos que cambiaron, así que "el estado al momento T" es, por
+# plato, su última fila con SnapshotTimestamp <= T.
+# El MAX(SnapshotTimestamp) ... GROUP BY ID_Plato se resuelve sobre idx_history_plato_time
+# (ID_Plato, SnapshotTimestamp) con un salto por plato, sin recorrer el historial.
+#
+# Un plato que deja de estar en la vista (sin precio de competencia, dado de baja) se marca
+# con una fila "de baja": solo ID_Plato y SnapshotTimestamp, resto NULL. Se reconoce por
+# Precio_Competencia_Hist IS NULL (los snapshots normales siempre tienen precio > 0).
+#
+# Cada juego de FINANCIAL_PARAMS tiene su propia línea de tiempo: las filas llevan Param_Id y
+# todas las lecturas "última fila por plato" se hacen dentro de un mismo Param_Id, sobre
+# idx_history_param_plato_time (Param_Id, ID_Plato, SnapshotTimestamp).
+
+DEFAULT_PARAM_ID = 1  # Juego de FINANCIAL_PARAMS que usa V_PLATOS_FINANCIALS
+
+# Migración de tablas creadas antes de Param_Id: las filas existentes quedan en el juego por
+# defecto (si ya se habían tomado snapshots con otro param_id hay que reasignarlos a mano).
+PARAM_ID_MIGRATION_SQL = f"""
+    ALTER TABLE PLATOS_FINANCIALS_HISTORY
+        ADD COLUMN Param_Id INT NOT NULL DEFAULT {DEFAULT_PARAM_ID} AFTER ID_Plato,
+        ADD INDEX idx_history_param_plato_time (Param_Id, ID_Plato, SnapshotTimestamp);
+"""
+
+# Argumentos: (param_id, as_of, *plato_ids)
+AS_OF_SQL = """
+    SELECT h.*, p.Nombre_Plato
+    FROM PLATOS_FINANCIALS_HISTORY h
+    JOIN (
+        SELECT Param_Id, ID_Plato, MAX(SnapshotTimestamp) AS SnapshotTimestamp
+        FROM PLATOS_FINANCIALS_HISTORY
+        WHERE Param_Id = %s AND SnapshotTimestamp <= %s{plato_filter}
+        GROUP BY Param_Id, ID_Plato
+    ) ultimo ON h.Param_Id = ultimo.Param_Id AND h.ID_Plato = ultimo.ID_Plato
+            AND h.SnapshotTimestamp = ultimo.SnapshotTimestamp
+    LEFT JOIN PLATOS p ON h.ID_Plato = p.ID_Plato
+"""
+
+PARAM_ID_COLUMN_SQL = """
+    SELECT COUNT(*) FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE() AND UPPER(TABLE_NAME) = 'PLATOS_FINANCIALS_HISTORY'
+      AND COLUMN_NAME = 'Param_Id';
+"""
+MIGRATION_HINT = "python snapshot_job.py --migrate-history"
+
+_param_column_checked = False
+
+
+class HistorySchemaError(RuntimeError):
+    """PLATOS_FINANCIALS_HISTORY no tiene la columna Param_Id (falta correr la migración)."""
+
+
+def _has_param_column(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(PARAM_ID_COLUMN_SQL)
+        return bool(cursor.fetchone()[0])
+    finally:
+        cursor.close()
+
+
+def check_history_param_column(conn):
+    """
+    Verifica que PLATOS_FINANCIALS_HISTORY tenga Param_Id (una vez por proceso). Los lectores y
+    escritores del historial la llaman antes de consultar: sin la columna lanzan
+    HistorySchemaError indicando la migración en lugar de fallar con un error de SQL.
+    """
+    global _param_column_checked
+    if _param_column_checked:
+        return
+    if not _has_param_column(conn):
+        message = f"PLATOS_FINANCIALS_HISTORY no tiene la columna Param_Id. Ejecutar la migración: {MIGRATION_HINT}"
+        logging.error(message)
+        raise HistorySchemaError(message)
+    _param_column_checked = True
+
+
+def migrate_history_param_column(conn):
+    """
+    Agrega Param_Id (y su índice) a PLATOS_FINANCIALS_HISTORY si falta. Paso explícito del job
+    (--migrate-history): es DDL (commit implícito en MySQL), no se corre desde la app.
+    Devuelve (bool, str).
+    """
+    global _param_column_checked
+    try:
+        if _has_param_column(conn):
+            message = "PLATOS_FINANCIALS_HISTORY ya tiene la columna Param_Id."
+        else:
+            logging.info("Migrando PLATOS_FINANCIALS_HISTORY: columna Param_Id e índice por juego de parámetros.")
+            cursor = conn.cursor()
+            try:
+                cursor.execute(PARAM_ID_MIGRATION_SQL)
+            finally:
+                cursor.close()
+            message = "PLATOS_FINANCIALS_HISTORY migrada: columna Param_Id e índice idx_history_param_plato_time."
+        _param_column_checked = True
+        logging.info(message)
+        return True, message
+    except Error as e:
+        logging.error(f"No se pudo agregar Param_Id en PLATOS_FINANCIALS_HISTORY: {e}")
+        return False, f"Error de BD al migrar PLATOS_FINANCIALS_HISTORY: {e}"
+
+
+def is_tombstone(df):
+    """Máscara de las filas de baja (plato retirado en ese snapshot)."""
+    return df['Precio_Competencia_Hist'].isna()
+
+
+def _last_rows(df):
+    """Última fila por plato; entre filas con el mismo timestamp gana el SnapshotID mayor."""
+    sort_cols = [c for c in ('SnapshotTimestamp', 'SnapshotID') if c in df.columns]
+    df = df.sort_values(sort_cols).drop_duplicates('ID_Plato', keep='last')
+    return df[~is_tombstone(df)].sort_values('ID_Plato').reset_index(drop=True)
+
+
+def get_financials_as_of(conn, as_of, plato_ids=None, param_id=DEFAULT_PARAM_ID):
+    """
+    Estado de cada plato al momento `as_of` (datetime o string 'YYYY-MM-DD HH:MM:SS'):
+    su última fila de historial con SnapshotTimestamp <= as_of en el juego de parámetros
+    `param_id`. Los platos dados de baja a esa fecha no aparecen. `plato_ids` limita la
+    consulta a esos platos.
+    Devuelve un DataFrame con las columnas de PLATOS_FINANCIALS_HISTORY más Nombre_Plato.
+    """
+    check_history_param_column(conn)
+    args = [param_id, as_of]
+    plato_filter = ""
+    if plato_ids is not None:
+        plato_ids = list(plato_ids)
+        if not plato_ids:
+            return pd.DataFrame()
+        plato_filter = f" AND ID_Plato IN ({', '.join(['%s'] * len(plato_ids))})"
+        args.extend(plato_ids)
+    df = pd.read_sql_query(AS_OF_SQL.format(plato_filter=plato_filter), conn, params=tuple(args))
+    if df.empty:
+        return df
+    state = _last_rows(df)
+    logging.info(f"Estado financiero al {as_of}: {len(state)} platos.")
+    return state
+
+
+def state_as_of(history_df, as_of=None, param_id=DEFAULT_PARAM_ID):
+    """
+    Mismo criterio que get_financials_as_of, sobre un DataFrame de historial ya cargado.
+    Sin `as_of` devuelve el estado más reciente.
+    """
+    if history_df.empty:
+        return history_df
+    df = history_df
+    if 'Param_Id' in df.columns:
+        df = df[df['Param_Id'] == param_id]
+    if as_of is not None:
+        df = df[pd.to_datetime(df['SnapshotTimestamp']) <= pd.Timestamp(as_of)]
+    if df.empty:
+        return df
+    return _last_rows(df)
@@ -0,0 +1,414 @@
+import datetime
+import json
+import logging
+import os
+import uuid
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from mysql.connector import Error
+
+from financial_history import DEFAULT_PARAM_ID, check_history_param_column
+
+# Archivo columnar (Parquet) de PLATOS_FINANCIALS_HISTORY para que la página de historial y los
+# análisis offline no recorran la tabla en MySQL.
+#   <raíz>/month=YYYY-MM/part-<último SnapshotID>-<sufijo>.parquet   archivos de cada mes
+#   <raíz>/manifest.json                                               partes y marca de agua
+# - Se particiona por mes y no por día: con snapshots diarios un archivo por día son miles de
+#   archivos chicos en pocos años y abrirlos cuesta más que leerlos.
+# - Cada lote exportado agrega una parte nueva por mes que toca, sin releer lo ya archivado
+#   (reescribir el mes en cada lote hacía cuadrática la exportación de un mes grande). Al
+#   final de la exportación, un mes con más de MAX_PARTS_PER_MONTH partes se compacta en una
+#   sola: cada mes se reescribe a lo sumo una vez por exportación.
+# - ID_Plato y Nombre_Plato van con codificación de diccionario (en pandas llegan como category)
+#   y las medidas en float64: las columnas son DECIMAL en MySQL y float32 las redondeaba
+#   (573.305 -> 573.30499), con lo que el archivo no coincidía con la tabla.
+# - Dentro de cada archivo las filas se ordenan por (ID_Plato, SnapshotTimestamp) y se guardan
+#   estadísticas por row group, así un filtro por platos salta row groups enteros.
+# - El manifest guarda por parte filas, rangos de SnapshotID / timestamp / ID_Plato, y la
+#   marca de agua last_snapshot_id: la exportación solo lee filas con SnapshotID mayor
+#   (rango sobre la clave primaria). Un snapshot que confirma tarde (la app lo insertaba
+#   mientras corría el job) puede tener un SnapshotID menor que uno ya exportado: por eso cada
+#   exportación vuelve a mirar las filas con SnapshotTimestamp >= recheck_from (inicio de la
+#   exportación anterior menos RECHECK_LAG) y agrega las que falten, comparando SnapshotID con
+#   lo ya archivado. load_history aplica la misma ventana a las filas que lee de MySQL.
+#   Las partes reemplazadas por una compactación se borran después de guardar el manifest,
+#   que es lo único que los lectores consultan.
+# Nombre_Plato es el nombre vigente al momento de archivar.
+# Se archivan todos los juegos de parámetros (columna Param_Id); los lectores filtran uno.
+# El manifest lleva la versión del formato: un archivo de una versión anterior se ignora y la
+# próxima exportación lo regenera desde cero (salvo la 3, que tiene los mismos archivos con
+# una parte por mes y se convierte al leerla).
+
+DEFAULT_ARCHIVE_DIR = os.getenv('HISTORY_ARCHIVE_DIR', 'history_archive')
+MANIFEST_FILE = 'manifest.json'
+ARCHIVE_FORMAT_VERSION = 4  # 2: columna Param_Id; 3: medidas en float64; 4: varias partes por mes
+UPGRADABLE_VERSIONS = {3}
+EXPORT_BATCH_ROWS = 200000
+MAX_PARTS_PER_MONTH = 8
+# Mayor demora esperable entre el timestamp de un snapshot y su commit
+RECHECK_LAG = pd.Timedelta(minutes=int(os.getenv('HISTORY_ARCHIVE_RECHECK_MINUTES', '60')))
+ROW_GROUP_ROWS = 50000
+
+MEASURE_COLUMNS = [
+    'Costo_Plato_Hist', 'Precio_Competencia_Hist', 'Market_Discount_Used', 'IVA_Rate_Used',
+    'Commission_Rate_Used', 'PBA_Hist', 'PNA_Hist', 'COGS_Partner_Actual_Hist', 'Costo_Total_CT_Hist',
+    'Margen_Bruto_Actual_MBA_Hist', 'Porcentaje_Margen_Bruto_PctMBA_Hist',
+]
+ARCHIVE_SCHEMA = pa.schema(
+    [
+        ('SnapshotID', pa.int64()),
+        ('SnapshotTimestamp', pa.timestamp('s')),
+        ('ID_Plato', pa.dictionary(pa.int32(), pa.string())),
+        ('Param_Id', pa.int32()),
+        ('Nombre_Plato', pa.dictionary(pa.int32(), pa.string())),
+    ]
+    + [(col, pa.float64()) for col in MEASURE_COLUMNS]
+)
+ARCHIVE_COLUMNS = ARCHIVE_SCHEMA.names
+
+HISTORY_ROWS_SQL = """
+    SELECT h.*, p.Nombre_Plato
+    FROM PLATOS_FINANCIALS_HISTORY h
+    LEFT JOIN PLATOS p ON h.ID_Plato = p.ID_Plato
+    WHERE h.SnapshotID > %s{filters}
+    ORDER BY h.SnapshotID
+"""
+
+# Filas bajo la marca de agua dentro de la ventana de re-chequeo (rango sobre idx_history_time)
+LATE_ROWS_SQL = """
+    SELECT h.*, p.Nombre_Plato
+    FROM PLATOS_FINANCIALS_HISTORY h
+    LEFT JOIN PLATOS p ON h.ID_Plato = p.ID_Plato
+    WHERE h.SnapshotTimestamp >= %s AND h.SnapshotID <= %s{filters}
+    ORDER BY h.SnapshotID
+"""
+
+
+def _empty_manifest():
+    return {'version': ARCHIVE_FORMAT_VERSION, 'last_snapshot_id': 0, 'recheck_from': None, 'partitions': {}}
+
+
+def _read_manifest_file(root):
+    path = os.path.join(root, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _upgrade_manifest(manifest):
+    """Convierte un manifest de formato 3 (una entrada por mes) a listas de partes."""
+    if manifest.get('version') in UPGRADABLE_VERSIONS:
+        manifest['partitions'] = {key: [entry] for key, entry in manifest.get('partitions', {}).items()}
+        manifest['version'] = ARCHIVE_FORMAT_VERSION
+    return manifest
+
+
+def _parts(manifest):
+    """(mes, entrada) de todas las partes del manifest, en orden de mes."""
+    return [(key, entry) for key, entries in sorted(manifest['partitions'].items()) for entry in entries]
+
+
+def load_manifest(root=DEFAULT_ARCHIVE_DIR):
+    """Manifest del archivo (vacío si todavía no se exportó nada o si es de otro formato)."""
+    manifest = _read_manifest_file(root)
+    if manifest is None:
+        return _empty_manifest()
+    manifest = _upgrade_manifest(manifest)
+    if manifest.get('version') != ARCHIVE_FORMAT_VERSION:
+        logging.warning(f"Archivo de historial en formato {manifest.get('version')} (actual {ARCHIVE_FORMAT_VERSION}): "
+                        "se ignora hasta que la próxima exportación lo regenere.")
+        return _empty_manifest()
+    return manifest
+
+
+def _discard_outdated_archive(root):
+    """Borra las particiones de un archivo de formato anterior (se vuelve a exportar todo)."""
+    manifest = _read_manifest_file(root)
+    if manifest is None or manifest.get('version') == ARCHIVE_FORMAT_VERSION or (
+            manifest.get('version') in UPGRADABLE_VERSIONS):
+        return
+    logging.info(f"Regenerando el archivo de historial (formato {manifest.get('version')} -> {ARCHIVE_FORMAT_VERSION}).")
+    for entry in manifest.get('partitions', {}).values():
+        for part in (entry if isinstance(entry, list) else [entry]):
+            path = os.path.join(root, part['path'])
+            if os.path.exists(path):
+                os.remove(path)
+    os.remove(os.path.join(root, MANIFEST_FILE))
+
+
+def _save_manifest(root, manifest):
+    path = os.path.join(root, MANIFEST_FILE)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)  # reemplazo atómico: los lectores ven el manifest viejo o el nuevo
+
+
+def to_archive_frame(df):
+    """Filas de historial (como vienen de MySQL) con los tipos del archivo."""
+    df = df.reindex(columns=ARCHIVE_COLUMNS)
+    out = pd.DataFrame({
+        'SnapshotID': pd.to_numeric(df['SnapshotID']).astype('int64'),
+        'SnapshotTimestamp': pd.to_datetime(df['SnapshotTimestamp']).astype('datetime64[s]'),
+        'ID_Plato': df['ID_Plato'].astype(str).astype('category'),
+        'Param_Id': pd.to_numeric(df['Param_Id']).fillna(DEFAULT_PARAM_ID).astype('int32'),
+        'Nombre_Plato': df['Nombre_Plato'].astype('category'),
+    }, index=df.index)
+    for col in MEASURE_COLUMNS:
+        out[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+    return out
+
+
+def _write_partition(root, key, frame):
+    """Escribe una parte de un mes y devuelve su entrada de manifest."""
+    # Las categorías de ID_Plato quedan ordenadas (to_archive_frame / concat_history), así el
+    # orden es alfabético
+    frame = frame.sort_values(['ID_Plato', 'SnapshotTimestamp', 'SnapshotID'])
+    max_id = int(frame['SnapshotID'].max())
+    # El sufijo evita pisar una parte vigente: una compactación con filas tardías puede tener
+    # el mismo SnapshotID máximo que una de las partes que reemplaza
+    rel_path = f"month={key}/part-{max_id:010d}-{uuid.uuid4().hex[:8]}.parquet"
+    path = os.path.join(root, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.Table.from_pandas(frame, schema=ARCHIVE_SCHEMA, preserve_index=False)
+    pq.write_table(table, path + '.tmp', row_group_size=ROW_GROUP_ROWS, compression='zstd',
+                   use_dictionary=True, write_statistics=True)
+    os.replace(path + '.tmp', path)
+    platos = frame['ID_Plato'].astype(str)
+    return {
+        'path': rel_path, 'rows': len(frame),
+        'min_snapshot_id': int(frame['SnapshotID'].min()), 'max_snapshot_id': max_id,
+        'min_timestamp': str(frame['SnapshotTimestamp'].min()), 'max_timestamp': str(frame['SnapshotTimestamp'].max()),
+        'min_plato': platos.min(), 'max_plato': platos.max(),
+    }
+
+
+def _append_batch(root, manifest, frame):
+    """Agrega un lote al archivo como una parte nueva por mes. Devuelve los meses tocados."""
+    months = set()
+    for key, part in frame.groupby(frame['SnapshotTimestamp'].dt.strftime('%Y-%m')):
+        manifest['partitions'].setdefault(key, []).append(_write_partition(root, key, part))
+        months.add(key)
+    return months
+
+
+def _compact(root, manifest, months, max_parts=MAX_PARTS_PER_MONTH):
+    """Une en una sola parte los meses con más de `max_parts` partes. Devuelve archivos obsoletos."""
+    obsolete = []
+    for key in sorted(months):
+        entries = manifest['partitions'].get(key, [])
+        if len(entries) <= max_parts:
+            continue
+        frames = [pq.read_table(os.path.join(root, e['path']), schema=ARCHIVE_SCHEMA).to_pandas() for e in entries]
+        manifest['partitions'][key] = [_write_partition(root, key, concat_history(frames))]
+        obsolete.extend(os.path.join(root, e['path']) for e in entries)
+    return obsolete
+
+
+def _archived_ids(root, manifest, since):
+    """SnapshotID ya archivados con SnapshotTimestamp >= `since` (solo lee esa columna)."""
+    since = pd.Timestamp(since)
+    paths = [os.path.join(root, e['path']) for _, e in _parts(manifest)
+             if pd.Timestamp(e['max_timestamp']) >= since]
+    if not paths:
+        return pd.Index([], dtype='int64')
+    dataset = ds.dataset(paths, schema=ARCHIVE_SCHEMA, format='parquet')
+    table = dataset.to_table(columns=['SnapshotID'], filter=ds.field('SnapshotTimestamp') >= pa.scalar(
+        since.to_pydatetime(), pa.timestamp('s')))
+    return pd.Index(table.column('SnapshotID').to_numpy())
+
+
+def _late_rows(conn, root, manifest, filters="", args=()):
+    """Filas bajo la marca de agua, dentro de la ventana de re-chequeo, que no están archivadas."""
+    if not manifest.get('recheck_from') or not manifest['last_snapshot_id']:
+        return pd.DataFrame()
+    since = pd.Timestamp(manifest['recheck_from'])
+    df = pd.read_sql_query(LATE_ROWS_SQL.format(filters=filters) + ";", conn,
+                           params=(since.to_pydatetime(), manifest['last_snapshot_id'], *args))
+    if df.empty:
+        return df
+    return df[~pd.to_numeric(df['SnapshotID']).isin(_archived_ids(root, manifest, since))]
+
+
+def export_history(conn, root=DEFAULT_ARCHIVE_DIR, batch_size=EXPORT_BATCH_ROWS):
+    """
+    Exporta al archivo las filas de PLATOS_FINANCIALS_HISTORY posteriores a la marca de agua
+    del manifest, en lotes de `batch_size` por SnapshotID, más las que confirmaron tarde por
+    debajo de ella (ventana recheck_from). Devuelve (bool, str).
+    """
+    logging.info(f"Iniciando exportación del historial a Parquet ({root})...")
+    try:
+        check_history_param_column(conn)
+        started = pd.Timestamp(datetime.datetime.now())
+        os.makedirs(root, exist_ok=True)
+        _discard_outdated_archive(root)
+        manifest = load_manifest(root)
+        last_id = manifest['last_snapshot_id']
+        months = set()
+        late = _late_rows(conn, root, manifest)
+        if not late.empty:
+            logging.warning(f"Archivo de historial: {len(late)} filas confirmadas después de la exportación anterior.")
+            months |= _append_batch(root, manifest, to_archive_frame(late))
+            _save_manifest(root, manifest)
+        total = len(late)
+        while True:
+            df = pd.read_sql_query(HISTORY_ROWS_SQL.format(filters="") + " LIMIT %s;", conn, params=(last_id, batch_size))
+            if df.empty:
+                break
+            months |= _append_batch(root, manifest, to_archive_frame(df))
+            last_id = int(df['SnapshotID'].max())
+            manifest['last_snapshot_id'] = last_id
+            _save_manifest(root, manifest)
+            total += len(df)
+            if len(df) < batch_size:
+                break
+        obsolete = _compact(root, manifest, months)
+        manifest['recheck_from'] = str(started - RECHECK_LAG)
+        _save_manifest(root, manifest)
+        for path in obsolete:
+            os.remove(path)
+        message = f"Archivo de historial: {total} filas nuevas exportadas (último SnapshotID {last_id}, {len(manifest['partitions'])} meses)."
+        logging.info(message)
+        return True, message
+    except Error as e:
+        logging.error(f"Error de BD exportando el historial: {e}")
+        return False, f"Error de BD al exportar el historial: {e}"
+    except Exception as ex:
+        logging.error(f"Error inesperado exportando el historial: {ex}", exc_info=True)
+        return False, f"Error inesperado al exportar el historial: {ex}"
+
+
+def _bounds(start, end):
+    """
+    (start, end) como Timestamp. Un `end` sin hora (date o 'YYYY-MM-DD') incluye ese día
+    completo.
+    """
+    start_ts = pd.Timestamp(start) if start is not None else None
+    end_ts = None
+    if end is not None:
+        end_ts = pd.Timestamp(end)
+        date_only = (isinstance(end, datetime.date) and not isinstance(end, datetime.datetime)) or (
+            isinstance(end, str) and len(end.strip()) == 10
+        )
+        if date_only:
+            end_ts = end_ts + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+    return start_ts, end_ts
+
+
+def _prune(manifest, start, end, plato_ids):
+    """Partes del manifest que pueden tener filas en [start, end] para esos platos."""
+    low = high = None
+    if plato_ids is not None:
+        ids = sorted(str(p) for p in plato_ids)
+        low, high = (ids[0], ids[-1]) if ids else (None, None)
+    paths = []
+    for key, entry in _parts(manifest):
+        if (start is not None and pd.Timestamp(entry['max_timestamp']) < start) or (
+                end is not None and pd.Timestamp(entry['min_timestamp']) > end):
+            continue
+        if plato_ids is not None and (low is None or entry['max_plato'] < low or entry['min_plato'] > high):
+            continue
+        paths.append(entry['path'])
+    return paths
+
+
+def read_history_archive(root=DEFAULT_ARCHIVE_DIR, start=None, end=None, plato_ids=None, columns=None,
+                         param_id=DEFAULT_PARAM_ID):
+    """
+    Lee el archivo de historial: descarta meses fuera de [start, end] y platos fuera de
+    `plato_ids` con el manifest, y dentro de cada archivo filtra con las estadísticas de
+    row group. `columns` limita las columnas leídas; `param_id` elige el juego de parámetros
+    (None: todos). Devuelve un DataFrame (ID_Plato y Nombre_Plato como category).
+    """
+    manifest = load_manifest(root)
+    start, end = _bounds(start, end)
+    paths = _prune(manifest, start, end, plato_ids)
+    if columns is not None:
+        columns = [c for c in ARCHIVE_COLUMNS if c in columns]
+    if not paths:
+        empty = to_archive_frame(pd.DataFrame(columns=ARCHIVE_COLUMNS))
+        return empty[columns] if columns is not None else empty
+    dataset = ds.dataset([os.path.join(root, p) for p in paths], schema=ARCHIVE_SCHEMA, format='parquet')
+    conditions = []
+    if start is not None:
+        conditions.append(ds.field('SnapshotTimestamp') >= pa.scalar(start.to_pydatetime(), pa.timestamp('s')))
+    if end is not None:
+        conditions.append(ds.field('SnapshotTimestamp') <= pa.scalar(end.to_pydatetime(), pa.timestamp('s')))
+    if plato_ids is not None:
+        conditions.append(ds.field('ID_Plato').isin([str(p) for p in plato_ids]))
+    if param_id is not None:
+        conditions.append(ds.field('Param_Id') == int(param_id))
+    condition = None
+    for c in conditions:
+        condition = c if condition is None else condition & c
+    table = dataset.to_table(columns=columns, filter=condition)
+    df = table.to_pandas()
+    logging.info(f"Archivo de historial: {len(df)} filas leídas de {len(paths)}/{len(_parts(manifest))} partes.")
+    return df
+
+
+def load_history(conn=None, root=DEFAULT_ARCHIVE_DIR, start=None, end=None, plato_ids=None, columns=None,
+                 param_id=DEFAULT_PARAM_ID):
+    """
+    Historial completo para la página y los análisis: lo archivado desde Parquet más, si hay
+    conexión, las filas de MySQL que el archivo todavía no tiene: posteriores a la marca de
+    agua del manifest o confirmadas tarde dentro de su ventana de re-chequeo. Sin archivo
+    equivale a leer toda la tabla. Por defecto solo el
+    juego de parámetros de la vista (`param_id` None: todos).
+    """
+    df = read_history_archive(root, start, end, plato_ids, columns, param_id)
+    if conn is None:
+        return df
+    check_history_param_column(conn)
+    start, end = _bounds(start, end)
+    manifest = load_manifest(root)
+    filters, args = "", []
+    if param_id is not None:
+        filters += " AND h.Param_Id = %s"
+        args.append(int(param_id))
+    if start is not None:
+        filters += " AND h.SnapshotTimestamp >= %s"
+        args.append(start.to_pydatetime())
+    if end is not None:
+        filters += " AND h.SnapshotTimestamp <= %s"
+        args.append(end.to_pydatetime())
+    if plato_ids is not None:
+        plato_ids = list(plato_ids)
+        if not plato_ids:
+            return df
+        filters += f" AND h.ID_Plato IN ({', '.join(['%s'] * len(plato_ids))})"
+        args.extend(plato_ids)
+    tail = pd.read_sql_query(HISTORY_ROWS_SQL.format(filters=filters) + ";", conn,
+                             params=(manifest['last_snapshot_id'], *args))
+    late = _late_rows(conn, root, manifest, filters, args)
+    if not late.empty:
+        tail = pd.concat([late, tail], ignore_index=True) if not tail.empty else late
+    if tail.empty:
+        return df
+    tail = to_archive_frame(tail)
+    if columns is not None:
+        tail = tail[df.columns]
+    return concat_history([df, tail])
+
+
+def concat_history(frames):
+    """
+    Une frames con los tipos del archivo sin perder las category: las categorías se unen
+    (ordenadas) en lugar de caer a object como en un pd.concat directo.
+    """
+    frames = [f for f in frames if f is not None and len(f)] or frames[:1]
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    columns = {}
+    for col in frames[0].columns:
+        parts = [f[col] for f in frames]
+        if all(isinstance(p.dtype, pd.CategoricalDtype) for p in parts):
+            columns[col] = union_categoricals([p.array for p in parts], sort_categories=True)
+        else:
+            columns[col] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(columns)
@@ -0,0 +1,195 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from financial_history import AS_OF_SQL, DEFAULT_PARAM_ID, check_history_param_column, get_financials_as_of
+
+# Consultas del historial para los gráficos: las series por plato, la foto al último snapshot y
+# el top-N se resuelven en MySQL (filtros por plato y fecha sobre idx_history_plato_time,
+# ORDER BY ... LIMIT) y solo viajan las columnas del gráfico. Las series largas se reducen con
+# LTTB (Largest-Triangle-Three-Buckets) a una cantidad fija de puntos antes de llegar a Plotly:
+# conserva la forma (picos y caídas) mejor que un promedio por intervalo.
+# Con snapshots delta las series son escalonadas (un punto por cambio): graficar con
+# line_shape='hv'.
+# Todas las consultas son de un juego de FINANCIAL_PARAMS (`param_id`, por defecto el de la vista).
+
+# Métricas que se pueden pedir (se interpolan en el SQL, por eso la lista cerrada)
+HISTORY_METRICS = {
+    'Porcentaje_Margen_Bruto_PctMBA_Hist': 'Margen Bruto (%)',
+    'Margen_Bruto_Actual_MBA_Hist': 'Margen Bruto ($)',
+    'Costo_Plato_Hist': 'Costo del Plato ($)',
+    'Precio_Competencia_Hist': 'Precio de Competencia ($)',
+    'Costo_Total_CT_Hist': 'Costo Total ($)',
+    'COGS_Partner_Actual_Hist': 'COGS Partner',
+}
+DEFAULT_METRIC = 'Porcentaje_Margen_Bruto_PctMBA_Hist'
+DEFAULT_TARGET_POINTS = 300
+
+
+def _metric(metric):
+    if metric not in HISTORY_METRICS:
+        raise ValueError(f"Métrica no soportada: {metric}. Opciones: {list(HISTORY_METRICS)}")
+    return metric
+
+
+def get_plato_series(conn, plato_ids, metric=DEFAULT_METRIC, start=None, end=None, target_points=DEFAULT_TARGET_POINTS,
+                     param_id=DEFAULT_PARAM_ID):
+    """
+    Serie temporal de `metric` por plato (ID_Plato, SnapshotTimestamp, valor), leída con
+    filtro por plato y rango de fechas y reducida a `target_points` puntos por plato con LTTB
+    (None para no reducir). Las filas de baja (NULL) se omiten.
+    """
+    metric = _metric(metric)
+    plato_ids = list(plato_ids)
+    if not plato_ids:
+        return pd.DataFrame(columns=['ID_Plato', 'SnapshotTimestamp', metric])
+    check_history_param_column(conn)
+    conditions = ["Param_Id = %s", f"ID_Plato IN ({', '.join(['%s'] * len(plato_ids))})", f"{metric} IS NOT NULL"]
+    args = [param_id, *plato_ids]
+    if start is not None:
+        conditions.append("SnapshotTimestamp >= %s")
+        args.append(start)
+    if end is not None:
+        conditions.append("SnapshotTimestamp <= %s")
+        args.append(end)
+    query = f"""
+        SELECT ID_Plato, SnapshotTimestamp, {metric}
+        FROM PLATOS_FINANCIALS_HISTORY
+        WHERE {' AND '.join(conditions)}
+        ORDER BY ID_Plato, SnapshotTimestamp;
+    """
+    df = pd.read_sql_query(query, conn, params=tuple(args))
+    df['SnapshotTimestamp'] = pd.to_datetime(df['SnapshotTimestamp'])
+    df[metric] = pd.to_numeric(df[metric], errors='coerce')
+    if target_points:
+        n_in = len(df)
+        df = downsample_series(df, 'SnapshotTimestamp', metric, target_points)
+        logging.info(f"Series de {metric}: {n_in} puntos -> {len(df)} ({len(plato_ids)} platos).")
+    return df
+
+
+def get_latest_slice(conn, as_of=None, plato_ids=None, param_id=DEFAULT_PARAM_ID):
+    """Estado de cada plato al último snapshot (o a `as_of`); ver financial_history."""
+    if as_of is None:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT MAX(SnapshotTimestamp) FROM PLATOS_FINANCIALS_HISTORY;")
+            as_of = cursor.fetchone()[0]
+        finally:
+            cursor.close()
+        if as_of is None:
+            return pd.DataFrame()
+    return get_financials_as_of(conn, as_of, plato_ids, param_id)
+
+
+def get_top_platos(conn, metric=DEFAULT_METRIC, n=15, as_of=None, ascending=False, plato_ids=None,
+                   param_id=DEFAULT_PARAM_ID):
+    """
+    Los `n` platos con mayor (o menor, ascending=True) `metric` en su última fila hasta
+    `as_of` (por defecto, el último snapshot). El orden y el LIMIT se resuelven en MySQL.
+    """
+    metric = _metric(metric)
+    check_history_param_column(conn)
+    if as_of is None:
+        as_of = pd.Timestamp.now().to_pydatetime()
+    args = [param_id, as_of]
+    plato_filter = ""
+    if plato_ids is not None:
+        plato_ids = list(plato_ids)
+        if not plato_ids:
+            return pd.DataFrame()
+        plato_filter = f" AND ID_Plato IN ({', '.join(['%s'] * len(plato_ids))})"
+        args.extend(plato_ids)
+    # El doble de filas cubre los empates de timestamp de un mismo plato (se descartan abajo)
+    query = (AS_OF_SQL.format(plato_filter=plato_filter)
+             + f" WHERE h.{metric} IS NOT NULL AND h.Precio_Competencia_Hist IS NOT NULL"
+             + f" ORDER BY h.{metric} {'ASC' if ascending else 'DESC'}, h.SnapshotID DESC LIMIT %s;")
+    args.append(2 * int(n))
+    df = pd.read_sql_query(query, conn, params=tuple(args))
+    df[metric] = pd.to_numeric(df[metric], errors='coerce')
+    return df.drop_duplicates('ID_Plato').head(n).reset_index(drop=True)
+
+
+# --- Reducción LTTB ---
+
+def lttb_indices(x, y, target_points):
+    """Posiciones elegidas por LTTB en una serie (x creciente). Devuelve un array ordenado."""
+    n = len(x)
+    if target_points >= n or target_points < 3:
+        return np.arange(n)
+    return _lttb_many([np.asarray(x, dtype='float64')], [np.asarray(y, dtype='float64')], target_points)[0]
+
+
+def _lttb_many(xs, ys, target_points):
+    """
+    LTTB para varias series a la vez (todas con más de target_points puntos): los buckets se
+    rellenan hasta el tamaño máximo y el recorrido bucket a bucket se hace en paralelo sobre
+    las series, así el bucle de Python es de target_points pasos y no por serie.
+    """
+    m = target_points
+    lengths = np.array([len(x) for x in xs])
+    S, n_max = len(xs), lengths.max()
+    X = np.full((S, n_max), np.nan)
+    Y = np.full((S, n_max), np.nan)
+    for s, (x, y) in enumerate(zip(xs, ys)):
+        X[s, :len(x)], Y[s, :len(y)] = x, y
+    rows = np.arange(S)[:, None]
+    # Buckets internos b = 0..m-3 sobre los puntos 1..n-2 (el primero y el último se conservan)
+    every = (lengths - 2) / (m - 2)
+    bounds = np.floor(np.arange(m - 1)[None, :] * every[:, None]).astype('int64') + 1   # (S, m-1)
+    bounds[:, -1] = lengths - 1
+    starts, ends = bounds[:, :-1], bounds[:, 1:]
+    K = int((ends - starts).max())
+    idx = starts[:, :, None] + np.arange(K)[None, None, :]                               # (S, m-2, K)
+    valid = idx < ends[:, :, None]
+    idx = np.where(valid, idx, 0)
+    BX, BY = X[rows[:, :, None], idx], Y[rows[:, :, None], idx]
+    counts = valid.sum(axis=2)
+    avg_x = np.where(valid, BX, 0).sum(axis=2) / counts
+    avg_y = np.where(valid, np.nan_to_num(BY), 0).sum(axis=2) / counts
+    last = lengths - 1
+    # Promedio del bucket siguiente; para el último bucket, el último punto
+    next_x = np.column_stack([avg_x[:, 1:], X[np.arange(S), last]])
+    next_y = np.column_stack([avg_y[:, 1:], Y[np.arange(S), last]])
+
+    selected = np.empty((S, m), dtype='int64')
+    selected[:, 0], selected[:, -1] = 0, last
+    a_x, a_y = X[:, 0], Y[:, 0]
+    for b in range(m - 2):
+        px, py = BX[:, b, :], BY[:, b, :]
+        area = np.abs((a_x - next_x[:, b])[:, None] * (py - a_y[:, None])
+                      - (a_x[:, None] - px) * (next_y[:, b] - a_y)[:, None])
+        area = np.where(valid[:, b, :], np.nan_to_num(area, nan=-1.0), -np.inf)
+        choice = area.argmax(axis=1)
+        selected[:, b + 1] = idx[np.arange(S), b, choice]
+        a_x, a_y = px[np.arange(S), choice], py[np.arange(S), choice]
+    return [selected[s] for s in range(S)]
+
+
+def downsample_series(df, x_col, y_col, target_points=DEFAULT_TARGET_POINTS, group_col='ID_Plato'):
+    """
+    Reduce cada serie de `df` (agrupada por `group_col`, ordenada por `x_col`) a
+    `target_points` puntos con LTTB. Las series cortas quedan como están.
+    """
+    if df.empty:
+        return df
+    df = df.sort_values([group_col, x_col], kind='stable').reset_index(drop=True)
+    x_all = df[x_col]
+    x_all = (x_all.astype('int64') / 1e9).to_numpy() if pd.api.types.is_datetime64_any_dtype(x_all) else x_all.to_numpy(dtype='float64')
+    y_all = df[y_col].to_numpy(dtype='float64')
+    codes, _ = pd.factorize(df[group_col], sort=False)
+    bounds = np.r_[0, np.flatnonzero(np.diff(codes)) + 1, len(df)]
+    keep, long_series = [], []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        if stop - start > target_points >= 3:
+            long_series.append(start)
+        else:
+            keep.append(np.arange(start, stop))
+    if long_series:
+        spans = {start: stop for start, stop in zip(bounds[:-1], bounds[1:])}
+        xs = [x_all[s:spans[s]] for s in long_series]
+        ys = [y_all[s:spans[s]] for s in long_series]
+        for start, chosen in zip(long_series, _lttb_many(xs, ys, target_points)):
+            keep.append(start + chosen)
+    return df.take(np.sort(np.concatenate(keep))).reset_index(drop=True)
@@ -0,0 +1,146 @@
+import datetime
+import logging
+import threading
+
+import pandas as pd
+
+from financial_history import DEFAULT_PARAM_ID, check_history_param_column
+from history_archive import DEFAULT_ARCHIVE_DIR, RECHECK_LAG, concat_history, load_history, to_archive_frame
+
+# Historial financiero en memoria que se actualiza de forma incremental. La primera carga lee el
+# archivo Parquet más las filas no archivadas (history_archive.load_history); después, en cada
+# refresh():
+#   1) una consulta de control, MAX(SnapshotID), que MySQL resuelve leyendo el extremo de la
+#      clave primaria (sin recorrer la tabla);
+#   2) solo si ese máximo avanzó, las filas del juego de parámetros con SnapshotID mayor al
+#      último visto (rango sobre la clave primaria, el mismo criterio que la consulta de
+#      control);
+#   3) la ventana de re-chequeo del archivo (history_archive.RECHECK_LAG): un snapshot que
+#      confirma tarde puede tener un SnapshotID menor que uno ya visto, así que en cada refresh
+#      se piden también los SnapshotID con SnapshotTimestamp >= (refresh anterior - RECHECK_LAG)
+#      y SnapshotID <= marca de agua (rango sobre idx_history_time, solo ids) y se traen
+#      completas únicamente las filas que el frame no tiene.
+# Un snapshot nuevo cuesta lo que traer ese snapshot; no hay TTL ni datos vencidos. Si el
+# historial retrocede (tabla truncada o restaurada) se recarga completo.
+# Cada store es de un juego de FINANCIAL_PARAMS (por defecto el de la vista).
+
+NEW_ROWS_SQL = """
+    SELECT h.*, p.Nombre_Plato
+    FROM PLATOS_FINANCIALS_HISTORY h
+    LEFT JOIN PLATOS p ON h.ID_Plato = p.ID_Plato
+    WHERE h.SnapshotID > %s AND h.Param_Id = %s
+    ORDER BY h.SnapshotID;
+"""
+
+LATE_IDS_SQL = """
+    SELECT h.SnapshotID
+    FROM PLATOS_FINANCIALS_HISTORY h
+    WHERE h.SnapshotTimestamp >= %s AND h.SnapshotID <= %s AND h.Param_Id = %s;
+"""
+
+ROWS_BY_ID_SQL = """
+    SELECT h.*, p.Nombre_Plato
+    FROM PLATOS_FINANCIALS_HISTORY h
+    LEFT JOIN PLATOS p ON h.ID_Plato = p.ID_Plato
+    WHERE h.SnapshotID IN ({ids})
+    ORDER BY h.SnapshotID;
+"""
+
+
+class HistoryStore:
+    """Frame de PLATOS_FINANCIALS_HISTORY (+ Nombre_Plato) con marca de agua por SnapshotID."""
+
+    def __init__(self, root=DEFAULT_ARCHIVE_DIR, param_id=DEFAULT_PARAM_ID):
+        self.root = root
+        self.param_id = param_id
+        self.df = None
+        self.max_snapshot_id = 0     # mayor SnapshotID de la tabla ya consultado (todos los juegos)
+        self.recheck_from = None     # inicio del refresh anterior - RECHECK_LAG
+        self.version = 0             # cambia con cada fila nueva (útil como clave de caché)
+        self._lock = threading.Lock()
+
+    def _probe(self, conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT MAX(SnapshotID) FROM PLATOS_FINANCIALS_HISTORY;")
+            return cursor.fetchone()[0] or 0
+        finally:
+            cursor.close()
+
+    def _late_rows(self, conn):
+        """Filas bajo la marca de agua, dentro de la ventana de re-chequeo, que el frame no tiene."""
+        if self.recheck_from is None or not self.max_snapshot_id:
+            return pd.DataFrame()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(LATE_IDS_SQL, (self.recheck_from, self.max_snapshot_id, self.param_id))
+            ids = [int(r[0]) for r in cursor.fetchall()]
+        finally:
+            cursor.close()
+        if not ids:
+            return pd.DataFrame()
+        window = self.df['SnapshotTimestamp'] >= pd.Timestamp(self.recheck_from)
+        missing = sorted(set(ids) - set(self.df.loc[window, 'SnapshotID'].tolist()))
+        if not missing:
+            return pd.DataFrame()
+        return pd.read_sql_query(ROWS_BY_ID_SQL.format(ids=', '.join(['%s'] * len(missing))), conn, params=tuple(missing))
+
+    def reload(self, conn):
+        """Carga completa (archivo + MySQL)."""
+        with self._lock:
+            # La marca de agua se toma antes de leer y nunca queda por debajo de lo cargado:
+            # una fila que llegue durante la carga no se saltea ni se repite
+            started = datetime.datetime.now()
+            max_id = self._probe(conn)
+            self.df = load_history(conn, self.root, param_id=self.param_id)
+            self.recheck_from = started - RECHECK_LAG.to_pytimedelta()
+            self.max_snapshot_id = max(max_id, int(self.df['SnapshotID'].max()) if len(self.df) else 0)
+            self.version += 1
+            logging.info(f"Historial cargado: {len(self.df)} filas (último SnapshotID {self.max_snapshot_id}).")
+            return self.df
+
+    def refresh(self, conn):
+        """
+        Agrega las filas nuevas desde la última llamada y devuelve el frame actualizado
+        (un objeto nuevo si hubo cambios; los frames entregados antes no se modifican).
+        """
+        check_history_param_column(conn)
+        if self.df is None:
+            return self.reload(conn)
+        started = datetime.datetime.now()
+        max_id = self._probe(conn)
+        if max_id < self.max_snapshot_id:
+            logging.warning("El historial retrocedió (¿tabla truncada o restaurada?): recarga completa.")
+            return self.reload(conn)
+        with self._lock:
+            late_rows = self._late_rows(conn)
+            frames = [late_rows] if not late_rows.empty else []
+            if max_id > self.max_snapshot_id:
+                new_rows = pd.read_sql_query(NEW_ROWS_SQL, conn, params=(self.max_snapshot_id, self.param_id))
+                if not new_rows.empty:
+                    frames.append(new_rows)
+            # Filas de otros juegos de parámetros también avanzan la marca: no se vuelven a pedir
+            self.max_snapshot_id = max_id
+            self.recheck_from = started - RECHECK_LAG.to_pytimedelta()
+            if not frames:
+                return self.df
+            if len(late_rows):
+                logging.warning(f"Historial: {len(late_rows)} filas confirmadas después del refresh anterior.")
+            new_rows = to_archive_frame(pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0])
+            self.df = concat_history([self.df, new_rows])
+            self.max_snapshot_id = max(max_id, int(new_rows['SnapshotID'].max()))
+            self.version += 1
+            logging.info(f"Historial: {len(new_rows)} filas nuevas (total {len(self.df)}).")
+            return self.df
+
+
+_shared_stores = {}
+_shared_lock = threading.Lock()
+
+def get_history_store(root=DEFAULT_ARCHIVE_DIR, param_id=DEFAULT_PARAM_ID):
+    """Store compartido del proceso para ese directorio de archivo y juego de parámetros."""
+    with _shared_lock:
+        key = (root, param_id)
+        if key not in _shared_stores:
+            _shared_stores[key] = HistoryStore(root, param_id)
+        return _shared_stores[key]
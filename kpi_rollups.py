@@ -0,0 +1,352 @@
+import logging
+
+import numpy as np
+import pandas as pd
+from mysql.connector import Error
+
+from financial_history import DEFAULT_PARAM_ID, get_financials_as_of
+from history_archive import load_history
+
+# Rollups de KPIs financieros por día, semana y mes, para que las preguntas de tendencia
+# ("margen promedio por semana", "cuántos platos quedaron con margen negativo este mes") no
+# recorran PLATOS_FINANCIALS_HISTORY.
+# Cada fila resume un período y una categoría de plato (más ALL_CATEGORIES para el total):
+#   - el estado del período es el de cada plato al último snapshot del período (as-of, así
+#     los snapshots delta cuentan igual que los completos; los platos dados de baja no entran);
+#   - margen promedio / mínimo / máximo (Porcentaje_Margen_Bruto_PctMBA_Hist) y cantidad de
+#     platos con Margen_Bruto_Actual_MBA_Hist < 0;
+#   - inflación de costo y deriva del precio de competencia: promedio por plato de
+#     valor_fin / valor_inicio - 1, contra el estado al cierre del período anterior.
+# update_kpi_rollups() se llama después de cada snapshot y recalcula solo los períodos que
+# contienen ese snapshot (el día, la semana y el mes); rebuild_kpi_rollups() los recalcula
+# todos a partir del historial (archivo Parquet + MySQL).
+# La categoría es la actual de PLATOS.Categoria_Plato (columna opcional: sin ella solo hay total).
+# Los rollups son del juego de FINANCIAL_PARAMS de la vista (DEFAULT_PARAM_ID): los snapshots
+# de otros juegos tienen su propia línea de tiempo y no entran.
+
+ROLLUP_TABLES = {
+    'day': 'KPI_ROLLUP_DAILY',
+    'week': 'KPI_ROLLUP_WEEKLY',
+    'month': 'KPI_ROLLUP_MONTHLY',
+}
+ALL_CATEGORIES = 'TODAS'
+WITHOUT_CATEGORY = 'Sin categoría'
+
+KPI_COLUMNS = [
+    'Period_Start', 'Categoria', 'Last_Snapshot', 'Platos',
+    'Avg_Margin_Pct', 'Min_Margin_Pct', 'Max_Margin_Pct', 'Negative_Margin_Platos',
+    'Avg_Costo', 'Cost_Inflation_Pct', 'Avg_Precio_Competencia', 'Price_Drift_Pct',
+]
+
+ROLLUP_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        Period_Start DATE NOT NULL,
+        Categoria VARCHAR(100) NOT NULL,
+        Last_Snapshot TIMESTAMP NULL DEFAULT NULL,
+        Platos INT NOT NULL DEFAULT 0,
+        Avg_Margin_Pct DECIMAL(10,5) DEFAULT NULL,
+        Min_Margin_Pct DECIMAL(10,5) DEFAULT NULL,
+        Max_Margin_Pct DECIMAL(10,5) DEFAULT NULL,
+        Negative_Margin_Platos INT NOT NULL DEFAULT 0,
+        Avg_Costo DECIMAL(12,5) DEFAULT NULL,
+        Cost_Inflation_Pct DECIMAL(10,5) DEFAULT NULL,
+        Avg_Precio_Competencia DECIMAL(10,2) DEFAULT NULL,
+        Price_Drift_Pct DECIMAL(10,5) DEFAULT NULL,
+        Updated_At TIMESTAMP NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        PRIMARY KEY (Period_Start, Categoria)
+    );
+"""
+
+UPSERT_SQL = """
+    INSERT INTO {table} ({columns}) VALUES ({placeholders})
+    ON DUPLICATE KEY UPDATE {updates};
+"""
+
+STATE_COLUMNS = ['Costo_Plato_Hist', 'Precio_Competencia_Hist', 'Porcentaje_Margen_Bruto_PctMBA_Hist', 'Margen_Bruto_Actual_MBA_Hist']
+
+
+def period_start(value, granularity):
+    """Primer día del período (día, semana desde el lunes o mes) que contiene `value`."""
+    day = pd.Timestamp(value).normalize()
+    if granularity == 'day':
+        return day
+    if granularity == 'week':
+        return day - pd.Timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    raise ValueError(f"Granularidad no soportada: {granularity}. Opciones: {list(ROLLUP_TABLES)}")
+
+
+def _next_period_start(start, granularity):
+    if granularity == 'day':
+        return start + pd.Timedelta(days=1)
+    if granularity == 'week':
+        return start + pd.Timedelta(days=7)
+    return start + pd.offsets.MonthBegin(1)
+
+
+def create_kpi_rollup_tables(conn):
+    """Crea (si no existen) las tablas de rollups. DDL: commit implícito en MySQL."""
+    cursor = conn.cursor()
+    try:
+        for table in ROLLUP_TABLES.values():
+            cursor.execute(ROLLUP_TABLE_DDL.format(table=table))
+    finally:
+        cursor.close()
+
+
+def _plato_categories(conn):
+    """Serie ID_Plato -> Categoria_Plato, o None si PLATOS no tiene esa columna."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT * FROM PLATOS LIMIT 0;")
+        cursor.fetchall()
+        columns = cursor.column_names
+    finally:
+        cursor.close()
+    if 'Categoria_Plato' not in columns:
+        return None
+    df = pd.read_sql_query("SELECT ID_Plato, Categoria_Plato FROM PLATOS;", conn)
+    return df.set_index(df['ID_Plato'].astype(str))['Categoria_Plato']
+
+
+def _numeric_state(state):
+    """Estado por plato (índice ID_Plato) con las columnas de STATE_COLUMNS numéricas."""
+    if state is None or state.empty:
+        return pd.DataFrame(columns=STATE_COLUMNS, dtype='float64')
+    out = pd.DataFrame(
+        {col: pd.to_numeric(state[col], errors='coerce').to_numpy(dtype='float64') for col in STATE_COLUMNS},
+        index=pd.Index(state['ID_Plato'].astype(str), name='ID_Plato'),
+    )
+    return out[~out.index.duplicated(keep='last')]
+
+
+def _drift(end, start, column):
+    """Por plato: fin / inicio - 1 (NaN si falta alguno o no es > 0). `start` alineado con `end`."""
+    e, s = end[column].to_numpy(), start[column].to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where((e > 0) & (s > 0), e / s - 1, np.nan)
+
+
+def _stat(values, func):
+    """Estadística sin NaN; None si no queda ningún valor."""
+    values = values[~np.isnan(values)]
+    return float(func(values)) if len(values) else None
+
+
+def period_kpis(end_state, start_state, categories=None):
+    """
+    Filas de KPIs (dicts sin Period_Start ni Last_Snapshot) para el total y cada categoría,
+    a partir del estado al cierre del período y al cierre del anterior (DataFrames por plato).
+    La inflación de costo y la deriva de precio promedian solo platos con ambos valores > 0.
+    """
+    end = _numeric_state(end_state)
+    start = _numeric_state(start_state).reindex(end.index)
+    pct = end['Porcentaje_Margen_Bruto_PctMBA_Hist'].to_numpy()
+    negative = (end['Margen_Bruto_Actual_MBA_Hist'] < 0).to_numpy()
+    costo, precio = end['Costo_Plato_Hist'].to_numpy(), end['Precio_Competencia_Hist'].to_numpy()
+    inflation, drift = _drift(end, start, 'Costo_Plato_Hist'), _drift(end, start, 'Precio_Competencia_Hist')
+
+    groups = [(ALL_CATEGORIES, np.arange(len(end)))]
+    if categories is not None and len(end):
+        labels = categories.reindex(end.index).fillna(WITHOUT_CATEGORY).astype(str).to_numpy()
+        groups += [(name, np.flatnonzero(labels == name)) for name in sorted(set(labels))]
+    rows = []
+    for name, pos in groups:
+        rows.append({
+            'Categoria': name,
+            'Platos': int(len(pos)),
+            'Avg_Margin_Pct': _stat(pct[pos], np.mean),
+            'Min_Margin_Pct': _stat(pct[pos], np.min),
+            'Max_Margin_Pct': _stat(pct[pos], np.max),
+            'Negative_Margin_Platos': int(negative[pos].sum()),
+            'Avg_Costo': _stat(costo[pos], np.mean),
+            'Cost_Inflation_Pct': _stat(inflation[pos], np.mean),
+            'Avg_Precio_Competencia': _stat(precio[pos], np.mean),
+            'Price_Drift_Pct': _stat(drift[pos], np.mean),
+        })
+    return rows
+
+
+def _upsert(conn, granularity, rows):
+    table = ROLLUP_TABLES[granularity]
+    updates = ", ".join(f"{c} = VALUES({c})" for c in KPI_COLUMNS[2:])
+    sql = UPSERT_SQL.format(table=table, columns=", ".join(KPI_COLUMNS),
+                            placeholders=", ".join(["%s"] * len(KPI_COLUMNS)), updates=updates)
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(sql, [tuple(row[c] for c in KPI_COLUMNS) for row in rows])
+    finally:
+        cursor.close()
+
+
+def _last_snapshot_in(conn, start, end):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT MAX(SnapshotTimestamp) FROM PLATOS_FINANCIALS_HISTORY "
+            "WHERE Param_Id = %s AND SnapshotTimestamp >= %s AND SnapshotTimestamp < %s;",
+            (DEFAULT_PARAM_ID, start.to_pydatetime(), end.to_pydatetime()),
+        )
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+
+def update_kpi_rollups(conn, snapshot_timestamp=None):
+    """
+    Recalcula los períodos (día, semana, mes) que contienen `snapshot_timestamp` (por defecto
+    el último snapshot). Crea las tablas si faltan. Hace commit. Devuelve (bool, str).
+    """
+    logging.info("Actualizando rollups de KPIs financieros...")
+    try:
+        create_kpi_rollup_tables(conn)
+        if snapshot_timestamp is None:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT MAX(SnapshotTimestamp) FROM PLATOS_FINANCIALS_HISTORY WHERE Param_Id = %s;", (DEFAULT_PARAM_ID,))
+                snapshot_timestamp = cursor.fetchone()[0]
+            finally:
+                cursor.close()
+            if snapshot_timestamp is None:
+                message = "No hay snapshots: no se actualizaron rollups."
+                logging.info(message)
+                return True, message
+        categories = _plato_categories(conn)
+        states = {}  # timestamp -> estado as-of (el cierre suele ser el mismo en las tres granularidades)
+
+        def state_at(ts):
+            if ts not in states:
+                states[ts] = get_financials_as_of(conn, ts, param_id=DEFAULT_PARAM_ID)
+            return states[ts]
+
+        updated = []
+        for granularity in ROLLUP_TABLES:
+            start = period_start(snapshot_timestamp, granularity)
+            last = _last_snapshot_in(conn, start, _next_period_start(start, granularity)) or snapshot_timestamp
+            previous_close = (start - pd.Timedelta(seconds=1)).to_pydatetime()
+            rows = period_kpis(state_at(last), state_at(previous_close), categories)
+            for row in rows:
+                row['Period_Start'] = start.date()
+                row['Last_Snapshot'] = last
+            _upsert(conn, granularity, rows)
+            updated.append(f"{granularity} {start.date()}")
+        conn.commit()
+        message = f"Rollups de KPIs actualizados ({', '.join(updated)})."
+        logging.info(message)
+        return True, message
+    except Error as e:
+        logging.error(f"Error de BD actualizando rollups de KPIs: {e}")
+        conn.rollback()
+        return False, f"Error de BD al actualizar rollups: {e}"
+    except Exception as ex:
+        logging.error(f"Error inesperado actualizando rollups de KPIs: {ex}", exc_info=True)
+        return False, f"Error inesperado al actualizar rollups: {ex}"
+
+
+def _daily_states(history):
+    """
+    Estado al cierre de cada día con snapshots, como matrices días x platos (una por columna de
+    STATE_COLUMNS), arrastrando el último valor de cada plato; las bajas cortan el arrastre.
+    """
+    df = history.sort_values(['SnapshotTimestamp', 'SnapshotID'])
+    df = df.assign(Dia=df['SnapshotTimestamp'].dt.normalize(), ID_Plato=df['ID_Plato'].astype(str))
+    df = df.drop_duplicates(['Dia', 'ID_Plato'], keep='last')
+    alive = df['Precio_Competencia_Hist'].notna().astype('float64')
+    days = pd.DatetimeIndex(sorted(df['Dia'].unique()))
+    pivot = lambda values: pd.DataFrame({'Dia': df['Dia'], 'ID_Plato': df['ID_Plato'], 'v': values}) \
+        .pivot(index='Dia', columns='ID_Plato', values='v').reindex(days).ffill()
+    alive_m = pivot(alive)
+    matrices = {col: pivot(pd.to_numeric(df[col], errors='coerce')).where(alive_m == 1) for col in STATE_COLUMNS}
+    last_ts = df.groupby('Dia')['SnapshotTimestamp'].max().reindex(days)
+    return days, matrices, alive_m == 1, last_ts
+
+
+def _state_row(matrices, alive, day):
+    ids = alive.columns[alive.loc[day].to_numpy()]
+    return pd.DataFrame({'ID_Plato': ids, **{col: matrices[col].loc[day, ids].to_numpy() for col in STATE_COLUMNS}})
+
+
+def rebuild_kpi_rollups(conn, granularities=None):
+    """
+    Recalcula todos los períodos con snapshots a partir del historial completo (archivo +
+    MySQL). Para la carga inicial o después de corregir el historial. Devuelve (bool, str).
+    """
+    granularities = list(granularities or ROLLUP_TABLES)
+    logging.info(f"Reconstruyendo rollups de KPIs ({granularities})...")
+    try:
+        create_kpi_rollup_tables(conn)
+        history = load_history(conn, columns=['SnapshotID', 'SnapshotTimestamp', 'ID_Plato', *STATE_COLUMNS],
+                               param_id=DEFAULT_PARAM_ID)
+        if history.empty:
+            return True, "No hay snapshots: no se generaron rollups."
+        categories = _plato_categories(conn)
+        days, matrices, alive, last_ts = _daily_states(history)
+        totals = {}
+        for granularity in granularities:
+            starts = pd.DatetimeIndex([period_start(d, granularity) for d in days])
+            period_days = pd.Series(days, index=days).groupby(starts.to_numpy()).max()  # último día con snapshot
+            rows = []
+            for start, close_day in period_days.items():
+                start = pd.Timestamp(start)
+                # Cierre del período anterior: último día con snapshots antes de `start`
+                pos = days.searchsorted(start)
+                previous_day = days[pos - 1] if pos else None
+                start_state = _state_row(matrices, alive, previous_day) if previous_day is not None else None
+                for row in period_kpis(_state_row(matrices, alive, close_day), start_state, categories):
+                    row['Period_Start'] = start.date()
+                    row['Last_Snapshot'] = last_ts[close_day].to_pydatetime()
+                    rows.append(row)
+            table = ROLLUP_TABLES[granularity]
+            cursor = conn.cursor()
+            try:
+                cursor.execute(f"DELETE FROM {table};")
+            finally:
+                cursor.close()
+            _upsert(conn, granularity, rows)
+            totals[granularity] = len(period_days)
+        conn.commit()
+        message = f"Rollups de KPIs reconstruidos: {totals} períodos."
+        logging.info(message)
+        return True, message
+    except Error as e:
+        logging.error(f"Error de BD reconstruyendo rollups de KPIs: {e}")
+        conn.rollback()
+        return False, f"Error de BD al reconstruir rollups: {e}"
+    except Exception as ex:
+        logging.error(f"Error inesperado reconstruyendo rollups de KPIs: {ex}", exc_info=True)
+        return False, f"Error inesperado al reconstruir rollups: {ex}"
+
+
+def get_kpi_rollups(conn, granularity='day', categoria=ALL_CATEGORIES, start=None, end=None):
+    """
+    KPIs de una granularidad ('day', 'week', 'month') ordenados por período; `categoria`
+    None trae todas. Lee solo la tabla de rollups.
+    """
+    table = ROLLUP_TABLES.get(granularity)
+    if table is None:
+        raise ValueError(f"Granularidad no soportada: {granularity}. Opciones: {list(ROLLUP_TABLES)}")
+    conditions, args = [], []
+    if categoria is not None:
+        conditions.append("Categoria = %s")
+        args.append(categoria)
+    if start is not None:
+        conditions.append("Period_Start >= %s")
+        args.append(period_start(start, granularity).date())
+    if end is not None:
+        conditions.append("Period_Start <= %s")
+        args.append(pd.Timestamp(end).date())
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    df = pd.read_sql_query(f"SELECT {', '.join(KPI_COLUMNS)} FROM {table}{where} ORDER BY Period_Start, Categoria;",
+                           conn, params=tuple(args))
+    for col in KPI_COLUMNS[3:]:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    df['Period_Start'] = pd.to_datetime(df['Period_Start'])
+    return df
+
+
+def get_rollup_categories(conn):
+    """Categorías presentes en los rollups (ALL_CATEGORIES primero)."""
+    df = pd.read_sql_query(f"SELECT DISTINCT Categoria FROM {ROLLUP_TABLES['month']};", conn)
+    others = sorted(c for c in df['Categoria'] if c != ALL_CATEGORIES)
+    return [ALL_CATEGORIES] + others
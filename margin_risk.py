@@ -0,0 +1,325 @@
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from costing_engine import CostingEngine, fetch_financial_params
+from exposure_index import COMPOSITION_VERSION
+from history_archive import load_history
+from materialized_views import get_materialization_version
+
+# Margin-at-risk por Monte Carlo.
+# 1) Volatilidad: de PLATOS_FINANCIALS_HISTORY se obtiene la volatilidad diaria del costo de
+#    cada plato (retornos logarítmicos entre snapshots, escalados por los días transcurridos).
+#    No hay historial por insumo, así que la volatilidad de cada insumo es el promedio de la
+#    de los platos que lo usan, ponderado por su participación en el costo de cada plato.
+# 2) Simulación: shocks normales independientes por insumo sobre el horizonte pedido. El shock
+#    del costo de cada plato es la suma de los de sus insumos ponderada por participación en
+#    el costo; como los insumos son independientes, esa suma tiene una volatilidad menor que
+#    la del plato (≈ sqrt(Σ s²)·σ_p), así que se reescala por plato para que la volatilidad
+#    simulada sea la calibrada (la del historial, o Σ s·σ_insumo si el plato no tiene). Los
+#    platos comparten los shocks de sus insumos comunes, y eso da la correlación entre platos.
+#    Los platos se parten en bloques que se simulan en un pool de procesos; cada insumo usa
+#    un generador derivado de (seed, índice del insumo), así todos los bloques ven el mismo
+#    camino para el mismo insumo y los márgenes por campaña se pueden sumar entre bloques.
+#    El bloque se achica cuando hay muchos caminos: cada proceso guarda una sola matriz
+#    platos x caminos de a lo sumo MAX_BLOCK_CELLS celdas.
+# El precio de competencia se mantiene fijo: el riesgo simulado es solo de costos.
+
+DEFAULT_PATHS = 20000
+DEFAULT_HORIZON_DAYS = 30
+DEFAULT_PERCENTILES = (5, 50, 95)
+PLATO_BLOCK_SIZE = 500
+PATH_CHUNK_SIZE = 2000  # Caminos por tanda de shocks: la matriz insumos x caminos queda acotada
+MAX_BLOCK_CELLS = 4_000_000  # Platos x caminos por bloque (32 MB en float64)
+
+# (versión de snapshot, versión de costos, parámetros, huella de campañas) -> (df_platos, df_campañas)
+_RESULT_CACHE = {}
+
+
+def fetch_cost_history(conn):
+    """
+    Serie de costos por plato de PLATOS_FINANCIALS_HISTORY: lo archivado en Parquet más las
+    filas todavía no archivadas (ver history_archive.load_history). Solo el juego de
+    parámetros de la vista: otros juegos repetirían los mismos costos en otros instantes.
+    """
+    history = load_history(conn, columns=['ID_Plato', 'SnapshotTimestamp', 'Costo_Plato_Hist'])
+    history['ID_Plato'] = history['ID_Plato'].astype(object)
+    return history.sort_values(['ID_Plato', 'SnapshotTimestamp']).reset_index(drop=True)
+
+
+def get_snapshot_version(conn):
+    """Identifica el estado del historial: (último SnapshotID, cantidad de filas)."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT MAX(SnapshotID), COUNT(*) FROM PLATOS_FINANCIALS_HISTORY;")
+        max_id, count = cursor.fetchone()
+        return (max_id or 0, count or 0)
+    finally:
+        cursor.close()
+
+
+def plato_volatility(history):
+    """
+    Volatilidad diaria del costo por plato: raíz del promedio de los retornos logarítmicos
+    al cuadrado, cada uno dividido por la raíz de los días entre snapshots (mínimo 1 día).
+    Platos con menos de dos snapshots válidos quedan fuera.
+    """
+    df = history[['ID_Plato', 'SnapshotTimestamp', 'Costo_Plato_Hist']].copy()
+    df['Costo_Plato_Hist'] = pd.to_numeric(df['Costo_Plato_Hist'], errors='coerce')
+    df['SnapshotTimestamp'] = pd.to_datetime(df['SnapshotTimestamp'])
+    df = df[df['Costo_Plato_Hist'] > 0].sort_values(['ID_Plato', 'SnapshotTimestamp'])
+    grouped = df.groupby('ID_Plato')
+    log_ret = np.log(df['Costo_Plato_Hist']).groupby(df['ID_Plato']).diff()
+    days = grouped['SnapshotTimestamp'].diff().dt.total_seconds() / 86400.0
+    scaled = (log_ret / np.sqrt(days.clip(lower=1.0))).dropna()
+    return np.sqrt((scaled ** 2).groupby(df.loc[scaled.index, 'ID_Plato']).mean())
+
+
+def insumo_volatility(engine, plato_sigma):
+    """
+    Atribuye la volatilidad de los platos a los insumos por participación en el costo.
+    Los insumos sin información toman la mediana de los conocidos (0 si no hay ninguno).
+    Devuelve un array alineado con engine.insumo_ids.
+    """
+    W = engine.insumo_matrix()
+    c = np.nan_to_num(engine.insumo_costs)
+    costos = W @ c
+    sigma_p = pd.Series(plato_sigma).reindex(engine.plato_ids).to_numpy(dtype='float64')
+    known = ~np.isnan(sigma_p) & (costos > 0)
+    # Participación s_pi = W_pi * c_i / costo_p, solo para platos con volatilidad conocida
+    inv_costo = np.where(known, 1.0 / np.where(costos > 0, costos, 1.0), 0.0)
+    shares = sparse.diags(inv_costo) @ W @ sparse.diags(c)
+    weight = np.asarray(shares.sum(axis=0)).ravel()
+    weighted = shares.T @ np.nan_to_num(sigma_p)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigma_i = np.where(weight > 0, weighted / weight, np.nan)
+    fallback = np.nanmedian(sigma_i) if np.any(~np.isnan(sigma_i)) else 0.0
+    return np.where(np.isnan(sigma_i), fallback, sigma_i)
+
+
+def _insumo_generator(seed, insumo_index):
+    # Generador por insumo: el mismo camino en todos los bloques/procesos (y en todas las tandas,
+    # porque cada tanda sigue la secuencia del mismo generador)
+    return np.random.default_rng([seed, int(insumo_index)])
+
+
+def _simulate_block(task):
+    """Simula un bloque de platos (se ejecuta en un proceso del pool)."""
+    S = task['S']
+    cols = np.unique(S.indices)
+    n_paths = task['n_paths']
+    horizon = task['horizon_days']
+    sigma = (task['sigma'][cols] * np.sqrt(horizon))[:, None]
+    S_cols = S[:, cols]
+    generators = [_insumo_generator(task['seed'], col) for col in cols]
+    # Los caminos se generan por tandas: insumos en filas y caminos de la tanda en columnas;
+    # solo se acumula el shock compuesto de cada plato (platos del bloque x caminos)
+    chunk = max(1, min(task.get('path_chunk', PATH_CHUNK_SIZE), n_paths))
+    costo = np.empty((S.shape[0], n_paths))
+    buffer = np.empty((len(cols), chunk))
+    for lo in range(0, n_paths, chunk):
+        hi = min(lo + chunk, n_paths)
+        shocked = buffer[:, :hi - lo]
+        for j, generator in enumerate(generators):
+            shocked[j] = generator.standard_normal(hi - lo)
+        shocked *= sigma
+        costo[:, lo:hi] = S_cols @ shocked
+    del buffer
+    # Reescalado a la volatilidad calibrada y corrección de la media: costo = base * e^(k·D - σ²h/2)
+    costo *= task['scale'][:, None]
+    costo -= (0.5 * task['target_sigma'] ** 2 * horizon)[:, None]
+    np.exp(costo, out=costo)
+    costo *= task['base'][:, None]
+
+    campaign_margin = None
+    if task['campaign_A'] is not None:
+        # Margen de campaña por camino (caminos x campañas): constante - costos de sus platos
+        campaign_margin = task['campaign_const'] - np.asarray(task['campaign_A'].T @ costo).T
+    # MBA en el lugar (sin una segunda matriz platos x caminos)
+    mba = costo
+    mba *= -1.0
+    mba += (task['pna'] - task['pba'] * task['comm'])[:, None]
+    mba_mean = mba.mean(axis=1)
+    prob_negative = (mba < 0).mean(axis=1)
+    mba_pct = np.percentile(mba, task['percentiles'], axis=1, overwrite_input=True)
+    # PctMBA = MBA / PNA con PNA fijo por plato: sus percentiles salen de los de MBA sin reordenar
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pctmba_pct = mba_pct / np.where(task['pna'] == 0, np.nan, task['pna'])
+    return {
+        'start': task['start'],
+        'mba_pct': mba_pct,
+        'pctmba_pct': pctmba_pct,
+        'mba_mean': mba_mean,
+        'prob_negative': prob_negative,
+        'campaign_margin': campaign_margin,
+    }
+
+
+def plato_shock_scale(W, costs, insumo_sigma, plato_sigma=None):
+    """
+    Participaciones S (platos x insumos), volatilidad objetivo por plato y factor de escala k
+    tal que k·(S·shock) tenga esa volatilidad. Objetivo: `plato_sigma` (array alineado, NaN si
+    no hay historial) o, en su defecto, Σ_i s_pi·σ_i. Devuelve (S, costo_base, objetivo, k).
+    """
+    base = W @ costs
+    inv_base = np.where(base > 0, 1.0 / np.where(base > 0, base, 1.0), 0.0)
+    S = sparse.csr_matrix(sparse.diags(inv_base) @ W @ sparse.diags(costs))
+    target = S @ insumo_sigma
+    if plato_sigma is not None:
+        target = np.where(np.isnan(plato_sigma), target, plato_sigma)
+    simulated = np.sqrt(S.multiply(S) @ (insumo_sigma ** 2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.where(simulated > 0, target / simulated, 0.0)
+    target = np.where(simulated > 0, target, 0.0)
+    return S, base, target, scale
+
+
+def _campaign_terms(engine, campaigns, mask, params):
+    """
+    Matriz de incidencia (platos simulados x campañas) y constante por campaña:
+    margen_campaña = Σ_p (PNA_c,p - PBA_c,p * comisión) - Σ_p costo_p.
+    """
+    if campaigns is None or campaigns.empty:
+        return None, None, []
+    pos = {id_: i for i, id_ in enumerate(np.asarray(engine.plato_ids, dtype=object)[mask])}
+    df = campaigns[campaigns['ID_Plato'].isin(pos)].copy()
+    if df.empty:
+        return None, None, []
+    labels = df[['CampaignID', 'CampaignName']].drop_duplicates('CampaignID')
+    col = {cid: j for j, cid in enumerate(labels['CampaignID'])}
+    pba_c = pd.to_numeric(df['Precio_Bruto_Campaign'], errors='coerce').fillna(0).to_numpy()
+    pna_c = pba_c / (1 + float(params['iva_rate']))
+    term = pna_c - pba_c * float(params['commission_rate'])
+    # astype(object): las dimensiones pueden venir como category (simulation_schema)
+    rows = df['ID_Plato'].astype(object).map(pos).to_numpy(dtype='int64')
+    cols = df['CampaignID'].astype(object).map(col).to_numpy(dtype='int64')
+    A = sparse.csr_matrix((np.ones(len(df)), (rows, cols)), shape=(len(pos), len(col)))
+    const = np.bincount(cols, weights=term, minlength=len(col))
+    return A, const, list(labels.itertuples(index=False, name=None))
+
+
+def simulate_margin_risk(engine, params, insumo_sigma, campaigns=None, n_paths=DEFAULT_PATHS,
+                         horizon_days=DEFAULT_HORIZON_DAYS, seed=0, percentiles=DEFAULT_PERCENTILES,
+                         block_size=PLATO_BLOCK_SIZE, max_workers=None, path_chunk=PATH_CHUNK_SIZE,
+                         plato_sigma=None, max_block_cells=MAX_BLOCK_CELLS):
+    """
+    Corre la simulación y devuelve (df_platos, df_campañas).
+    `plato_sigma`: volatilidad diaria por ID_Plato (Serie de plato_volatility); cada plato se
+    simula con la suya. Los platos sin historial usan la que resulta de sus insumos.
+    df_platos: ID_Plato, Nombre_Plato, MBA_Actual, MBA_Medio, MBA_P<q>, PctMBA_P<q>, Prob_Margen_Negativo.
+    df_campañas: CampaignID, CampaignName, Margen_Medio, Margen_P<q>, Prob_Margen_Negativo.
+    """
+    precio = engine.precio_competencia
+    mask = engine.plato_in_view_mask() & (precio > 0)
+    W = engine.insumo_matrix()[mask]
+    costs = np.nan_to_num(engine.insumo_costs)
+    md, iva, comm = (float(params[k]) for k in ('market_discount', 'iva_rate', 'commission_rate'))
+    pba = md * precio[mask]
+    pna = pba / (1 + iva)
+    A, const, campaign_labels = _campaign_terms(engine, campaigns, mask, params)
+    ids = np.asarray(engine.plato_ids, dtype=object)[mask]
+    if plato_sigma is not None:
+        plato_sigma = pd.Series(plato_sigma).reindex(ids).to_numpy(dtype='float64')
+    S, base, target, scale = plato_shock_scale(W, costs, insumo_sigma, plato_sigma)
+
+    n_platos = W.shape[0]
+    block_size = max(1, min(block_size, max_block_cells // max(n_paths, 1)))
+    tasks = []
+    for start in range(0, n_platos, block_size):
+        stop = min(start + block_size, n_platos)
+        tasks.append({
+            'start': start, 'S': S[start:stop], 'sigma': insumo_sigma,
+            'base': base[start:stop], 'target_sigma': target[start:stop], 'scale': scale[start:stop],
+            'pba': pba[start:stop], 'pna': pna[start:stop], 'comm': comm,
+            'n_paths': n_paths, 'path_chunk': path_chunk, 'horizon_days': horizon_days, 'seed': seed,
+            'percentiles': list(percentiles),
+            'campaign_A': A[start:stop] if A is not None else None,
+            # La constante de cada campaña se suma una sola vez (en el primer bloque)
+            'campaign_const': (const if start == 0 else np.zeros_like(const)) if A is not None else None,
+        })
+
+    # Los márgenes por campaña (caminos x campañas) se suman a medida que llegan los bloques
+    total = None
+    results = []
+
+    def collect(result):
+        nonlocal total
+        margin = result.pop('campaign_margin')
+        if margin is not None:
+            total = margin if total is None else total + margin
+        results.append(result)
+
+    if len(tasks) > 1 and max_workers != 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for result in executor.map(_simulate_block, tasks):
+                collect(result)
+    else:
+        for task in tasks:
+            collect(_simulate_block(task))
+    results.sort(key=lambda r: r['start'])
+
+    names = np.asarray(engine.plato_names, dtype=object)[mask]
+    platos = pd.DataFrame({'ID_Plato': ids, 'Nombre_Plato': names,
+                           'MBA_Actual': pna - (W @ costs + pba * comm)})
+    if results:
+        platos['MBA_Medio'] = np.concatenate([r['mba_mean'] for r in results])
+        for k, q in enumerate(percentiles):
+            platos[f'MBA_P{q}'] = np.concatenate([r['mba_pct'][k] for r in results])
+        for k, q in enumerate(percentiles):
+            platos[f'PctMBA_P{q}'] = np.concatenate([r['pctmba_pct'][k] for r in results])
+        platos['Prob_Margen_Negativo'] = np.concatenate([r['prob_negative'] for r in results])
+
+    campaigns_df = pd.DataFrame(columns=['CampaignID', 'CampaignName'])
+    if A is not None:
+        campaigns_df = pd.DataFrame(campaign_labels, columns=['CampaignID', 'CampaignName'])
+        campaigns_df['Margen_Medio'] = total.mean(axis=0)
+        for q, values in zip(percentiles, np.percentile(total, list(percentiles), axis=0)):
+            campaigns_df[f'Margen_P{q}'] = values
+        campaigns_df['Prob_Margen_Negativo'] = (total < 0).mean(axis=0)
+
+    logging.info(f"Monte Carlo: {n_paths} caminos, {n_platos} platos en {len(tasks)} bloques, {len(campaign_labels)} campañas.")
+    return platos, campaigns_df
+
+
+def _campaigns_digest(campaigns):
+    """Huella del contenido de `campaigns` (lo que usa la simulación) para la clave del caché."""
+    if campaigns is None:
+        return None
+    cols = [c for c in ('CampaignID', 'CampaignName', 'ID_Plato', 'Precio_Bruto_Campaign') if c in campaigns.columns]
+    hashes = pd.util.hash_pandas_object(campaigns[cols].astype(object), index=False)
+    return hashlib.sha1(hashes.to_numpy().tobytes()).hexdigest()
+
+
+def margin_at_risk(conn, n_paths=DEFAULT_PATHS, horizon_days=DEFAULT_HORIZON_DAYS, seed=0,
+                   campaigns=None, max_workers=None, use_cache=True):
+    """
+    Punto de entrada: carga motor, historial y parámetros, y corre la simulación.
+    Los resultados se cachean en el proceso por versión de snapshot (último SnapshotID), por
+    versión de PLATOS_FINANCIALS_MAT y de COMPOSITION, ya que los costos base y la matriz de
+    insumos son los actuales, y por el contenido de `campaigns`.
+    `campaigns`: DataFrame de V_CAMPAIGN_SIMULATION (opcional) para el riesgo por campaña.
+    Devuelve (df_platos, df_campañas).
+    """
+    version = get_snapshot_version(conn)
+    key = (version, get_materialization_version(conn, "PLATOS_FINANCIALS_MAT"), get_materialization_version(conn, COMPOSITION_VERSION),
+           n_paths, horizon_days, seed, _campaigns_digest(campaigns))
+    if use_cache and key in _RESULT_CACHE:
+        return _RESULT_CACHE[key]
+
+    params = fetch_financial_params(conn)
+    if not params:
+        raise ValueError("No se encontraron parámetros financieros en FINANCIAL_PARAMS.")
+    engine = CostingEngine.from_db(conn)
+    sigma_p = plato_volatility(fetch_cost_history(conn))
+    sigma_i = insumo_volatility(engine, sigma_p)
+    logging.info(f"Volatilidad estimada para {len(sigma_p)} platos con historial.")
+    result = simulate_margin_risk(engine, params, sigma_i, campaigns=campaigns, n_paths=n_paths,
+                                  horizon_days=horizon_days, seed=seed, max_workers=max_workers,
+                                  plato_sigma=sigma_p)
+    _RESULT_CACHE.clear()  # Solo interesa la última versión
+    _RESULT_CACHE[key] = result
+    return result
@@ -0,0 +1,215 @@
+import logging
+from mysql.connector import Error
+
+# Tablas materializadas de las vistas más costosas. Las vistas recalculan toda la cadena de
+# CTEs (V_SUBRECETAS_COSTOS -> ... -> V_PLATOS_FINANCIALS) en cada lectura; estas tablas
+# guardan el resultado con clave primaria y se refrescan cuando cambian sus datos de origen
+# (actualización de precios, edición de FINANCIAL_PARAMS) o bajo demanda.
+# Cada refresco incrementa la versión de la tabla en MATERIALIZATION_VERSIONS, que los
+# lectores (ej: cachés de Streamlit) pueden usar para saber si sus datos siguen vigentes.
+# CAMPAIGN_SIMULATION_MAT depende además de CAMPAIGNS, que este proyecto no escribe (las
+# campañas se cargan directo en la base): después de cambiar campañas hay que llamar a
+# refresh_campaign_simulation (botón en "Análisis de Campañas" o snapshot_job.py
+# --refresh-campaigns; la corrida completa del job también lo hace).
+
+VERSIONS_TABLE = "MATERIALIZATION_VERSIONS"
+
+# tabla materializada -> (vista de origen, clave primaria)
+MATERIALIZED_TABLES = {
+    "PLATOS_FINANCIALS_MAT": ("V_PLATOS_FINANCIALS", ["ID_Plato"]),
+    # Se asume una fila por (CampaignID, ID_Plato) en V_CAMPAIGN_SIMULATION
+    "CAMPAIGN_SIMULATION_MAT": ("V_CAMPAIGN_SIMULATION", ["CampaignID", "ID_Plato"]),
+}
+
+# vista -> tabla materializada, para que los lectores elijan la fuente
+MATERIALIZED_SOURCES = {view: table for table, (view, _) in MATERIALIZED_TABLES.items()}
+
+
+def _existing_tables(cursor, names):
+    placeholders = ", ".join(["%s"] * len(names))
+    cursor.execute(f"""
+        SELECT UPPER(TABLE_NAME) FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND UPPER(TABLE_NAME) IN ({placeholders});
+    """, [n.upper() for n in names])
+    return {row[0] for row in cursor.fetchall()}
+
+
+def create_materialized_tables(conn):
+    """
+    Crea (si no existen) la tabla de versiones y las tablas materializadas, con la misma
+    estructura que sus vistas más una clave primaria, y las carga por primera vez.
+    Son sentencias DDL (commit implícito en MySQL): no llamar dentro de otra transacción.
+    Devuelve (bool, str).
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {VERSIONS_TABLE} (
+                Table_Name VARCHAR(64) NOT NULL PRIMARY KEY,
+                Version BIGINT NOT NULL DEFAULT 0,
+                Row_Count INT DEFAULT NULL,
+                Refreshed_At TIMESTAMP NULL DEFAULT NULL
+            );
+        """)
+        existing = _existing_tables(cursor, list(MATERIALIZED_TABLES))
+        created = []
+        for table, (view, key) in MATERIALIZED_TABLES.items():
+            if table.upper() in existing:
+                continue
+            try:
+                cursor.execute(f"CREATE TABLE {table} AS SELECT * FROM {view} WHERE 1 = 0;")
+            except Error as e:
+                # Ej: V_CAMPAIGN_SIMULATION no existe en esta BD; las demás tablas siguen
+                logging.warning(f"No se pudo crear {table} desde {view}: {e}")
+                continue
+            cursor.execute(f"ALTER TABLE {table} ADD PRIMARY KEY ({', '.join(key)});")
+            created.append(table)
+        cursor.close()
+        cursor = None
+        if created:
+            refresh_materialized(conn, tables=created)
+            conn.commit()
+        message = f"Tablas materializadas listas (creadas: {created or 'ninguna'})."
+        logging.info(message)
+        return True, message
+    except Error as e:
+        message = f"Error creando tablas materializadas: {e}"
+        logging.error(message)
+        conn.rollback()
+        return False, message
+    finally:
+        if cursor is not None:
+            cursor.close()
+
+
+def materialized_source(conn, view):
+    """Devuelve la tabla materializada de `view` si existe en la BD; si no, la propia vista."""
+    table = MATERIALIZED_SOURCES.get(view)
+    if table is None:
+        return view
+    cursor = conn.cursor()
+    try:
+        return table if _existing_tables(cursor, [table]) else view
+    except Error as e:
+        logging.warning(f"No se pudo verificar {table}, se lee la vista {view}: {e}")
+        return view
+    finally:
+        cursor.close()
+
+
+def refresh_materialized(conn, plato_ids=None, tables=None):
+    """
+    Recalcula las tablas materializadas desde sus vistas y sube su versión.
+    Con `plato_ids` solo se reemplazan las filas de esos platos; sin ellos, la tabla completa.
+    Usa DELETE + INSERT ... SELECT (no TRUNCATE) para quedar dentro de la transacción de quien
+    llama: no hace commit, así el refresco se confirma junto con el cambio que lo originó.
+    Las tablas que aún no fueron creadas se omiten. Devuelve {tabla: nueva versión}.
+    """
+    if plato_ids is not None:
+        plato_ids = [p for p in dict.fromkeys(plato_ids) if p is not None]
+        if not plato_ids:
+            return {}
+    tables = list(tables or MATERIALIZED_TABLES)
+    versions = {}
+    cursor = conn.cursor()
+    try:
+        existing = _existing_tables(cursor, tables + [VERSIONS_TABLE])
+        if VERSIONS_TABLE.upper() not in existing:
+            return {}
+        for table in tables:
+            if table.upper() not in existing:
+                continue
+            view, _ = MATERIALIZED_TABLES[table]
+            if plato_ids is None:
+                cursor.execute(f"DELETE FROM {table};")
+                cursor.execute(f"INSERT INTO {table} SELECT * FROM {view};")
+            else:
+                placeholders = ", ".join(["%s"] * len(plato_ids))
+                cursor.execute(f"DELETE FROM {table} WHERE ID_Plato IN ({placeholders});", plato_ids)
+                cursor.execute(f"INSERT INTO {table} SELECT * FROM {view} WHERE ID_Plato IN ({placeholders});", plato_ids)
+            cursor.execute(f"""
+                INSERT INTO {VERSIONS_TABLE} (Table_Name, Version, Row_Count, Refreshed_At)
+                SELECT %s, 1, COUNT(*), NOW() FROM {table}
+                ON DUPLICATE KEY UPDATE Version = Version + 1, Row_Count = VALUES(Row_Count), Refreshed_At = NOW();
+            """, (table,))
+            cursor.execute(f"SELECT Version FROM {VERSIONS_TABLE} WHERE Table_Name = %s;", (table,))
+            versions[table] = cursor.fetchone()[0]
+    finally:
+        cursor.close()
+    if versions:
+        alcance = "completo" if plato_ids is None else f"{len(plato_ids)} platos"
+        logging.info(f"Tablas materializadas refrescadas ({alcance}): {versions}")
+    return versions
+
+
+def get_materialization_version(conn, table):
+    """Versión actual de una tabla materializada (None si no existe o nunca se refrescó)."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT Version FROM {VERSIONS_TABLE} WHERE Table_Name = %s;", (table,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+    except Error:
+        return None
+    finally:
+        cursor.close()
+
+
+def bump_version(conn, name):
+    """
+    Sube la versión de `name` en MATERIALIZATION_VERSIONS sin refrescar ninguna tabla (para
+    datos derivados que no son tablas materializadas, ej: la composición de los platos).
+    No hace commit. Devuelve la nueva versión, o None si la tabla de versiones no existe.
+    """
+    cursor = conn.cursor()
+    try:
+        if VERSIONS_TABLE.upper() not in _existing_tables(cursor, [VERSIONS_TABLE]):
+            return None
+        cursor.execute(f"""
+            INSERT INTO {VERSIONS_TABLE} (Table_Name, Version, Refreshed_At) VALUES (%s, 1, NOW())
+            ON DUPLICATE KEY UPDATE Version = Version + 1, Refreshed_At = NOW();
+        """, (name,))
+        cursor.execute(f"SELECT Version FROM {VERSIONS_TABLE} WHERE Table_Name = %s;", (name,))
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+
+def refresh_all_materialized(conn):
+    """Refresco completo bajo demanda (crea las tablas si faltan). Hace commit. Devuelve (bool, str)."""
+    success, message = create_materialized_tables(conn)
+    if not success:
+        return False, message
+    try:
+        versions = refresh_materialized(conn)
+        conn.commit()
+        message = f"Tablas materializadas refrescadas: {versions}."
+        logging.info(message)
+        return True, message
+    except Error as e:
+        conn.rollback()
+        message = f"Error refrescando tablas materializadas: {e}"
+        logging.error(message)
+        return False, message
+
+
+def refresh_campaign_simulation(conn):
+    """
+    Refresco completo de CAMPAIGN_SIMULATION_MAT, para usar cuando cambian filas de CAMPAIGNS
+    (los refrescos por precios o parámetros no lo detectan). Hace commit. Devuelve (bool, str).
+    """
+    table = MATERIALIZED_SOURCES["V_CAMPAIGN_SIMULATION"]
+    try:
+        versions = refresh_materialized(conn, tables=[table])
+        conn.commit()
+        if table not in versions:
+            message = f"{table} no existe: las campañas se leen directo de V_CAMPAIGN_SIMULATION."
+        else:
+            message = f"{table} refrescada (versión {versions[table]})."
+        logging.info(message)
+        return True, message
+    except Error as e:
+        conn.rollback()
+        message = f"Error refrescando {table}: {e}"
+        logging.error(message)
+        return False, message
@@ -0,0 +1,156 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from costing_engine import CostingEngine, fetch_financial_params
+
+# Barrido de parámetros financieros: evalúa una grilla market_discount x iva_rate x
+# commission_rate contra todos los platos con un único broadcast de numpy (platos x D x V x C),
+# en vez de editar FINANCIAL_PARAMS y volver a consultar V_PLATOS_FINANCIALS por cada valor.
+# Las fórmulas son las de la vista:
+#   PBA = market_discount * Precio_Competencia
+#   PNA = PBA / (1 + iva_rate)
+#   CT  = Costo_Plato + PBA * commission_rate
+#   MBA = PNA - CT,  PctMBA = 1 - CT / PNA
+
+SWEEP_AXES = ('market_discount', 'iva_rate', 'commission_rate')
+
+
+class SweepResult:
+    """
+    Resultado de un barrido: arrays mba y pct_mba de forma (platos, D, V, C), en el orden de
+    market_discounts, iva_rates y commission_rates.
+    """
+
+    def __init__(self, plato_ids, plato_names, costo, precio, market_discounts, iva_rates, commission_rates, mba, pct_mba):
+        self.plato_ids = list(plato_ids)
+        self.plato_names = list(plato_names)
+        self.costo = costo
+        self.precio = precio
+        self.market_discounts = market_discounts
+        self.iva_rates = iva_rates
+        self.commission_rates = commission_rates
+        self.mba = mba
+        self.pct_mba = pct_mba
+
+    def _grid(self):
+        return pd.MultiIndex.from_product(
+            [self.market_discounts, self.iva_rates, self.commission_rates], names=list(SWEEP_AXES)
+        ).to_frame(index=False)
+
+    def to_frame(self):
+        """Formato largo: una fila por (plato, punto de la grilla). Puede ser grande."""
+        grid = self._grid()
+        n_platos, n_grid = len(self.plato_ids), len(grid)
+        df = pd.DataFrame({
+            'ID_Plato': np.repeat(np.asarray(self.plato_ids, dtype=object), n_grid),
+            'Nombre_Plato': np.repeat(np.asarray(self.plato_names, dtype=object), n_grid),
+        })
+        for axis in SWEEP_AXES:
+            df[axis] = np.tile(grid[axis].to_numpy(), n_platos)
+        df['Margen_Bruto_Actual_MBA'] = self.mba.reshape(-1)
+        df['Porcentaje_Margen_Bruto_PctMBA'] = self.pct_mba.reshape(-1)
+        return df
+
+    def aggregate(self):
+        """Una fila por punto de la grilla: margen total, % de margen promedio y platos con margen negativo."""
+        df = self._grid()
+        with np.errstate(invalid='ignore'):
+            df['Margen_Total'] = np.nansum(self.mba, axis=0).reshape(-1)
+            df['Pct_Margen_Promedio'] = (
+                np.nanmean(self.pct_mba, axis=0).reshape(-1) if self.plato_ids else np.nan
+            )
+        df['Platos_Margen_Negativo'] = (self.mba < 0).sum(axis=0).reshape(-1)
+        return df
+
+    def surface(self, metric='Margen_Total', x='commission_rate', y='market_discount', **fixed):
+        """
+        Superficie 2D de una métrica de aggregate() (filas = y, columnas = x). El tercer eje se
+        fija por nombre (ej: iva_rate=0.21); si no se indica, se usa su primer valor.
+        """
+        df = self.aggregate()
+        for axis in SWEEP_AXES:
+            if axis in (x, y):
+                continue
+            value = fixed.get(axis, df[axis].iloc[0])
+            df = df[np.isclose(df[axis], value)]
+        return df.pivot(index=y, columns=x, values=metric)
+
+    def breakeven_commission(self):
+        """
+        Comisión máxima con la que cada plato no pierde plata (MBA = 0), por market_discount
+        e iva_rate: (PNA - Costo_Plato) / PBA. Útil para negociar con cada plataforma.
+        """
+        md = self.market_discounts[None, :, None]
+        iva = self.iva_rates[None, None, :]
+        pba = md * self.precio[:, None, None]
+        pna = pba / (1 + iva)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            breakeven = np.where(pba > 0, (pna - self.costo[:, None, None]) / pba, np.nan)
+        n_md, n_iva = len(self.market_discounts), len(self.iva_rates)
+        return pd.DataFrame({
+            'ID_Plato': np.repeat(np.asarray(self.plato_ids, dtype=object), n_md * n_iva),
+            'Nombre_Plato': np.repeat(np.asarray(self.plato_names, dtype=object), n_md * n_iva),
+            'market_discount': np.tile(np.repeat(self.market_discounts, n_iva), len(self.plato_ids)),
+            'iva_rate': np.tile(self.iva_rates, len(self.plato_ids) * n_md),
+            'Comision_Equilibrio': breakeven.reshape(-1),
+        })
+
+
+def _axis(values):
+    return np.atleast_1d(np.asarray(values, dtype='float64'))
+
+
+def sweep_financial_params(costos, precios, market_discounts, iva_rates, commission_rates,
+                           plato_ids=None, plato_names=None):
+    """
+    Evalúa todos los platos contra la grilla completa de parámetros en una sola operación.
+    `costos` y `precios`: arrays alineados (Costo_Plato y Precio_Competencia por plato).
+    Cada eje de parámetros acepta un escalar o una lista de valores. Devuelve un SweepResult.
+    """
+    costo = np.asarray(costos, dtype='float64')
+    precio = np.asarray(precios, dtype='float64')
+    if costo.shape != precio.shape:
+        raise ValueError(f"costos y precios deben tener el mismo largo ({costo.shape} vs {precio.shape}).")
+    md, iva, comm = _axis(market_discounts), _axis(iva_rates), _axis(commission_rates)
+
+    # (P, D, 1, 1), (P, D, V, 1) y (P, D, 1, C) -> (P, D, V, C)
+    pba = precio[:, None, None, None] * md[None, :, None, None]
+    pna = pba / (1 + iva[None, None, :, None])
+    ct = costo[:, None, None, None] + pba * comm[None, None, None, :]
+    mba = pna - ct
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct = 1 - ct / np.where(pna == 0, np.nan, pna)
+
+    if plato_ids is None:
+        plato_ids = list(range(len(costo)))
+    if plato_names is None:
+        plato_names = [None] * len(costo)
+    logging.info(
+        f"Barrido de parámetros: {len(costo)} platos x {len(md)} descuentos x {len(iva)} IVA x {len(comm)} comisiones."
+    )
+    return SweepResult(plato_ids, plato_names, costo, precio, md, iva, comm, mba, pct)
+
+
+def sweep_from_db(conn, market_discounts=None, iva_rates=None, commission_rates=None, param_id=1, engine=None):
+    """
+    Barrido sobre los costos y precios actuales de la BD. Los ejes no indicados toman el valor
+    del juego `param_id` de FINANCIAL_PARAMS. Incluye los mismos platos que V_PLATOS_FINANCIALS.
+    """
+    if market_discounts is None or iva_rates is None or commission_rates is None:
+        params = fetch_financial_params(conn, param_id)
+        if not params:
+            raise ValueError(f"No existe FINANCIAL_PARAMS con param_id = {param_id}.")
+        market_discounts = params['market_discount'] if market_discounts is None else market_discounts
+        iva_rates = params['iva_rate'] if iva_rates is None else iva_rates
+        commission_rates = params['commission_rate'] if commission_rates is None else commission_rates
+    engine = engine or CostingEngine.from_db(conn)
+    costos = engine.plato_costs()
+    precio = pd.Series(engine.precio_competencia, index=engine.plato_ids).reindex(costos['ID_Plato']).to_numpy()
+    keep = precio > 0
+    return sweep_financial_params(
+        costos['Costo_Total_Plato_Calculado'].to_numpy()[keep], precio[keep],
+        market_discounts, iva_rates, commission_rates,
+        plato_ids=costos['ID_Plato'][keep], plato_names=costos['Nombre_Plato'][keep],
+    )
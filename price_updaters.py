@@ -2,123 +2,877 @@ from mysql.connector import Error
 import pandas as pd
 import logging
 import os
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from openpyxl import load_workbook
+from unit_converter import compute_costo_por_unidad_uso
+from cost_propagation import propagate_cost_changes
+from materialized_views import refresh_materialized
+
+def _fetch_unidades_uso(conn):
+    """Devuelve {ID_Insumo: Unidad_Medida_Uso} leyendo INSUMOS en una sola consulta."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT ID_Insumo, Unidad_Medida_Uso FROM INSUMOS;")
+        return dict(cursor.fetchall())
+    finally:
+        cursor.close()
+
+def _add_costo_por_unidad_uso(df_precios, unidades_uso):
+    """Agrega Costo_Por_Unidad_Uso al DataFrame del archivo usando el motor de unidades (vectorizado)."""
+    calc = pd.DataFrame({
+        'Costo_Compra': df_precios['Nuevo_Costo_Compra'],
+        'Unidad_Medida_Compra': df_precios['Nueva_Unidad_Compra'],
+        'Unidad_Medida_Uso': df_precios['ID_Insumo'].map(unidades_uso),
+    })
+    df_precios = df_precios.copy()
+    df_precios['Costo_Por_Unidad_Uso'] = compute_costo_por_unidad_uso(calc).round(5)
+    return df_precios
+
+# --- Detección de cambios ---
+# Tolerancias acordes a la precisión de las columnas DECIMAL de la BD.
+PRICE_TOLERANCE = 0.005   # DECIMAL(10,2)
+CPU_TOLERANCE = 0.000005  # DECIMAL(12,5)
+
+def _fetch_current_values(conn, table, id_col, columns, ids):
+    """Lee en una sola consulta los valores actuales de `columns` para los IDs del archivo."""
+    ids = list(ids)
+    if not ids:
+        return pd.DataFrame(columns=[id_col] + columns)
+    placeholders = ", ".join(["%s"] * len(ids))
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            f"SELECT {id_col}, {', '.join(columns)} FROM {table} WHERE {id_col} IN ({placeholders});",
+            ids
+        )
+        return pd.DataFrame(cursor.fetchall(), columns=[id_col] + columns)
+    finally:
+        cursor.close()
+
+def _numeric_changed(old, new, tolerance):
+    """Compara dos Series numéricas (pueden traer Decimal/None) y marca dónde difieren de verdad."""
+    old = pd.to_numeric(old, errors='coerce').astype('float64')
+    new = pd.to_numeric(new, errors='coerce').astype('float64')
+    both_null = old.isna() & new.isna()
+    differs = (old - new).abs() > tolerance
+    return ~both_null & (differs | old.isna() | new.isna())
+
+def _pct_delta(old, new):
+    old = pd.to_numeric(old, errors='coerce').astype('float64')
+    new = pd.to_numeric(new, errors='coerce').astype('float64')
+    return (new - old) / old.where(old != 0)
+
+def _propagate_insumo_changes(conn, cambios):
+    """
+    Propaga a subrecetas, recetas y platos los insumos cuyo Costo_Por_Unidad_Uso cambió
+    y refresca las filas materializadas de los platos afectados.
+    Corre en la misma transacción que la actualización de precios (no hace commit).
+    """
+    if cambios.empty:
+        return None
+    cpu_changed = _numeric_changed(
+        cambios['Costo_Por_Unidad_Uso_Anterior'], cambios['Costo_Por_Unidad_Uso_Nuevo'], CPU_TOLERANCE
+    )
+    propagation = propagate_cost_changes(conn, cambios.loc[cpu_changed, 'ID_Insumo'].tolist())
+    refresh_materialized(conn, plato_ids=propagation['plato_ids'])
+    return propagation
+
+def diff_insumo_prices(conn, df_precios):
+    """
+    Compara el archivo de precios (con Costo_Por_Unidad_Uso ya calculado) contra INSUMOS.
+    Devuelve (cambios, unknown_ids): `cambios` tiene solo los insumos cuyo costo, unidad de compra
+    o costo por unidad de uso cambió, con valor anterior, nuevo y variación porcentual.
+    """
+    df_precios = df_precios.drop_duplicates(subset='ID_Insumo', keep='last')
+    actuales = _fetch_current_values(
+        conn, 'INSUMOS', 'ID_Insumo',
+        ['Costo_Compra', 'Unidad_Medida_Compra', 'Costo_Por_Unidad_Uso'],
+        df_precios['ID_Insumo'].dropna().unique()
+    )
+    merged = df_precios.merge(actuales, on='ID_Insumo', how='left', indicator=True)
+    unknown_ids = merged.loc[merged['_merge'] == 'left_only', 'ID_Insumo'].tolist()
+    merged = merged[merged['_merge'] == 'both']
+
+    unidad_anterior = merged['Unidad_Medida_Compra'].astype(object)
+    unidad_nueva = merged['Nueva_Unidad_Compra'].astype(object)
+    # NULL contra NULL no es un cambio (mismo criterio que <=> en la carga por staging)
+    unidad_igual = (unidad_anterior == unidad_nueva) | (unidad_anterior.isna() & unidad_nueva.isna())
+    changed = (
+        _numeric_changed(merged['Costo_Compra'], merged['Nuevo_Costo_Compra'], PRICE_TOLERANCE)
+        | ~unidad_igual
+        | _numeric_changed(merged['Costo_Por_Unidad_Uso_y'], merged['Costo_Por_Unidad_Uso_x'], CPU_TOLERANCE)
+    )
+    merged = merged[changed]
+    cambios = pd.DataFrame({
+        'ID_Insumo': merged['ID_Insumo'],
+        'Costo_Compra_Anterior': pd.to_numeric(merged['Costo_Compra'], errors='coerce'),
+        'Costo_Compra_Nuevo': pd.to_numeric(merged['Nuevo_Costo_Compra'], errors='coerce'),
+        'Pct_Delta': _pct_delta(merged['Costo_Compra'], merged['Nuevo_Costo_Compra']),
+        'Unidad_Compra_Anterior': merged['Unidad_Medida_Compra'],
+        'Unidad_Compra_Nueva': merged['Nueva_Unidad_Compra'],
+        'Costo_Por_Unidad_Uso_Anterior': pd.to_numeric(merged['Costo_Por_Unidad_Uso_y'], errors='coerce'),
+        'Costo_Por_Unidad_Uso_Nuevo': merged['Costo_Por_Unidad_Uso_x'],
+    }).reset_index(drop=True)
+    return cambios, unknown_ids
+
+def diff_competitor_prices(conn, df_competencia):
+    """
+    Compara el archivo de precios de competencia contra PLATOS.
+    Devuelve (cambios, unknown_ids) con solo los platos cuyo Precio_Competencia cambió.
+    """
+    df_competencia = df_competencia.drop_duplicates(subset='ID_Plato', keep='last')
+    actuales = _fetch_current_values(
+        conn, 'PLATOS', 'ID_Plato', ['Precio_Competencia'],
+        df_competencia['ID_Plato'].dropna().unique()
+    )
+    merged = df_competencia.merge(actuales, on='ID_Plato', how='left', indicator=True)
+    unknown_ids = merged.loc[merged['_merge'] == 'left_only', 'ID_Plato'].tolist()
+    merged = merged[merged['_merge'] == 'both']
+    merged = merged[_numeric_changed(merged['Precio_Competencia'], merged['Precio_Competencia_Nuevo'], PRICE_TOLERANCE)]
+    cambios = pd.DataFrame({
+        'ID_Plato': merged['ID_Plato'],
+        'Precio_Competencia_Anterior': pd.to_numeric(merged['Precio_Competencia'], errors='coerce'),
+        'Precio_Competencia_Nuevo': pd.to_numeric(merged['Precio_Competencia_Nuevo'], errors='coerce'),
+        'Pct_Delta': _pct_delta(merged['Precio_Competencia'], merged['Precio_Competencia_Nuevo']),
+    }).reset_index(drop=True)
+    return cambios, unknown_ids
+
+# --- Lectura y validación de archivos de precios ---
+INSUMO_PRICE_COLUMNS = ['ID_Insumo', 'Nuevo_Costo_Compra', 'Nueva_Unidad_Compra']
+COMPETITOR_PRICE_COLUMNS = ['ID_Plato', 'Precio_Competencia_Nuevo']
+EXCEL_EXTENSIONS = ('.xlsx', '.xlsm')
+
+def read_price_file(file_path, id_col):
+    """Lee un archivo de precios completo (CSV o Excel según la extensión) con el ID como texto."""
+    if os.path.splitext(file_path)[1].lower() in EXCEL_EXTENSIONS:
+        return pd.read_excel(file_path, dtype={id_col: str})
+    return pd.read_csv(file_path, dtype={id_col: str})
+
+def iter_price_file_chunks(file_path, chunk_size, id_col):
+    """
+    Itera un archivo de precios en DataFrames de hasta `chunk_size` filas sin cargarlo entero.
+    CSV: pandas por bloques. Excel: openpyxl en modo solo lectura, fila a fila.
+    """
+    if os.path.splitext(file_path)[1].lower() not in EXCEL_EXTENSIONS:
+        yield from pd.read_csv(file_path, chunksize=chunk_size, dtype={id_col: str})
+        return
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        buffer = []
+        for row in rows:
+            buffer.append(row)
+            if len(buffer) >= chunk_size:
+                yield _excel_chunk(buffer, header, id_col)
+                buffer = []
+        if buffer:
+            yield _excel_chunk(buffer, header, id_col)
+    finally:
+        workbook.close()
+
+def _id_to_str(value):
+    # openpyxl entrega los IDs numéricos como float: 1.0 -> '1' (si no, no matchean contra la base)
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def _excel_chunk(rows, header, id_col):
+    df = pd.DataFrame(rows, columns=header)
+    df[id_col] = df[id_col].astype(object).map(_id_to_str, na_action='ignore')
+    return df
+
+def _validate_prices(df, columns, price_col, label):
+    missing = [col for col in columns if col not in df.columns]
+    if missing:
+        raise ValueError(f"Faltan columnas en el archivo de {label}: {missing}")
+    df = df[columns].copy()
+    df[price_col] = pd.to_numeric(df[price_col], errors='coerce')
+    valid = df[columns[0]].notna() & df[price_col].notna() & (df[price_col] >= 0)
+    if not valid.all():
+        logging.warning(f"Se descartan {int((~valid).sum())} filas inválidas en el archivo de {label} (ID vacío o precio no numérico/negativo).")
+    return df[valid]
+
+def validate_insumo_prices(df):
+    """Verifica columnas requeridas y descarta filas sin ID o con costo inválido."""
+    return _validate_prices(df, INSUMO_PRICE_COLUMNS, 'Nuevo_Costo_Compra', 'insumos')
+
+def validate_competitor_prices(df):
+    """Verifica columnas requeridas y descarta filas sin ID o con precio inválido."""
+    return _validate_prices(df, COMPETITOR_PRICE_COLUMNS, 'Precio_Competencia_Nuevo', 'competencia')
+
+
+INSUMO_UPDATE_SQL = """
+    UPDATE INSUMOS
+    SET Costo_Compra = %s,
+        Unidad_Medida_Compra = %s,
+        Fecha_Ultima_Actualizacion_Costo = NOW(),
+        Costo_Por_Unidad_Uso = %s
+    WHERE ID_Insumo = %s;
+"""
+
+def apply_insumo_price_changes(conn, df_precios, unidades_uso=None):
+    """
+    Calcula Costo_Por_Unidad_Uso, detecta cambios y ejecuta los UPDATE solo para esos insumos.
+    Los costos de subrecetas, recetas y platos afectados se recalculan en la misma transacción.
+    No hace commit. Devuelve (cambios, unknown_ids, unchanged).
+    """
+    if unidades_uso is None:
+        unidades_uso = _fetch_unidades_uso(conn)
+    # Costo por unidad de uso calculado en Python (unit_converter) a partir de la unidad de compra
+    # del archivo y la unidad de uso registrada en INSUMOS.
+    df_precios = _add_costo_por_unidad_uso(df_precios, unidades_uso)
+    cambios, unknown_ids = diff_insumo_prices(conn, df_precios)
+    if unknown_ids:
+        logging.warning(f"IDs de insumo desconocidos (ignorados): {unknown_ids[:50]}")
+    update_data = _frame_to_rows(
+        cambios, ['Costo_Compra_Nuevo', 'Unidad_Compra_Nueva', 'Costo_Por_Unidad_Uso_Nuevo', 'ID_Insumo']
+    )
+    if update_data:
+        cursor = conn.cursor()
+        try:
+            cursor.executemany(INSUMO_UPDATE_SQL, update_data)
+        finally:
+            cursor.close()
+        _propagate_insumo_changes(conn, cambios)
+    unchanged = df_precios['ID_Insumo'].nunique() - len(update_data) - len(unknown_ids)
+    return cambios, unknown_ids, unchanged
+
+def update_insumo_prices(conn, file_path, return_changes=False): # Eliminado valor por defecto
+    """
+    Actualiza precios de insumos (Ejemplo: desde un CSV).
+    Solo escribe los insumos cuyo precio/unidad cambió respecto de INSUMOS (el resto no se toca,
+    ni siquiera Fecha_Ultima_Actualizacion_Costo). Con return_changes=True devuelve
+    (bool, str, cambios) donde `cambios` es el DataFrame de diff_insumo_prices.
+    """
+    def _result(success, message, cambios=None):
+        if return_changes:
+            return success, message, cambios if cambios is not None else pd.DataFrame()
+        return success, message
 
-def update_insumo_prices(conn, file_path): # Eliminado valor por defecto
     if not file_path or not os.path.exists(file_path): # Verificar si existe
         logging.error(f"Archivo de precios de insumos no encontrado o no especificado: {file_path}")
-        return False, f"Archivo no encontrado: {file_path}"
-    """Actualiza precios de insumos (Ejemplo: desde un CSV)."""
+        return _result(False, f"Archivo no encontrado: {file_path}")
     logging.info("Iniciando actualización de precios de insumos...")
     try:
         # --- PASO 1: Leer nuevos precios (EJEMPLO desde CSV) ---
         # Cambia esto según tu fuente de datos (CSV, Excel, API, etc.)
-        df_precios = pd.read_csv(file_path)
-        cursor = conn.cursor()
+        df_precios = validate_insumo_prices(read_price_file(file_path, id_col='ID_Insumo'))
+
+        # --- PASO 2: Aplicar solo los cambios reales ---
+        cambios, unknown_ids, unchanged = apply_insumo_price_changes(conn, df_precios)
 
-        update_sql = """
-            UPDATE INSUMOS
-            SET Costo_Compra = %s,
-                Unidad_Medida_Compra = %s,
-                Fecha_Ultima_Actualizacion_Costo = NOW()
-                , Costo_Por_Unidad_Uso = CASE
-                                            WHEN %s LIKE '%kg' THEN %s / 1000.0
-                                            WHEN %s LIKE 'g' THEN %s
-                                            ELSE NULL
-                                        END
-            WHERE ID_Insumo = %s;
-        """
-        update_data = []
-        for index, row in df_precios.iterrows():
-            unidad_compra = row['Nueva_Unidad_Compra']
-            costo_compra = row['Nuevo_Costo_Compra']
-            update_data.append((
-                costo_compra,
-                unidad_compra,
-                unidad_compra,
-                costo_compra,
-                unidad_compra,
-                costo_compra,
-                row['ID_Insumo']
-            ))
-
-        if update_data:
-            cursor.executemany(update_sql, update_data)
+        if not cambios.empty:
             conn.commit()
-            message = f"Actualizados precios para {cursor.rowcount} insumos."
+            message = f"Actualizados precios para {len(cambios)} insumos ({unchanged} sin cambios, {len(unknown_ids)} desconocidos)."
             logging.info(message)
-            cursor.close()
-            return True, message # <--- CORREGIDO
+            return _result(True, message, cambios) # <--- CORREGIDO
         else:
-            message = "No hay datos de precios de insumos para actualizar."
+            message = f"No hay cambios de precios de insumos para aplicar ({unchanged} sin cambios, {len(unknown_ids)} desconocidos)."
             logging.info(message)
-            if cursor: cursor.close() # Asegurar cierre si se abrió
-            return True, message # <--- CORREGIDO (Éxito, sin cambios)
+            return _result(True, message, cambios) # <--- CORREGIDO (Éxito, sin cambios)
 
 
     except FileNotFoundError:
         message = f"Archivo {file_path} no encontrado. Saltando actualización."
         logging.warning(message)
-        return True, message # <--- CORREGIDO (Considerado éxito, tarea saltada)
+        return _result(True, message) # <--- CORREGIDO (Considerado éxito, tarea saltada)
         # O podrías devolver False si es crítico: return False, message
     except Error as e:
         message = f"Error actualizando precios de insumos: {e}"
         logging.error(message)
         conn.rollback()
-        if cursor: cursor.close()
-        return False, message # <--- CORREGIDO
+        return _result(False, message) # <--- CORREGIDO
     except Exception as ex:
         message = f"Error inesperado en update_insumo_prices: {ex}"
         logging.error(message, exc_info=True)
         conn.rollback()
-        if cursor: cursor.close()
-        return False, message # <--- CORREGIDO
+        return _result(False, message) # <--- CORREGIDO
+
+
+# --- Carga masiva vía tabla staging ---
+# Tabla temporal (vive solo en la sesión/conexión actual) donde se vuelca el archivo completo
+# antes de aplicar todos los cambios con un único UPDATE ... JOIN.
+INSUMOS_STAGING_TABLE = "TMP_PRECIOS_INSUMOS"
+STAGING_INSERT_BATCH = 1000 # Filas por INSERT multi-fila
+
+# Mismo criterio que diff_insumo_prices, expresado en SQL sobre la tabla staging (alias t) e INSUMOS (alias i)
+_INSUMO_CHANGED_PREDICATE = """
+    NOT (i.Costo_Compra <=> t.Nuevo_Costo_Compra
+         AND i.Unidad_Medida_Compra <=> t.Nueva_Unidad_Compra
+         AND i.Costo_Por_Unidad_Uso <=> t.Costo_Por_Unidad_Uso)
+"""
+
+def _create_insumos_staging(cursor):
+    cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {INSUMOS_STAGING_TABLE};")
+    cursor.execute(f"""
+        CREATE TEMPORARY TABLE {INSUMOS_STAGING_TABLE} (
+            ID_Insumo VARCHAR(10) NOT NULL PRIMARY KEY,
+            Nuevo_Costo_Compra DECIMAL(10,2),
+            Nueva_Unidad_Compra VARCHAR(20),
+            Costo_Por_Unidad_Uso DECIMAL(12,5)
+        ) ENGINE=InnoDB;
+    """)
+
+def _insert_staging_rows(cursor, table, columns, rows, batch_size=STAGING_INSERT_BATCH):
+    """Inserta filas en la tabla staging con INSERTs multi-fila (si un ID se repite, gana la última fila)."""
+    placeholders = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    update_clause = ", ".join(f"{col} = VALUES({col})" for col in columns[1:])
+    total = 0
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        sql = (
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES "
+            + ", ".join([placeholders] * len(batch))
+            + f" ON DUPLICATE KEY UPDATE {update_clause};"
+        )
+        cursor.execute(sql, [value for row in batch for value in row])
+        total += len(batch)
+    return total
+
+def _frame_to_rows(df, columns):
+    """Convierte columnas de un DataFrame a tuplas con None en lugar de NaN (lo que espera el conector)."""
+    subset = df[columns].astype(object)
+    return list(subset.where(subset.notna(), None).itertuples(index=False, name=None))
+
+def bulk_update_insumos(conn, frames):
+    """
+    Vuelca los DataFrames de precios (columnas ID_Insumo, Nuevo_Costo_Compra, Nueva_Unidad_Compra)
+    a la tabla staging, junto con el Costo_Por_Unidad_Uso calculado por unit_converter,
+    y aplica todos los cambios con un solo UPDATE ... JOIN.
+    Solo se actualizan los insumos cuyo valor cambió de verdad, y luego se propagan
+    sus costos a subrecetas, recetas y platos (cost_propagation).
+    No hace commit. Devuelve un dict con 'staged', 'matched', 'changed', 'unknown_ids' y
+    'changes' (DataFrame con valor anterior, nuevo y Pct_Delta, igual que diff_insumo_prices).
+    """
+    cursor = conn.cursor()
+    try:
+        _create_insumos_staging(cursor)
+        unidades_uso = _fetch_unidades_uso(conn)
+        staged = 0
+        columns = ['ID_Insumo', 'Nuevo_Costo_Compra', 'Nueva_Unidad_Compra', 'Costo_Por_Unidad_Uso']
+        for df in frames:
+            if not df.empty:
+                df = _add_costo_por_unidad_uso(df, unidades_uso)
+                staged += _insert_staging_rows(cursor, INSUMOS_STAGING_TABLE, columns, _frame_to_rows(df, columns))
+
+        cursor.execute(f"""
+            SELECT t.ID_Insumo
+            FROM {INSUMOS_STAGING_TABLE} t
+            LEFT JOIN INSUMOS i ON i.ID_Insumo = t.ID_Insumo
+            WHERE i.ID_Insumo IS NULL;
+        """)
+        unknown_ids = [row[0] for row in cursor.fetchall()]
+
+        cursor.execute(f"SELECT COUNT(*) FROM {INSUMOS_STAGING_TABLE} t JOIN INSUMOS i ON i.ID_Insumo = t.ID_Insumo;")
+        matched = cursor.fetchone()[0]
+
+        # Set de cambios (antes del UPDATE, para conservar el valor anterior)
+        cursor.execute(f"""
+            SELECT t.ID_Insumo, i.Costo_Compra, t.Nuevo_Costo_Compra,
+                   i.Unidad_Medida_Compra, t.Nueva_Unidad_Compra,
+                   i.Costo_Por_Unidad_Uso, t.Costo_Por_Unidad_Uso
+            FROM {INSUMOS_STAGING_TABLE} t
+            JOIN INSUMOS i ON i.ID_Insumo = t.ID_Insumo
+            WHERE {_INSUMO_CHANGED_PREDICATE};
+        """)
+        rows = cursor.fetchall()
+        cambios = pd.DataFrame(rows, columns=[
+            'ID_Insumo', 'Costo_Compra_Anterior', 'Costo_Compra_Nuevo',
+            'Unidad_Compra_Anterior', 'Unidad_Compra_Nueva',
+            'Costo_Por_Unidad_Uso_Anterior', 'Costo_Por_Unidad_Uso_Nuevo',
+        ])
+        cambios.insert(3, 'Pct_Delta', _pct_delta(cambios['Costo_Compra_Anterior'], cambios['Costo_Compra_Nuevo']))
+
+        # Solo se escriben (y bloquean) las filas que cambian de verdad
+        cursor.execute(f"""
+            UPDATE INSUMOS i
+            JOIN {INSUMOS_STAGING_TABLE} t ON i.ID_Insumo = t.ID_Insumo
+            SET i.Costo_Compra = t.Nuevo_Costo_Compra,
+                i.Unidad_Medida_Compra = t.Nueva_Unidad_Compra,
+                i.Fecha_Ultima_Actualizacion_Costo = NOW(),
+                i.Costo_Por_Unidad_Uso = t.Costo_Por_Unidad_Uso
+            WHERE {_INSUMO_CHANGED_PREDICATE};
+        """)
+        _propagate_insumo_changes(conn, cambios)
+        return {
+            'staged': staged,
+            'matched': int(matched),
+            'changed': len(cambios),
+            'unknown_ids': unknown_ids,
+            'changes': cambios,
+        }
+    finally:
+        try:
+            cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {INSUMOS_STAGING_TABLE};")
+        except Error as e:
+            logging.warning(f"No se pudo eliminar la tabla staging {INSUMOS_STAGING_TABLE}: {e}")
+        cursor.close()
+
+COMPETITOR_STAGING_TABLE = "TMP_PRECIOS_COMPETENCIA"
+
+def bulk_update_competitors(conn, frames):
+    """
+    Igual que bulk_update_insumos pero para Precio_Competencia de PLATOS
+    (columnas ID_Plato, Precio_Competencia_Nuevo). No hace commit.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {COMPETITOR_STAGING_TABLE};")
+        cursor.execute(f"""
+            CREATE TEMPORARY TABLE {COMPETITOR_STAGING_TABLE} (
+                ID_Plato VARCHAR(10) NOT NULL PRIMARY KEY,
+                Precio_Competencia_Nuevo DECIMAL(10,2)
+            ) ENGINE=InnoDB;
+        """)
+        staged = 0
+        for df in frames:
+            if not df.empty:
+                staged += _insert_staging_rows(cursor, COMPETITOR_STAGING_TABLE, COMPETITOR_PRICE_COLUMNS, _frame_to_rows(df, COMPETITOR_PRICE_COLUMNS))
+
+        cursor.execute(f"""
+            SELECT t.ID_Plato
+            FROM {COMPETITOR_STAGING_TABLE} t
+            LEFT JOIN PLATOS p ON p.ID_Plato = t.ID_Plato
+            WHERE p.ID_Plato IS NULL;
+        """)
+        unknown_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute(f"SELECT COUNT(*) FROM {COMPETITOR_STAGING_TABLE} t JOIN PLATOS p ON p.ID_Plato = t.ID_Plato;")
+        matched = cursor.fetchone()[0]
+
+        cursor.execute(f"""
+            SELECT t.ID_Plato, p.Precio_Competencia, t.Precio_Competencia_Nuevo
+            FROM {COMPETITOR_STAGING_TABLE} t
+            JOIN PLATOS p ON p.ID_Plato = t.ID_Plato
+            WHERE NOT (p.Precio_Competencia <=> t.Precio_Competencia_Nuevo);
+        """)
+        cambios = pd.DataFrame(cursor.fetchall(), columns=['ID_Plato', 'Precio_Competencia_Anterior', 'Precio_Competencia_Nuevo'])
+        cambios['Pct_Delta'] = _pct_delta(cambios['Precio_Competencia_Anterior'], cambios['Precio_Competencia_Nuevo'])
+
+        cursor.execute(f"""
+            UPDATE PLATOS p
+            JOIN {COMPETITOR_STAGING_TABLE} t ON p.ID_Plato = t.ID_Plato
+            SET p.Precio_Competencia = t.Precio_Competencia_Nuevo
+            WHERE NOT (p.Precio_Competencia <=> t.Precio_Competencia_Nuevo);
+        """)
+        refresh_materialized(conn, plato_ids=cambios['ID_Plato'].tolist())
+        return {
+            'staged': staged,
+            'matched': int(matched),
+            'changed': len(cambios),
+            'unknown_ids': unknown_ids,
+            'changes': cambios,
+        }
+    finally:
+        try:
+            cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {COMPETITOR_STAGING_TABLE};")
+        except Error as e:
+            logging.warning(f"No se pudo eliminar la tabla staging {COMPETITOR_STAGING_TABLE}: {e}")
+        cursor.close()
+
+def update_insumo_prices_bulk(conn, file_path, chunk_size=10000):
+    """
+    Variante masiva de update_insumo_prices para listas grandes de proveedores.
+    Lee el CSV por bloques hacia una tabla staging y aplica todo con un único UPDATE ... JOIN,
+    así los bloqueos de fila duran solo esa sentencia.
+    Devuelve (bool, str, dict) con éxito, mensaje y el resumen (matched / changed / unknown_ids).
+    """
+    if not file_path or not os.path.exists(file_path):
+        logging.error(f"Archivo de precios de insumos no encontrado o no especificado: {file_path}")
+        return False, f"Archivo no encontrado: {file_path}", {}
+    logging.info("Iniciando actualización masiva (staging) de precios de insumos...")
+    try:
+        chunks = (validate_insumo_prices(chunk) for chunk in iter_price_file_chunks(file_path, chunk_size, id_col='ID_Insumo'))
+        summary = bulk_update_insumos(conn, chunks)
+        conn.commit()
+        message = (
+            f"Carga masiva de insumos: {summary['staged']} filas leídas, {summary['matched']} encontradas, "
+            f"{summary['changed']} con cambios, {len(summary['unknown_ids'])} IDs desconocidos."
+        )
+        if summary['unknown_ids']:
+            logging.warning(f"IDs de insumo desconocidos (ignorados): {summary['unknown_ids'][:50]}")
+        logging.info(message)
+        return True, message, summary
+    except Error as e:
+        message = f"Error en la carga masiva de precios de insumos: {e}"
+        logging.error(message)
+        conn.rollback()
+        return False, message, {}
+    except Exception as ex:
+        message = f"Error inesperado en update_insumo_prices_bulk: {ex}"
+        logging.error(message, exc_info=True)
+        conn.rollback()
+        return False, message, {}
+
+
+COMPETITOR_UPDATE_SQL = """
+    UPDATE PLATOS
+    SET Precio_Competencia = %s
+    WHERE ID_Plato = %s;
+"""
+
+def apply_competitor_price_changes(conn, df_competencia):
+    """
+    Detecta cambios de Precio_Competencia y ejecuta los UPDATE solo para esos platos
+    (y refresca sus filas materializadas). No hace commit. Devuelve (cambios, unknown_ids, unchanged).
+    """
+    cambios, unknown_ids = diff_competitor_prices(conn, df_competencia)
+    if unknown_ids:
+        logging.warning(f"IDs de plato desconocidos (ignorados): {unknown_ids[:50]}")
+    update_data = _frame_to_rows(cambios, ['Precio_Competencia_Nuevo', 'ID_Plato'])
+    if update_data:
+        cursor = conn.cursor()
+        try:
+            cursor.executemany(COMPETITOR_UPDATE_SQL, update_data)
+        finally:
+            cursor.close()
+        refresh_materialized(conn, plato_ids=cambios['ID_Plato'].tolist())
+    unchanged = df_competencia['ID_Plato'].nunique() - len(update_data) - len(unknown_ids)
+    return cambios, unknown_ids, unchanged
 
+def update_competitor_prices(conn, file_path, return_changes=False): # Eliminado valor por defecto
+    """
+    Actualiza precios de competencia (Ejemplo: desde un Excel o CSV).
+    Solo escribe los platos cuyo Precio_Competencia cambió. Con return_changes=True devuelve
+    (bool, str, cambios) donde `cambios` es el DataFrame de diff_competitor_prices.
+    """
+    def _result(success, message, cambios=None):
+        if return_changes:
+            return success, message, cambios if cambios is not None else pd.DataFrame()
+        return success, message
 
-def update_competitor_prices(conn, file_path): # Eliminado valor por defecto
     if not file_path or not os.path.exists(file_path): # Verificar si existe
         logging.error(f"Archivo de precios de competencia no encontrado o no especificado: {file_path}")
-        return False, f"Archivo no encontrado: {file_path}"
-    """Actualiza precios de competencia (Ejemplo: desde un Excel)."""
+        return _result(False, f"Archivo no encontrado: {file_path}")
     logging.info("Iniciando actualización de precios de competencia...")
     try:
         # --- PASO 2: Leer nuevos precios (EJEMPLO desde Excel) ---
-        df_competencia = pd.read_excel(file_path)
-        cursor = conn.cursor()
-
-        update_sql = """
-            UPDATE PLATOS
-            SET Precio_Competencia = %s
-            WHERE ID_Plato = %s;
-        """
-        update_data = [(row['Precio_Competencia_Nuevo'], row['ID_Plato']) for index, row in df_competencia.iterrows()]
+        df_competencia = validate_competitor_prices(read_price_file(file_path, id_col='ID_Plato'))
+        cambios, unknown_ids, unchanged = apply_competitor_price_changes(conn, df_competencia)
 
-        if update_data:
-            cursor.executemany(update_sql, update_data)
+        if not cambios.empty:
             conn.commit()
-            message = f"Actualizados precios de competencia para {cursor.rowcount} platos."
+            message = f"Actualizados precios de competencia para {len(cambios)} platos ({unchanged} sin cambios, {len(unknown_ids)} desconocidos)."
             logging.info(message)
-            cursor.close()
-            return True, message # <--- CORREGIDO
+            return _result(True, message, cambios) # <--- CORREGIDO
         else:
-            message = "No hay datos de precios de competencia para actualizar."
+            message = f"No hay cambios de precios de competencia para aplicar ({unchanged} sin cambios, {len(unknown_ids)} desconocidos)."
             logging.info(message)
-            if cursor: cursor.close() # Asegurar cierre si se abrió
-            return True, message # <--- CORREGIDO (Éxito, sin cambios)
+            return _result(True, message, cambios) # <--- CORREGIDO (Éxito, sin cambios)
 
     except FileNotFoundError:
         message = f"Archivo {file_path} no encontrado. Saltando actualización."
         logging.warning(message)
-        return True, message # <--- CORREGIDO (Considerado éxito, tarea saltada)
+        return _result(True, message) # <--- CORREGIDO (Considerado éxito, tarea saltada)
         # O podrías devolver False si es crítico: return False, message
     except Error as e:
-        message = "Error actualizando precios de competencia: {e}"
+        message = f"Error actualizando precios de competencia: {e}"
         logging.error(message)
         conn.rollback()
-        if cursor: cursor.close()
-        return False, message # <--- CORREGIDO
+        return _result(False, message) # <--- CORREGIDO
     except Exception as ex:
-        message = "Error inesperado en update_competitor_prices: {ex}"
+        message = f"Error inesperado en update_competitor_prices: {ex}"
+        logging.error(message)
+        conn.rollback()
+        return _result(False, message) # <--- CORREGIDO
+
+
+# --- Ingesta por bloques (memoria acotada, reanudable) ---
+STREAM_CHUNK_SIZE = 5000
+
+def _checkpoint_signature(file_path, kind, chunk_size):
+    stat = os.stat(file_path)
+    return {
+        'file': os.path.abspath(file_path),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'kind': kind,
+        'chunk_size': chunk_size,
+    }
+
+def _load_checkpoint(checkpoint_path, signature):
+    """Devuelve el último bloque confirmado si el checkpoint corresponde al mismo archivo/configuración."""
+    if not os.path.exists(checkpoint_path):
+        return -1
+    try:
+        with open(checkpoint_path) as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Checkpoint ilegible ({checkpoint_path}), se empieza desde el inicio: {e}")
+        return -1
+    if {k: data.get(k) for k in signature} != signature:
+        logging.info("El checkpoint corresponde a otro archivo o configuración; se ignora.")
+        return -1
+    return int(data.get('last_chunk', -1))
+
+def _save_checkpoint(checkpoint_path, signature, last_chunk):
+    tmp_path = checkpoint_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({**signature, 'last_chunk': last_chunk}, f)
+    os.replace(tmp_path, checkpoint_path) # Escritura atómica
+
+def stream_update_prices(conn, file_path, kind='insumos', chunk_size=STREAM_CHUNK_SIZE, checkpoint_path=None):
+    """
+    Ingesta por bloques para archivos grandes (memoria acotada).
+    CSV se lee con pandas por bloques y .xlsx con el iterador de solo lectura de openpyxl;
+    cada bloque se valida, se aplica (solo cambios reales) y se confirma con su propio commit.
+    Tras cada commit se guarda un checkpoint: si el job se corta, la próxima corrida sobre el mismo
+    archivo retoma desde el bloque siguiente al último confirmado.
+
+    kind: 'insumos' o 'competencia'.
+    Devuelve (bool, str, dict) con éxito, mensaje y resumen (bloques, filas, cambios, desconocidos).
+    """
+    if kind not in ('insumos', 'competencia'):
+        raise ValueError(f"Tipo de archivo de precios no soportado: {kind}")
+    if not file_path or not os.path.exists(file_path):
+        logging.error(f"Archivo de precios ({kind}) no encontrado o no especificado: {file_path}")
+        return False, f"Archivo no encontrado: {file_path}", {}
+
+    checkpoint_path = checkpoint_path or f"{file_path}.checkpoint.json"
+    signature = _checkpoint_signature(file_path, kind, chunk_size)
+    last_done = _load_checkpoint(checkpoint_path, signature)
+    if last_done >= 0:
+        logging.info(f"Reanudando ingesta de {file_path} desde el bloque {last_done + 1}.")
+
+    id_col = 'ID_Insumo' if kind == 'insumos' else 'ID_Plato'
+    summary = {'chunks': 0, 'skipped_chunks': 0, 'rows': 0, 'changed': 0, 'unknown': 0}
+    unidades_uso = _fetch_unidades_uso(conn) if kind == 'insumos' else None
+    chunk_index = -1
+    try:
+        for chunk_index, chunk in enumerate(iter_price_file_chunks(file_path, chunk_size, id_col=id_col)):
+            if chunk_index <= last_done:
+                summary['skipped_chunks'] += 1
+                continue
+            if kind == 'insumos':
+                chunk = validate_insumo_prices(chunk)
+                cambios, unknown_ids, _ = apply_insumo_price_changes(conn, chunk, unidades_uso)
+            else:
+                chunk = validate_competitor_prices(chunk)
+                cambios, unknown_ids, _ = apply_competitor_price_changes(conn, chunk)
+            conn.commit()
+            _save_checkpoint(checkpoint_path, signature, chunk_index)
+            summary['chunks'] += 1
+            summary['rows'] += len(chunk)
+            summary['changed'] += len(cambios)
+            summary['unknown'] += len(unknown_ids)
+            logging.info(f"Bloque {chunk_index} confirmado: {len(chunk)} filas, {len(cambios)} cambios.")
+    except Error as e:
+        conn.rollback()
+        message = f"Error de BD en el bloque {chunk_index} de {file_path}: {e}. Se puede reanudar desde ese bloque."
         logging.error(message)
+        return False, message, summary
+    except Exception as ex:
         conn.rollback()
-        if cursor: cursor.close()
-        return False, message # <--- CORREGIDO
\ No newline at end of file
+        message = f"Error inesperado en el bloque {chunk_index} de {file_path}: {ex}. Se puede reanudar desde ese bloque."
+        logging.error(message, exc_info=True)
+        return False, message, summary
+
+    # Archivo completo: el checkpoint ya no hace falta
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    message = (
+        f"Ingesta por bloques de {kind}: {summary['chunks']} bloques ({summary['skipped_chunks']} ya confirmados), "
+        f"{summary['rows']} filas, {summary['changed']} cambios, {summary['unknown']} IDs desconocidos."
+    )
+    logging.info(message)
+    return True, message, summary
+
+
+# --- Ingesta de múltiples archivos desde un directorio ---
+PRICE_FILE_EXTENSIONS = ('.csv',) + EXCEL_EXTENSIONS
+
+def discover_price_files(directory):
+    """
+    Lista los archivos de precios (CSV / Excel) del directorio, ordenados por nombre.
+    Ese orden define la precedencia: ante un mismo ID en varios archivos gana el último
+    (ej: nombrar los archivos con prefijo de fecha "2025-04-06_proveedorA.csv").
+    """
+    files = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.startswith(('.', '~$')) or not os.path.isfile(path):
+            continue # Ocultos y archivos de bloqueo de Excel
+        if os.path.splitext(name)[1].lower() in PRICE_FILE_EXTENSIONS:
+            files.append(path)
+    return files
+
+def _parse_price_file(file_path, kind):
+    """Lee y valida un archivo (se ejecuta en un proceso del pool; debe ser función de módulo)."""
+    start = time.perf_counter()
+    try:
+        if kind == 'insumos':
+            df = validate_insumo_prices(read_price_file(file_path, id_col='ID_Insumo'))
+        else:
+            df = validate_competitor_prices(read_price_file(file_path, id_col='ID_Plato'))
+        error = None
+    except Exception as ex:
+        df, error = None, str(ex)
+    return {'file': file_path, 'df': df, 'rows': 0 if df is None else len(df),
+            'seconds': round(time.perf_counter() - start, 3), 'error': error}
+
+def parse_price_files(paths, kind, max_workers=None):
+    """
+    Parsea los archivos en paralelo en un pool de procesos (leer Excel es CPU-bound).
+    Devuelve los resultados en el mismo orden que `paths`.
+    """
+    if len(paths) <= 1:
+        return [_parse_price_file(path, kind) for path in paths]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(_parse_price_file, paths, [kind] * len(paths)))
+
+def merge_price_frames(parsed, kind):
+    """
+    Une los archivos parseados aplicando la precedencia determinista: el orden de `parsed`
+    (por nombre de archivo) y, dentro de cada archivo, la última fila. Devuelve (merged, conflicts)
+    donde conflicts es la cantidad de IDs que aparecen con valores distintos en más de un archivo.
+    """
+    id_col, price_col = ('ID_Insumo', 'Nuevo_Costo_Compra') if kind == 'insumos' else ('ID_Plato', 'Precio_Competencia_Nuevo')
+    frames = [p['df'].assign(_orden=i) for i, p in enumerate(parsed) if p['df'] is not None and not p['df'].empty]
+    if not frames:
+        return pd.DataFrame(columns=INSUMO_PRICE_COLUMNS if kind == 'insumos' else COMPETITOR_PRICE_COLUMNS), 0
+    stacked = pd.concat(frames, ignore_index=True)
+    per_file = stacked.drop_duplicates(subset=[id_col, '_orden'], keep='last')
+    distinct = per_file.groupby(id_col)[price_col].nunique()
+    conflicts = int((distinct > 1).sum())
+    merged = per_file.drop_duplicates(subset=id_col, keep='last').drop(columns='_orden')
+    return merged.reset_index(drop=True), conflicts
+
+def update_prices_from_directory(conn, directory, kind='insumos', max_workers=None):
+    """
+    Modo directorio: descubre todos los archivos de precios, los parsea en paralelo,
+    resuelve IDs repetidos por precedencia (ver discover_price_files) y escribe el resultado
+    combinado en una sola operación masiva (tabla staging + UPDATE ... JOIN).
+    Si algún archivo no se puede leer no se escribe nada.
+    Devuelve (bool, str, dict) con éxito, mensaje y resumen (incluye tiempo y filas por archivo).
+    """
+    if kind not in ('insumos', 'competencia'):
+        raise ValueError(f"Tipo de archivo de precios no soportado: {kind}")
+    if not directory or not os.path.isdir(directory):
+        logging.error(f"Directorio de precios ({kind}) no encontrado: {directory}")
+        return False, f"Directorio no encontrado: {directory}", {}
+
+    paths = discover_price_files(directory)
+    if not paths:
+        message = f"No se encontraron archivos de precios ({kind}) en {directory}."
+        logging.info(message)
+        return True, message, {'files': []}
+
+    start = time.perf_counter()
+    parsed = parse_price_files(paths, kind, max_workers=max_workers)
+    files_report = [{k: p[k] for k in ('file', 'rows', 'seconds', 'error')} for p in parsed]
+    for rep in files_report:
+        logging.info(f"Parseado {rep['file']}: {rep['rows']} filas en {rep['seconds']}s" + (f" (ERROR: {rep['error']})" if rep['error'] else ""))
+    summary = {'files': files_report, 'parse_seconds': round(time.perf_counter() - start, 3)}
+
+    failed = [rep['file'] for rep in files_report if rep['error']]
+    if failed:
+        message = f"No se pudieron leer {len(failed)} archivos de {kind}; no se aplicaron cambios: {failed}"
+        logging.error(message)
+        return False, message, summary
+
+    merged, conflicts = merge_price_frames(parsed, kind)
+    summary.update({'merged_rows': len(merged), 'conflicts': conflicts})
+    if conflicts:
+        logging.warning(f"{conflicts} IDs con precios distintos en varios archivos; se aplicó la precedencia por nombre de archivo.")
+
+    try:
+        if kind == 'insumos':
+            result = bulk_update_insumos(conn, [merged])
+        else:
+            result = bulk_update_competitors(conn, [merged])
+        conn.commit()
+    except Error as e:
+        conn.rollback()
+        message = f"Error de BD aplicando precios de {kind} desde {directory}: {e}"
+        logging.error(message)
+        return False, message, summary
+    except Exception as ex:
+        conn.rollback()
+        message = f"Error inesperado aplicando precios de {kind} desde {directory}: {ex}"
+        logging.error(message, exc_info=True)
+        return False, message, summary
+
+    summary.update(result)
+    message = (
+        f"Modo directorio ({kind}): {len(paths)} archivos, {len(merged)} IDs combinados ({conflicts} en conflicto), "
+        f"{result['changed']} cambios, {len(result['unknown_ids'])} IDs desconocidos."
+    )
+    logging.info(message)
+    return True, message, summary
+
+
+# --- Parámetros financieros ---
+FINANCIAL_PARAM_COLUMNS = ('market_discount', 'iva_rate', 'commission_rate')
+
+def update_financial_params(conn, param_id=1, **values):
+    """
+    Actualiza FINANCIAL_PARAMS (market_discount, iva_rate, commission_rate) y, si es el
+    juego 1 (el que usa V_PLATOS_FINANCIALS), refresca las tablas materializadas en la misma
+    transacción, ya que todos sus márgenes dependen de estos parámetros. Devuelve (bool, str).
+    """
+    unknown = set(values) - set(FINANCIAL_PARAM_COLUMNS)
+    if unknown:
+        return False, f"Parámetros financieros desconocidos: {sorted(unknown)}"
+    values = {k: v for k, v in values.items() if v is not None}
+    if not values:
+        return True, "No hay parámetros financieros para actualizar."
+
+    assignments = ", ".join(f"{col} = %s" for col in values)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            f"UPDATE FINANCIAL_PARAMS SET {assignments}, last_updated = NOW() WHERE param_id = %s;",
+            list(values.values()) + [param_id],
+        )
+        if cursor.rowcount == 0:
+            conn.rollback()
+            return False, f"No existe FINANCIAL_PARAMS con param_id = {param_id}."
+        versions = refresh_materialized(conn) if param_id == 1 else {}
+        conn.commit()
+        message = f"Parámetros financieros {param_id} actualizados ({', '.join(values)}); tablas materializadas: {versions or 'sin cambios'}."
+        logging.info(message)
+        return True, message
+    except Error as e:
+        conn.rollback()
+        message = f"Error actualizando parámetros financieros: {e}"
+        logging.error(message)
+        return False, message
+    finally:
+        cursor.close()
+
+
+def list_financial_params(conn):
+    """Todos los juegos de FINANCIAL_PARAMS (uno por plataforma, cliente, etc.) como DataFrame."""
+    return pd.read_sql_query(
+        "SELECT param_id, market_discount, iva_rate, commission_rate, last_updated FROM FINANCIAL_PARAMS ORDER BY param_id;",
+        conn,
+    )
+
+
+def add_financial_param_set(conn, param_id, market_discount, iva_rate, commission_rate):
+    """
+    Crea un nuevo juego de FINANCIAL_PARAMS. Falla si el param_id ya existe (para editarlo
+    usar update_financial_params). Devuelve (bool, str).
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            INSERT INTO FINANCIAL_PARAMS (param_id, market_discount, iva_rate, commission_rate, last_updated)
+            VALUES (%s, %s, %s, %s, NOW());
+        """, (param_id, market_discount, iva_rate, commission_rate))
+        conn.commit()
+        message = f"Juego de parámetros financieros {param_id} creado."
+        logging.info(message)
+        return True, message
+    except Error as e:
+        conn.rollback()
+        message = f"Error creando parámetros financieros {param_id}: {e}"
+        logging.error(message)
+        return False, message
+    finally:
+        cursor.close()
@@ -0,0 +1,137 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+# Simulador de escenarios de precios ("¿y si la harina sube 30% y la mozzarella 15%?").
+# Trabaja sobre la matriz aplanada platos x insumos del motor de costeo (costing_engine),
+# así que S escenarios se resuelven con un solo producto matriz dispersa x matriz densa,
+# sin tocar la base de datos.
+#
+# Nota: como en CostingEngine.insumo_matrix(), los insumos sin Costo_Por_Unidad_Uso (NULL)
+# cuentan como costo 0.
+
+SCENARIO_METRICS = ('Costo_Plato', 'PBA', 'PNA', 'Margen_Bruto_Actual_MBA', 'Porcentaje_Margen_Bruto_PctMBA')
+
+
+class ScenarioResult:
+    """
+    Resultado de una simulación: una matriz (escenarios x platos) por métrica.
+    Atributos: scenario_names, plato_ids, plato_names y arrays costo, pba, pna, mba, pct_mba.
+    """
+
+    def __init__(self, scenario_names, plato_ids, plato_names, costo, pba, pna, mba, pct_mba):
+        self.scenario_names = list(scenario_names)
+        self.plato_ids = list(plato_ids)
+        self.plato_names = list(plato_names)
+        self.costo = costo
+        self.pba = pba
+        self.pna = pna
+        self.mba = mba
+        self.pct_mba = pct_mba
+
+    def to_frame(self, scenarios=None):
+        """Formato largo (Escenario, ID_Plato, métricas), opcionalmente solo algunos escenarios."""
+        rows = range(len(self.scenario_names)) if scenarios is None else [
+            self.scenario_names.index(s) for s in scenarios
+        ]
+        n_platos = len(self.plato_ids)
+        frames = []
+        for i in rows:
+            frames.append(pd.DataFrame({
+                'Escenario': [self.scenario_names[i]] * n_platos,
+                'ID_Plato': self.plato_ids,
+                'Nombre_Plato': self.plato_names,
+                'Costo_Plato': self.costo[i],
+                'PBA': self.pba[i],
+                'PNA': self.pna[i],
+                'Margen_Bruto_Actual_MBA': self.mba[i],
+                'Porcentaje_Margen_Bruto_PctMBA': self.pct_mba[i],
+            }))
+        if not frames:
+            return pd.DataFrame(columns=['Escenario', 'ID_Plato', 'Nombre_Plato', *SCENARIO_METRICS])
+        return pd.concat(frames, ignore_index=True)
+
+    def summary(self):
+        """Una fila por escenario: costo y margen promedio, margen total y platos con margen negativo."""
+        with np.errstate(invalid='ignore'):
+            return pd.DataFrame({
+                'Escenario': self.scenario_names,
+                'Costo_Promedio': np.nanmean(self.costo, axis=1) if self.costo.size else np.nan,
+                'Margen_Total': np.nansum(self.mba, axis=1),
+                'Pct_Margen_Promedio': np.nanmean(self.pct_mba, axis=1) if self.pct_mba.size else np.nan,
+                'Platos_Margen_Negativo': (self.mba < 0).sum(axis=1),
+            })
+
+
+def build_multiplier_matrix(engine, scenarios):
+    """
+    Arma la matriz S x I de multiplicadores (1.0 = sin cambio) en el orden de engine.insumo_ids.
+    `scenarios`: DataFrame (índice = escenario, columnas = ID_Insumo) o dict
+    {escenario: {ID_Insumo: multiplicador}}. Los insumos desconocidos se ignoran con un aviso.
+    Devuelve (nombres de escenario, matriz numpy).
+    """
+    if isinstance(scenarios, pd.DataFrame):
+        scenarios = {name: row.dropna().to_dict() for name, row in scenarios.iterrows()}
+    names = list(scenarios)
+    positions = {id_: i for i, id_ in enumerate(engine.insumo_ids)}
+    matrix = np.ones((len(names), len(engine.insumo_ids)), dtype='float64')
+    unknown = set()
+    for s, name in enumerate(names):
+        for id_insumo, mult in scenarios[name].items():
+            pos = positions.get(id_insumo)
+            if pos is None:
+                unknown.add(id_insumo)
+                continue
+            matrix[s, pos] = float(mult)
+    if unknown:
+        logging.warning(f"Insumos desconocidos en los escenarios (ignorados): {sorted(unknown)[:50]}")
+    return names, matrix
+
+
+def simulate_price_shocks(engine, multipliers, params, scenario_names=None):
+    """
+    Calcula costo, PBA, PNA, Margen_Bruto_Actual_MBA y Porcentaje_Margen_Bruto_PctMBA de cada
+    plato bajo cada escenario, en una sola pasada vectorizada.
+
+    `engine`: CostingEngine ya cargado. `params`: dict de FINANCIAL_PARAMS.
+    `multipliers`: matriz S x I (orden engine.insumo_ids), o DataFrame/dict como en
+    build_multiplier_matrix. Solo se incluyen los platos que V_PLATOS_FINANCIALS mostraría
+    (con receta costeada y Precio_Competencia > 0).
+    """
+    if isinstance(multipliers, (pd.DataFrame, dict)):
+        scenario_names, multipliers = build_multiplier_matrix(engine, multipliers)
+    multipliers = np.atleast_2d(np.asarray(multipliers, dtype='float64'))
+    if multipliers.shape[1] != len(engine.insumo_ids):
+        raise ValueError(f"Se esperaban {len(engine.insumo_ids)} columnas de insumos, llegaron {multipliers.shape[1]}.")
+    if scenario_names is None:
+        scenario_names = [f"Escenario {i + 1}" for i in range(multipliers.shape[0])]
+
+    precio = engine.precio_competencia
+    mask = engine.plato_in_view_mask() & (precio > 0)
+    W = engine.insumo_matrix()[mask]
+    base_costs = np.nan_to_num(engine.insumo_costs)
+
+    # (P x I) @ (I x S) -> P x S; transpuesto para dejar escenarios en filas
+    costo = np.asarray(W @ (multipliers * base_costs).T).T
+
+    md = float(params['market_discount'])
+    iva = float(params['iva_rate'])
+    comm = float(params['commission_rate'])
+    pba = md * precio[mask]
+    pna = pba / (1 + iva)
+    ct = costo + pba * comm
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct = 1 - ct / np.where(pna == 0, np.nan, pna)
+    n = multipliers.shape[0]
+    ids = np.asarray(engine.plato_ids, dtype=object)[mask]
+    names = np.asarray(engine.plato_names, dtype=object)[mask]
+    logging.info(f"Simulados {n} escenarios sobre {mask.sum()} platos.")
+    return ScenarioResult(
+        scenario_names, ids, names,
+        costo=costo,
+        pba=np.broadcast_to(pba, costo.shape),
+        pna=np.broadcast_to(pna, costo.shape),
+        mba=pna - ct,
+        pct_mba=pct,
+    )
@@ -0,0 +1,79 @@
+import re
+
+import numpy as np
+
+# Especificación de filtros para leer la simulación de campañas: plataformas, campañas,
+# categorías de plato, margen mínimo y columnas. Se traduce a WHERE + proyección (vista /
+# tabla materializada) o a selección de campañas/platos antes del broadcast (motor en memoria),
+# así la página solo trae las filas y columnas que va a mostrar.
+# key() da una tupla hashable para usar como clave de caché.
+
+# Columnas que el análisis necesita siempre (conflictos de exclusividad, selección para el brief)
+ALWAYS_COLUMNS = ('CampaignID', 'ID_Plato', 'IsExclusive')
+
+_IDENTIFIER = re.compile(r'^\w+$')
+
+
+def _values(values):
+    if values is None:
+        return None
+    if isinstance(values, str):
+        values = [values]
+    return tuple(sorted({str(v) for v in values}))
+
+
+class SimulationFilter:
+    """Filtro de simulación; None en un criterio significa "sin filtrar"."""
+
+    def __init__(self, platforms=None, campaigns=None, categories=None, min_margin_pct=None, columns=None):
+        self.platforms = _values(platforms)
+        self.campaigns = _values(campaigns)    # por CampaignName, como en la página
+        self.categories = _values(categories)
+        self.min_margin_pct = None if min_margin_pct is None else float(min_margin_pct)
+        if columns is not None:
+            bad = [c for c in columns if not _IDENTIFIER.match(str(c))]
+            if bad:
+                raise ValueError(f"Nombres de columna inválidos: {bad}")
+            columns = tuple(dict.fromkeys([*ALWAYS_COLUMNS, *columns]))
+        self.columns = columns
+
+    def key(self):
+        return (self.platforms, self.campaigns, self.categories, self.min_margin_pct, self.columns)
+
+    @classmethod
+    def from_key(cls, key):
+        platforms, campaigns, categories, min_margin_pct, columns = key
+        return cls(platforms, campaigns, categories, min_margin_pct, columns)
+
+    def is_empty(self):
+        return self.key() == (None, None, None, None, None)
+
+    def where_clause(self):
+        """Devuelve (" WHERE ...", valores) para la vista o tabla materializada ("" si no filtra)."""
+        conditions, values = [], []
+        for column, selected in (('PlatformName', self.platforms), ('CampaignName', self.campaigns),
+                                 ('Categoria_Plato', self.categories)):
+            if selected is not None:
+                conditions.append(f"{column} IN ({', '.join(['%s'] * len(selected))})")
+                values.extend(selected)
+        if self.min_margin_pct is not None:
+            conditions.append("Pct_Margen_Bruto_Campaign >= %s")
+            values.append(self.min_margin_pct)
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), values
+
+    def select_query(self, source):
+        """SELECT con proyección y filtros sobre `source`. Devuelve (sql, valores)."""
+        columns = ", ".join(self.columns) if self.columns else "*"
+        where, values = self.where_clause()
+        return f"SELECT {columns} FROM {source}{where};", values
+
+    def mask(self, df):
+        """Máscara booleana equivalente, para frames ya cargados."""
+        keep = np.ones(len(df), dtype=bool)
+        for column, selected in (('PlatformName', self.platforms), ('CampaignName', self.campaigns),
+                                 ('Categoria_Plato', self.categories)):
+            if selected is not None and column in df.columns:
+                keep &= df[column].isin(selected).to_numpy()
+        if self.min_margin_pct is not None and 'Pct_Margen_Bruto_Campaign' in df.columns:
+            keep &= (df['Pct_Margen_Bruto_Campaign'] >= self.min_margin_pct).to_numpy()
+        return keep
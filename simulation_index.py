@@ -0,0 +1,101 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+# Índices para filtrar la simulación de campañas en la página sin recorrer el frame completo
+# en cada rerun de Streamlit. Se construyen una vez por conjunto de datos cargado:
+#   - posiciones de filas por PlatformName, CampaignName y Categoria_Plato (arrays ordenados),
+#   - listas de opciones ya ordenadas y campañas por plataforma,
+#   - permutación por Pct_Margen_Bruto_Campaign descendente y el rango de cada fila en ella.
+# Una combinación de filtros se resuelve intersectando arrays de posiciones; el margen mínimo
+# es un corte del orden por margen y el top-N, un slice.
+
+INDEXED_COLUMNS = ('PlatformName', 'CampaignName', 'Categoria_Plato')
+MARGIN_COLUMN = 'Pct_Margen_Bruto_Campaign'
+
+
+def _group_positions(series):
+    """{valor: posiciones (ordenadas)} a partir de códigos enteros, sin comparar strings."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes, categories = series.cat.codes.to_numpy(), series.cat.categories
+    else:
+        codes, categories = pd.factorize(series)
+    order = np.argsort(codes, kind='stable')
+    counts = np.bincount(codes[codes >= 0], minlength=len(categories))
+    start = np.count_nonzero(codes < 0)  # los NULL (-1) quedan primeros
+    groups = {}
+    for value, count in zip(categories, counts):
+        if count:
+            groups[value] = order[start:start + count]
+        start += count
+    return groups
+
+
+class SimulationIndex:
+    """Índice de filtros sobre un DataFrame de simulación ya cargado (no lo copia)."""
+
+    def __init__(self, df):
+        self.df = df
+        self.groups = {col: _group_positions(df[col]) for col in INDEXED_COLUMNS if col in df.columns}
+        self.options = {col: sorted(groups, key=str) for col, groups in self.groups.items()}
+        self.platform_campaigns = {}
+        if {'PlatformName', 'CampaignName'}.issubset(df.columns):
+            pairs = df[['PlatformName', 'CampaignName']].drop_duplicates()
+            for platform, names in pairs.groupby('PlatformName', observed=True)['CampaignName']:
+                self.platform_campaigns[platform] = sorted(names.dropna().unique(), key=str)
+
+        pct = df[MARGIN_COLUMN].to_numpy(dtype='float64') if MARGIN_COLUMN in df.columns else np.full(len(df), np.nan)
+        # Orden descendente por margen, NaN al final
+        self.by_margin = np.argsort(np.where(np.isnan(pct), np.inf, -pct), kind='stable')
+        self.sorted_margin = pct[self.by_margin]
+        self.n_valid = int(np.count_nonzero(~np.isnan(pct)))
+        self.rank = np.empty(len(df), dtype='int64')
+        self.rank[self.by_margin] = np.arange(len(df))
+        self.conflicts = (
+            np.flatnonzero(df['Exclusivity_Conflict'].to_numpy()) if 'Exclusivity_Conflict' in df.columns else None
+        )
+        logging.info(f"Índice de simulación: {len(df)} filas, " + ", ".join(
+            f"{len(g)} {col}" for col, g in self.groups.items()
+        ))
+
+    def campaigns_for(self, platform=None):
+        """Campañas disponibles (ordenadas), opcionalmente solo las de una plataforma."""
+        if platform is None:
+            return self.options.get('CampaignName', [])
+        return self.platform_campaigns.get(platform, [])
+
+    def _margin_cut(self, min_margin_pct):
+        """Cantidad de filas (en orden por margen) con margen >= min_margin_pct."""
+        if min_margin_pct is None:
+            return len(self.by_margin)
+        valid = self.sorted_margin[:self.n_valid]
+        return int(np.searchsorted(-valid, -min_margin_pct, side='right'))
+
+    def positions(self, platform=None, campaign=None, category=None, min_margin_pct=None,
+                  only_conflicts=False, top_n=None):
+        """
+        Posiciones de las filas que cumplen los filtros, ordenadas por margen descendente.
+        None en un filtro significa "todas".
+        """
+        cut = self._margin_cut(min_margin_pct)
+        sets = []
+        for col, value in (('PlatformName', platform), ('CampaignName', campaign), ('Categoria_Plato', category)):
+            if value is not None:
+                sets.append(self.groups.get(col, {}).get(value, np.empty(0, dtype='int64')))
+        if only_conflicts and self.conflicts is not None:
+            sets.append(self.conflicts)
+        if not sets:
+            result = self.by_margin[:cut]
+        else:
+            sets.sort(key=len)
+            pos = sets[0]
+            for other in sets[1:]:
+                pos = np.intersect1d(pos, other, assume_unique=True)
+            ranks = np.sort(self.rank[pos])
+            result = self.by_margin[ranks[ranks < cut]]
+        return result[:top_n] if top_n else result
+
+    def select(self, **filters):
+        """Filas que cumplen los filtros (ver positions), en orden de margen descendente."""
+        return self.df.take(self.positions(**filters))
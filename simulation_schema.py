@@ -0,0 +1,85 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+# Modelo de columnas tipadas para los datos de simulación de campañas. Se aplica una sola vez
+# al cargar (get_campaign_simulation_data): las dimensiones de texto pasan a category y las
+# medidas a float32, así la página no repite pd.to_numeric en cada rerun y cada sesión guarda
+# en st.session_state un frame varias veces más chico.
+# float32 alcanza para precios y márgenes (~7 dígitos significativos); los totales que se
+# calculan a partir de estas columnas conviene acumularlos en float64.
+
+DIMENSION_COLUMNS = ['CampaignID', 'PlatformName', 'CampaignName', 'ID_Plato', 'Nombre_Plato', 'Categoria_Plato']
+FLAG_COLUMNS = ['IsExclusive', 'Exclusivity_Conflict']
+MEASURE_COLUMNS = [
+    'Discount_Pct', 'Costo_Plato', 'Precio_Competencia', 'Precio_Bruto_Campaign',
+    'Precio_Neto_Campaign', 'Margen_Bruto_Campaign', 'Pct_Margen_Bruto_Campaign',
+]
+REQUIRED_COLUMNS = ['CampaignID', 'PlatformName', 'CampaignName', 'ID_Plato', 'IsExclusive',
+                    'Precio_Bruto_Campaign', 'Margen_Bruto_Campaign', 'Pct_Margen_Bruto_Campaign']
+
+
+class SimulationSchemaError(ValueError):
+    """Los datos de simulación no cumplen el esquema esperado."""
+
+
+def _memory(df):
+    return int(df.memory_usage(deep=True).sum())
+
+
+def apply_simulation_schema(df, validate=True):
+    """
+    Convierte las columnas conocidas a su tipo (category / bool / float32) y devuelve un
+    DataFrame nuevo; las columnas desconocidas se dejan como están. Registra el uso de
+    memoria antes y después.
+    """
+    if df is None or len(df.columns) == 0:
+        return df
+    before = _memory(df)
+    converted = {}
+    for col in df.columns:
+        series = df[col]
+        if col in DIMENSION_COLUMNS:
+            converted[col] = series if isinstance(series.dtype, pd.CategoricalDtype) else series.astype('category')
+        elif col in FLAG_COLUMNS:
+            converted[col] = series.fillna(False).astype(bool)
+        elif col in MEASURE_COLUMNS:
+            # Decimal (MySQL) u object -> numérico; NULL -> NaN
+            converted[col] = pd.to_numeric(series, errors='coerce').astype('float32')
+        else:
+            converted[col] = series
+    typed = pd.DataFrame(converted, index=df.index)
+    if validate:
+        validate_simulation_schema(typed)
+    after = _memory(typed)
+    logging.info(
+        f"Esquema de simulación aplicado a {len(typed)} filas: {before / 2**20:.1f} MB -> "
+        f"{after / 2**20:.1f} MB ({before / max(after, 1):.1f}x)."
+    )
+    return typed
+
+
+def validate_simulation_schema(df):
+    """Verifica columnas obligatorias y tipos. Lanza SimulationSchemaError con el detalle."""
+    problems = [f"falta la columna {col}" for col in REQUIRED_COLUMNS if col not in df.columns]
+    for col in df.columns:
+        dtype = df[col].dtype
+        if col in DIMENSION_COLUMNS and not isinstance(dtype, pd.CategoricalDtype):
+            problems.append(f"{col} debería ser category ({dtype})")
+        elif col in FLAG_COLUMNS and dtype != np.bool_:
+            problems.append(f"{col} debería ser bool ({dtype})")
+        elif col in MEASURE_COLUMNS and dtype != np.float32:
+            problems.append(f"{col} debería ser float32 ({dtype})")
+    if problems:
+        raise SimulationSchemaError("Datos de simulación inválidos: " + "; ".join(problems))
+
+
+def memory_report(df):
+    """Uso de memoria por columna (MB) y tipo, de mayor a menor."""
+    usage = df.memory_usage(deep=True, index=False)
+    return pd.DataFrame({
+        'Columna': usage.index,
+        'Tipo': [str(df[c].dtype) for c in usage.index],
+        'MB': usage.to_numpy() / 2**20,
+    }).sort_values('MB', ascending=False).reset_index(drop=True)
@@ -3,10 +3,177 @@
 from mysql.connector import Error
 import logging
 import datetime
+from financial_history import AS_OF_SQL, DEFAULT_PARAM_ID, HistorySchemaError, check_history_param_column
 
-def create_financial_snapshot(conn):
+# Equivalente de V_PLATOS_FINANCIALS para cualquier juego de FINANCIAL_PARAMS (la vista fija
+# param_id = 1). Mismas columnas y fórmulas; el param_id se pasa como valor (%s).
+PARAM_SET_FINANCIALS_SQL = """
+    SELECT
+        t.ID_Plato, t.Nombre_Plato, t.Costo_Plato, t.Precio_Competencia, t.PBA, t.PNA,
+        t.Costo_Plato / NULLIF(t.PNA, 0) AS COGS_Partner_Actual,
+        t.commission_rate AS Comision_Plataforma,
+        t.Costo_Plato + t.PBA * t.commission_rate AS Costo_Total_CT,
+        t.PNA - (t.Costo_Plato + t.PBA * t.commission_rate) AS Margen_Bruto_Actual_MBA,
+        1 - (t.Costo_Plato + t.PBA * t.commission_rate) / NULLIF(t.PNA, 0) AS Porcentaje_Margen_Bruto_PctMBA
+    FROM (
+        SELECT
+            vpc.ID_Plato, vpc.Nombre_Plato, vpc.Costo_Total_Plato_Calculado AS Costo_Plato,
+            p.Precio_Competencia, fp.commission_rate,
+            fp.market_discount * p.Precio_Competencia AS PBA,
+            (fp.market_discount * p.Precio_Competencia) / (1 + fp.iva_rate) AS PNA
+        FROM V_PLATOS_COSTOS vpc
+        JOIN PLATOS p ON vpc.ID_Plato = p.ID_Plato
+        JOIN FINANCIAL_PARAMS fp ON fp.param_id = %s
+        WHERE p.Precio_Competencia IS NOT NULL AND p.Precio_Competencia > 0
+    ) t
+"""
+
+def financials_source(conn, param_id=DEFAULT_PARAM_ID):
+    """
+    Fuente de indicadores financieros para un juego de parámetros: (fragmento FROM, valores).
+    param_id 1 usa V_PLATOS_FINANCIALS; los demás, PARAM_SET_FINANCIALS_SQL. No se usa
+    PLATOS_FINANCIALS_MAT: solo se refresca con cambios de precios o parámetros, y platos o
+    recetas editados directamente en la BD quedarían fuera del historial o con costos viejos.
+    """
+    if param_id == DEFAULT_PARAM_ID:
+        return "V_PLATOS_FINANCIALS", ()
+    return f"({PARAM_SET_FINANCIALS_SQL})", (param_id,)
+
+# INSERT ... SELECT que arma el snapshot completo dentro de la BD (sin viajar filas a Python).
+# Los parámetros y el timestamp se pasan como valores para que todas las filas queden
+# selladas con el mismo SnapshotTimestamp y los mismos FINANCIAL_PARAMS leídos en el PASO 1.
+# {source} sale de financials_source(): V_PLATOS_FINANCIALS o la consulta parametrizada para
+# otros param_id (siempre datos vigentes, nunca la tabla materializada).
+# Cada fila lleva el Param_Id del juego usado (una línea de tiempo por juego de parámetros).
+SERVER_SIDE_SNAPSHOT_SQL = """
+    INSERT INTO PLATOS_FINANCIALS_HISTORY (
+        SnapshotTimestamp, ID_Plato, Param_Id,
+        Costo_Plato_Hist, Precio_Competencia_Hist,
+        Market_Discount_Used, IVA_Rate_Used, Commission_Rate_Used,
+        PBA_Hist, PNA_Hist, COGS_Partner_Actual_Hist,
+        Costo_Total_CT_Hist, Margen_Bruto_Actual_MBA_Hist,
+        Porcentaje_Margen_Bruto_PctMBA_Hist
+    )
+    SELECT
+        %s, vpc.ID_Plato, %s,
+        vpc.Costo_Plato, p.Precio_Competencia,
+        %s, %s, %s,
+        vpc.PBA, vpc.PNA, vpc.COGS_Partner_Actual,
+        vpc.Costo_Total_CT, vpc.Margen_Bruto_Actual_MBA,
+        vpc.Porcentaje_Margen_Bruto_PctMBA
+    FROM
+        {source} vpc
+    JOIN
+        PLATOS p ON vpc.ID_Plato = p.ID_Plato
+    WHERE p.Precio_Competencia IS NOT NULL AND p.Precio_Competencia > 0;
+"""
+
+# Modo delta: solo se insertan los platos sin historial o cuyo costo, precio de competencia o
+# parámetros difieren de su última fila del mismo juego de parámetros (las columnas derivadas
+# dependen solo de esos cinco valores). La última fila se busca con un MAX(SnapshotTimestamp)
+# correlacionado sobre idx_history_param_plato_time. Los valores nuevos se llevan a la escala de las columnas _Hist antes
+# de comparar, para que el redondeo al guardar no cuente como cambio. <=> compara NULL = NULL.
+DELTA_SNAPSHOT_CONDITION = """
+      AND NOT EXISTS (
+        SELECT 1
+        FROM PLATOS_FINANCIALS_HISTORY h
+        WHERE h.Param_Id = %s AND h.ID_Plato = vpc.ID_Plato
+          AND h.SnapshotTimestamp = (
+              SELECT MAX(h2.SnapshotTimestamp) FROM PLATOS_FINANCIALS_HISTORY h2
+              WHERE h2.Param_Id = h.Param_Id AND h2.ID_Plato = vpc.ID_Plato
+          )
+          AND h.Costo_Plato_Hist <=> CAST(vpc.Costo_Plato AS DECIMAL(12,5))
+          AND h.Precio_Competencia_Hist <=> p.Precio_Competencia
+          AND h.Market_Discount_Used <=> CAST(%s AS DECIMAL(5,2))
+          AND h.IVA_Rate_Used <=> CAST(%s AS DECIMAL(5,2))
+          AND h.Commission_Rate_Used <=> CAST(%s AS DECIMAL(5,2))
+      )
+"""
+
+# Filas de baja del modo delta: platos cuya última fila está vigente (con precio) pero que ya
+# no salen en la fuente. Sin ellas la reconstrucción a una fecha los seguiría mostrando.
+# Argumentos: (timestamp, param_id, param_id, *valores de la fuente)
+TOMBSTONE_SNAPSHOT_SQL = """
+    INSERT INTO PLATOS_FINANCIALS_HISTORY (SnapshotTimestamp, ID_Plato, Param_Id)
+    SELECT DISTINCT %s, h.ID_Plato, h.Param_Id
+    FROM PLATOS_FINANCIALS_HISTORY h
+    JOIN (
+        SELECT Param_Id, ID_Plato, MAX(SnapshotTimestamp) AS SnapshotTimestamp
+        FROM PLATOS_FINANCIALS_HISTORY
+        WHERE Param_Id = %s
+        GROUP BY Param_Id, ID_Plato
+    ) ultimo ON h.Param_Id = ultimo.Param_Id AND h.ID_Plato = ultimo.ID_Plato
+            AND h.SnapshotTimestamp = ultimo.SnapshotTimestamp
+    WHERE h.Param_Id = %s AND h.Precio_Competencia_Hist IS NOT NULL
+      AND h.ID_Plato NOT IN (
+        SELECT vpc.ID_Plato
+        FROM {source} vpc
+        JOIN PLATOS p ON vpc.ID_Plato = p.ID_Plato
+        WHERE p.Precio_Competencia IS NOT NULL AND p.Precio_Competencia > 0
+      );
+"""
+
+def insert_snapshot_server_side(conn, params, snapshot_timestamp, param_id=DEFAULT_PARAM_ID, delta=False):
+    """
+    Inserta el snapshot con una única sentencia INSERT ... SELECT ejecutada en la BD.
+    Con delta=True inserta solo los platos que cambiaron desde su última fila y marca las
+    bajas (ver DELTA_SNAPSHOT_CONDITION y TOMBSTONE_SNAPSHOT_SQL).
+    No hace commit (lo decide quien llama). Devuelve (filas insertadas, bajas marcadas).
+    """
+    source, source_args = financials_source(conn, param_id)
+    param_values = (params.get('market_discount'), params.get('iva_rate'), params.get('commission_rate'))
+    sql = SERVER_SIDE_SNAPSHOT_SQL.format(source=source)
+    args = (snapshot_timestamp, param_id, *param_values, *source_args)
+    cursor = conn.cursor()
+    try:
+        tombstones = 0
+        if delta:
+            cursor.execute(TOMBSTONE_SNAPSHOT_SQL.format(source=source), (snapshot_timestamp, param_id, param_id, *source_args))
+            tombstones = cursor.rowcount
+            sql = sql.rstrip().rstrip(';') + DELTA_SNAPSHOT_CONDITION + ";"
+            args = (*args, param_id, *param_values)
+        cursor.execute(sql, args)
+        return cursor.rowcount, tombstones
+    finally:
+        cursor.close()
+
+def _round_or_none(value, digits):
+    return None if value is None else round(float(value), digits)
+
+def _delta_key(costo, precio, market_discount, iva_rate, commission_rate):
+    """Valores que deciden si un plato cambió, en la escala de las columnas _Hist."""
+    return (
+        _round_or_none(costo, 5), _round_or_none(precio, 2),
+        _round_or_none(market_discount, 2), _round_or_none(iva_rate, 2), _round_or_none(commission_rate, 2),
+    )
+
+def _latest_history_keys(conn, param_id=DEFAULT_PARAM_ID):
+    """{ID_Plato: clave delta de su última fila en ese juego de parámetros} (None para bajas)."""
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(AS_OF_SQL.format(plato_filter=""), (param_id, datetime.datetime.now()))
+        latest = {}
+        for row in sorted(cursor.fetchall(), key=lambda r: (r['SnapshotTimestamp'], r['SnapshotID'])):
+            latest[row['ID_Plato']] = None if row['Precio_Competencia_Hist'] is None else _delta_key(
+                row['Costo_Plato_Hist'], row['Precio_Competencia_Hist'],
+                row['Market_Discount_Used'], row['IVA_Rate_Used'], row['Commission_Rate_Used'],
+            )
+        return latest
+    finally:
+        cursor.close()
+
+def create_financial_snapshot(conn, server_side=True, param_id=DEFAULT_PARAM_ID, delta=False):
     """
     Consulta V_PLATOS_FINANCIALS, obtiene parámetros, y guarda el snapshot en HISTORY.
+    `param_id` elige el juego de FINANCIAL_PARAMS (por plataforma, cliente, etc.); con
+    valores distintos de 1 los indicadores se calculan con PARAM_SET_FINANCIALS_SQL. Las filas
+    se guardan con ese Param_Id y el modo delta compara solo contra el mismo juego.
+    Con server_side=True el snapshot se arma con un único INSERT ... SELECT dentro de la BD;
+    si esa sentencia falla se usa el camino original (leer filas y reinsertarlas con executemany).
+    Con delta=True solo se guardan los platos nuevos o cuyo costo, precio de competencia o
+    parámetros cambiaron desde su última fila, más una fila de baja por cada plato que dejó
+    de estar en la vista; el estado completo a una fecha se reconstruye con
+    financial_history.get_financials_as_of.
     Devuelve (bool, str) indicando éxito y un mensaje.
     """
     logging.info("Iniciando creación de snapshot financiero...")
@@ -17,31 +184,51 @@ def create_financial_snapshot(conn):
     success = False
 
     try:
+        # Historiales creados antes de Param_Id: la migración es un paso explícito del job
+        check_history_param_column(conn)
+
         # --- PASO 1: Leer parámetros actuales ---
         params_cursor = conn.cursor(dictionary=True)
-        params_cursor.execute("SELECT market_discount, iva_rate, commission_rate FROM FINANCIAL_PARAMS WHERE param_id = 1;") # O tu lógica de selección
+        params_cursor.execute("SELECT market_discount, iva_rate, commission_rate FROM FINANCIAL_PARAMS WHERE param_id = %s;", (param_id,))
         params = params_cursor.fetchone()
 #        params_cursor.close() # Cerrar cursor de parámetros, eliminado por causer problemas en el testing
 
         if not params:
-            message = "Error: No se encontraron parámetros financieros en FINANCIAL_PARAMS."
+            message = f"Error: No se encontraron parámetros financieros en FINANCIAL_PARAMS (param_id = {param_id})."
             logging.error(message)
             return False, message # Salir si no hay parámetros
 
+        # --- PASO 1b: Snapshot en la BD con una sola sentencia (modo preferido) ---
+        if server_side:
+            snapshot_timestamp = datetime.datetime.now()
+            try:
+                row_count, tombstones = insert_snapshot_server_side(conn, params, snapshot_timestamp, param_id, delta)
+                conn.commit()
+                message = f"Insertadas {row_count} filas en PLATOS_FINANCIALS_HISTORY (INSERT ... SELECT en servidor)."
+                if delta:
+                    message = (f"Snapshot delta: {row_count} platos con cambios y {tombstones} bajas "
+                               f"insertados en PLATOS_FINANCIALS_HISTORY (INSERT ... SELECT en servidor).")
+                logging.info(message)
+                return True, message
+            except Error as e:
+                logging.warning(f"Falló el snapshot en servidor, usando el camino fila a fila: {e}")
+                conn.rollback()
+
         # --- PASO 2: Consultar la vista con los cálculos actuales ---
         select_cursor = conn.cursor(dictionary=True)
-        query_vista = """
+        source, source_args = financials_source(conn, param_id)
+        query_vista = f"""
             SELECT
                 vpc.*,
                 p.Precio_Competencia,
                 p.Nombre_Plato -- Asegurarse de incluir Nombre_Plato si lo quieres usar
             FROM
-                V_PLATOS_FINANCIALS vpc
+                {source} vpc
             JOIN
                 PLATOS p ON vpc.ID_Plato = p.ID_Plato
             WHERE p.Precio_Competencia IS NOT NULL AND p.Precio_Competencia > 0;
         """
-        select_cursor.execute(query_vista)
+        select_cursor.execute(query_vista, source_args)
         results = select_cursor.fetchall()
         # select_cursor.close() # Cerrar cursor de selección. Eliminado por Testing
         logging.info(f"Se obtuvieron {len(results)} filas de V_PLATOS_FINANCIALS.")
@@ -55,14 +242,14 @@ def create_financial_snapshot(conn):
             snapshot_timestamp = datetime.datetime.now()
             insert_sql = """
                 INSERT INTO PLATOS_FINANCIALS_HISTORY (
-                    SnapshotTimestamp, ID_Plato,
+                    SnapshotTimestamp, ID_Plato, Param_Id,
                     Costo_Plato_Hist, Precio_Competencia_Hist,
                     Market_Discount_Used, IVA_Rate_Used, Commission_Rate_Used,
                     PBA_Hist, PNA_Hist, COGS_Partner_Actual_Hist,
                     Costo_Total_CT_Hist, Margen_Bruto_Actual_MBA_Hist,
                     Porcentaje_Margen_Bruto_PctMBA_Hist
                 ) VALUES (
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
+                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
                 );
             """
             history_data = []
@@ -71,6 +258,7 @@ def create_financial_snapshot(conn):
                 history_data.append((
                     snapshot_timestamp,
                     row.get('ID_Plato'),
+                    param_id,
                     row.get('Costo_Plato'),
                     row.get('Precio_Competencia'),
                     params.get('market_discount'),
@@ -84,6 +272,23 @@ def create_financial_snapshot(conn):
                     row.get('Porcentaje_Margen_Bruto_PctMBA')
                 ))
 
+            if delta:
+                # Solo platos nuevos o con cambios, más las bajas (fila con solo ID y timestamp)
+                latest = _latest_history_keys(conn, param_id)
+                history_data = [
+                    r for r in history_data
+                    if latest.get(r[1]) != _delta_key(*r[3:8])
+                ]
+                current_ids = {row.get('ID_Plato') for row in results}
+                history_data.extend(
+                    (snapshot_timestamp, plato_id, param_id) + (None,) * 11
+                    for plato_id, key in latest.items() if key is not None and plato_id not in current_ids
+                )
+                if not history_data:
+                    message = "Snapshot delta: ningún plato cambió desde el último snapshot. No se insertaron filas."
+                    logging.info(message)
+                    return True, message
+
             if history_data:
                 # Realizar inserción
                 insert_cursor = conn.cursor()
@@ -105,6 +310,9 @@ def create_financial_snapshot(conn):
         conn.rollback() # Revertir en caso de error de BD
         message = f"Error de BD al crear snapshot: {e}"
         success = False
+    except HistorySchemaError as ex:
+        message = str(ex)
+        success = False
     except Exception as ex:
         logging.error(f"Error inesperado creando snapshot financiero: {ex}", exc_info=True)
         # No hacer rollback necesariamente aquí, podría ser un error de Python, no de BD
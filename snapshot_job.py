@@ -5,9 +5,14 @@ import argparse
 import datetime
 import logging
 import os
-from . import db_connection
-from . import price_updaters
-from . import snapshot_creator
+import db_connection
+import price_updaters
+import snapshot_creator
+import history_archive
+import kpi_rollups
+import financial_history
+import materialized_views
+import campaign_engine
 import sys # Para salir si falla la conexión
 
 # --- Configuración de Logging ---
@@ -25,6 +30,9 @@ logging.basicConfig(
 # Define rutas por defecto que pueden ser sobrescritas por Env Vars o Argparse
 DEFAULT_INSUMOS_CSV = os.getenv('INSUMOS_CSV_PATH', 'nuevos_precios_insumos.csv')
 DEFAULT_COMPETENCIA_XLSX = os.getenv('COMPETENCIA_FILE_PATH', 'precios_competencia.xlsx')
+# Directorios "drop" con un archivo por proveedor / fuente de competencia (opcionales)
+DEFAULT_INSUMOS_DIR = os.getenv('INSUMOS_DIR_PATH')
+DEFAULT_COMPETENCIA_DIR = os.getenv('COMPETENCIA_DIR_PATH')
 
 
 def run_job(args):
@@ -37,40 +45,114 @@ def run_job(args):
     competencia_file = args.competencia_file if args.competencia_file else DEFAULT_COMPETENCIA_XLSX
 
     try:
-        connection = db_connection.connect_db()
+        connection = db_connection.get_pooled_connection()
         if not (connection and connection.is_connected()):
             logging.critical("FALLO CRÍTICO: No se pudo establecer conexión con la base de datos. Abortando.")
             sys.exit(1) # Salir con código de error
-
         # --- Ejecutar Pasos Solicitados ---
         tasks_to_run = {
+            # DDL sobre PLATOS_FINANCIALS_HISTORY (historiales creados antes de Param_Id): solo a pedido
+            "migrate_history": args.migrate_history,
             "insumos": args.run_all or args.update_insumos,
             "competencia": args.run_all or args.update_competencia,
-            "snapshot": args.run_all or args.create_snapshot
+            "campaigns": args.run_all or args.refresh_campaigns,
+            # Control offline (lee toda V_CAMPAIGN_SIMULATION): solo a pedido
+            "verify_campaigns": args.verify_campaign_engine,
+            "snapshot": args.run_all or args.create_snapshot,
+            "archive": args.run_all or args.archive_history,
+            # Los rollups se mantienen con cada snapshot; --rebuild-rollups los recalcula todos
+            "rollups": args.run_all or args.create_snapshot or args.rebuild_rollups
         }
         results = {}
 
+        if tasks_to_run["migrate_history"]:
+            logging.info("--- Iniciando: Migración de PLATOS_FINANCIALS_HISTORY (Param_Id) ---")
+            success, msg = financial_history.migrate_history_param_column(connection)
+            results["migrate_history"] = {"success": success, "message": msg}
+            if success: logging.info(f"--- Finalizado: Migración historial - {msg} ---")
+            else: logging.error(f"--- FALLO: Migración historial - {msg} ---")
+
         if tasks_to_run["insumos"]:
             logging.info(f"--- Iniciando: Actualización precios insumos ({insumos_file}) ---")
-            success, msg = price_updaters.update_insumo_prices(connection, file_path=insumos_file)
-            results["insumos"] = {"success": success, "message": msg}
+            if args.insumos_dir:
+                logging.info(f"Modo directorio para insumos: {args.insumos_dir}")
+                success, msg, summary = price_updaters.update_prices_from_directory(connection, args.insumos_dir, 'insumos', max_workers=args.workers)
+                changes = summary.get("changes")
+            elif args.streaming:
+                success, msg, summary = price_updaters.stream_update_prices(connection, insumos_file, 'insumos', chunk_size=args.chunk_size)
+                changes = None # En modo por bloques solo se informan totales
+            elif args.bulk_insumos:
+                success, msg, summary = price_updaters.update_insumo_prices_bulk(connection, file_path=insumos_file)
+                changes = summary.get("changes")
+            else:
+                success, msg, changes = price_updaters.update_insumo_prices(connection, file_path=insumos_file, return_changes=True)
+            # Set de cambios estructurado (valor anterior, nuevo y Pct_Delta) para pasos siguientes
+            results["insumos"] = {"success": success, "message": msg, "changes": changes}
             if success: logging.info(f"--- Finalizado: Actualización insumos - {msg} ---")
             else: logging.error(f"--- FALLO: Actualización insumos - {msg} ---")
 
         if tasks_to_run["competencia"]:
             logging.info(f"--- Iniciando: Actualización precios competencia ({competencia_file}) ---")
-            success, msg = price_updaters.update_competitor_prices(connection, file_path=competencia_file)
-            results["competencia"] = {"success": success, "message": msg}
+            if args.competencia_dir:
+                logging.info(f"Modo directorio para competencia: {args.competencia_dir}")
+                success, msg, summary = price_updaters.update_prices_from_directory(connection, args.competencia_dir, 'competencia', max_workers=args.workers)
+                changes = summary.get("changes")
+            elif args.streaming:
+                success, msg, summary = price_updaters.stream_update_prices(connection, competencia_file, 'competencia', chunk_size=args.chunk_size)
+                changes = None
+            else:
+                success, msg, changes = price_updaters.update_competitor_prices(connection, file_path=competencia_file, return_changes=True)
+            results["competencia"] = {"success": success, "message": msg, "changes": changes}
             if success: logging.info(f"--- Finalizado: Actualización competencia - {msg} ---")
             else: logging.error(f"--- FALLO: Actualización competencia - {msg} ---")
 
+        if tasks_to_run["campaigns"]:
+            # CAMPAIGNS se edita fuera de la app: su tabla materializada se refresca aquí
+            logging.info("--- Iniciando: Refresco de CAMPAIGN_SIMULATION_MAT ---")
+            success, msg = materialized_views.refresh_campaign_simulation(connection)
+            results["campaigns"] = {"success": success, "message": msg}
+            if success: logging.info(f"--- Finalizado: Refresco campañas - {msg} ---")
+            else: logging.error(f"--- FALLO: Refresco campañas - {msg} ---")
+
+        if tasks_to_run["verify_campaigns"]:
+            logging.info("--- Iniciando: Verificación del motor de campañas contra V_CAMPAIGN_SIMULATION ---")
+            success, msg, diff = campaign_engine.verify_against_view(connection)
+            results["verify_campaigns"] = {"success": success, "message": msg}
+            if success: logging.info(f"--- Finalizado: Verificación motor de campañas - {msg} ---")
+            else: logging.error(f"--- FALLO: Verificación motor de campañas - {msg}\n{diff.head(20)} ---")
+
         if tasks_to_run["snapshot"]:
             logging.info("--- Iniciando: Creación de snapshot financiero ---")
-            success, msg = snapshot_creator.create_financial_snapshot(connection)
+            success, msg = snapshot_creator.create_financial_snapshot(connection, param_id=args.param_id, delta=args.delta)
             results["snapshot"] = {"success": success, "message": msg}
             if success: logging.info(f"--- Finalizado: Creación snapshot - {msg} ---")
             else: logging.error(f"--- FALLO: Creación snapshot - {msg} ---")
 
+        if tasks_to_run["rollups"]:
+            if args.rebuild_rollups:
+                logging.info("--- Iniciando: Reconstrucción de rollups de KPIs ---")
+                success, msg = kpi_rollups.rebuild_kpi_rollups(connection)
+            elif args.param_id != financial_history.DEFAULT_PARAM_ID:
+                success, msg = None, None # Los rollups son del juego de parámetros de la vista
+                logging.info(f"--- Omitido: Rollups KPIs (snapshot de param_id {args.param_id}) ---")
+            elif results.get("snapshot", {}).get("success"):
+                logging.info("--- Iniciando: Actualización de rollups de KPIs (períodos del nuevo snapshot) ---")
+                success, msg = kpi_rollups.update_kpi_rollups(connection)
+            else:
+                success, msg = None, None # El snapshot falló: no hay períodos nuevos que actualizar
+                logging.warning("--- Omitido: Rollups KPIs (sin snapshot nuevo) ---")
+            if success is not None:
+                results["rollups"] = {"success": success, "message": msg}
+                if success: logging.info(f"--- Finalizado: Rollups KPIs - {msg} ---")
+                else: logging.error(f"--- FALLO: Rollups KPIs - {msg} ---")
+
+        if tasks_to_run["archive"]:
+            logging.info(f"--- Iniciando: Archivo Parquet del historial ({args.archive_dir}) ---")
+            success, msg = history_archive.export_history(connection, root=args.archive_dir)
+            results["archive"] = {"success": success, "message": msg}
+            if success: logging.info(f"--- Finalizado: Archivo historial - {msg} ---")
+            else: logging.error(f"--- FALLO: Archivo historial - {msg} ---")
+
         # --- Resumen Final ---
         all_success = all(res["success"] for task, res in results.items() if tasks_to_run[task])
         if all_success:
@@ -85,7 +167,7 @@ def run_job(args):
     finally:
         if connection and connection.is_connected():
             connection.close()
-            logging.info("Conexión a MySQL cerrada.")
+            logging.info("Conexión a MySQL devuelta al pool.")
 
     logging.info("===== Job de Actualización y Snapshot Finalizado =====")
 
@@ -113,6 +195,42 @@ if __name__ == "__main__":
         help='Ruta al archivo Excel/CSV de precios de competencia.'
     )
 
+    parser.add_argument(
+        '--insumos-dir',
+        type=str,
+        default=DEFAULT_INSUMOS_DIR,
+        help='Directorio con varios archivos de precios de insumos (uno por proveedor). Tiene prioridad sobre --insumos-file.'
+    )
+    parser.add_argument(
+        '--competencia-dir',
+        type=str,
+        default=DEFAULT_COMPETENCIA_DIR,
+        help='Directorio con varios archivos de precios de competencia. Tiene prioridad sobre --competencia-file.'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='Procesos para parsear archivos en modo directorio (por defecto, uno por CPU).'
+    )
+    parser.add_argument(
+        '--bulk-insumos',
+        action='store_true',
+        help='Cargar los precios de insumos vía tabla staging y un único UPDATE ... JOIN (listas grandes).'
+    )
+
+    parser.add_argument(
+        '--streaming',
+        action='store_true',
+        help='Leer los archivos de precios por bloques (memoria acotada, commit y checkpoint por bloque, reanudable).'
+    )
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=price_updaters.STREAM_CHUNK_SIZE,
+        help='Filas por bloque en modo --streaming.'
+    )
+
     # Argumentos para controlar qué pasos ejecutar
     parser.add_argument(
         '--update-insumos',
@@ -130,10 +248,52 @@ if __name__ == "__main__":
         help='Ejecutar solo la creación del snapshot.'
     )
 
+    parser.add_argument(
+        '--param-id',
+        type=int,
+        default=snapshot_creator.DEFAULT_PARAM_ID,
+        help='Juego de FINANCIAL_PARAMS (param_id) a usar en el snapshot (ej: uno por plataforma). Cada juego tiene su propia línea de tiempo en el historial; los rollups de KPIs son del juego 1.'
+    )
+    parser.add_argument(
+        '--archive-history',
+        action='store_true',
+        help='Ejecutar solo la exportación del historial a Parquet.'
+    )
+    parser.add_argument(
+        '--archive-dir',
+        default=history_archive.DEFAULT_ARCHIVE_DIR,
+        help='Directorio del archivo Parquet del historial (por defecto $HISTORY_ARCHIVE_DIR o history_archive).'
+    )
+    parser.add_argument(
+        '--rebuild-rollups',
+        action='store_true',
+        help='Recalcular todos los rollups de KPIs (día/semana/mes) desde el historial.'
+    )
+    parser.add_argument(
+        '--refresh-campaigns',
+        action='store_true',
+        help='Ejecutar solo el refresco de la simulación de campañas materializada (tras cambiar CAMPAIGNS).'
+    )
+    parser.add_argument(
+        '--verify-campaign-engine',
+        action='store_true',
+        help='Comparar la simulación en memoria de la página de campañas con V_CAMPAIGN_SIMULATION (falla si difieren).'
+    )
+    parser.add_argument(
+        '--migrate-history',
+        action='store_true',
+        help='Agregar la columna Param_Id (e índice) a PLATOS_FINANCIALS_HISTORY si falta. Correr una vez antes de actualizar la app.'
+    )
+    parser.add_argument(
+        '--delta',
+        action='store_true',
+        help='Guardar solo los platos que cambiaron desde su último snapshot (más las bajas).'
+    )
+
     args = parser.parse_args()
 
     # Determinar si ejecutar todos los pasos (si no se especifica uno concreto)
-    args.run_all = not (args.update_insumos or args.update_competencia or args.create_snapshot)
+    args.run_all = not (args.update_insumos or args.update_competencia or args.create_snapshot or args.archive_history or args.rebuild_rollups or args.refresh_campaigns or args.verify_campaign_engine or args.migrate_history)
 
     # Llamar a la función principal
     run_job(args)
\ No newline at end of file
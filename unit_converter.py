@@ -0,0 +1,158 @@
+import re
+import logging
+import unicodedata
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# --- Registro de Unidades ---
+# Cada alias apunta a (dimensión, factor a la unidad base de esa dimensión).
+# Bases: masa -> g, volumen -> ml, conteo -> unidad.
+UNIT_REGISTRY = {
+    # Masa
+    'mg': ('masa', 0.001),
+    'g': ('masa', 1.0), 'gr': ('masa', 1.0), 'grs': ('masa', 1.0),
+    'gramo': ('masa', 1.0), 'gramos': ('masa', 1.0),
+    'kg': ('masa', 1000.0), 'kgs': ('masa', 1000.0), 'kilo': ('masa', 1000.0),
+    'kilos': ('masa', 1000.0), 'kilogramo': ('masa', 1000.0), 'kilogramos': ('masa', 1000.0),
+    # Volumen
+    'ml': ('volumen', 1.0), 'cc': ('volumen', 1.0), 'cm3': ('volumen', 1.0),
+    'cl': ('volumen', 10.0), 'dl': ('volumen', 100.0),
+    'l': ('volumen', 1000.0), 'lt': ('volumen', 1000.0), 'lts': ('volumen', 1000.0),
+    'litro': ('volumen', 1000.0), 'litros': ('volumen', 1000.0),
+    'm3': ('volumen', 1_000_000.0), 'metro cubico': ('volumen', 1_000_000.0),
+    'metros cubicos': ('volumen', 1_000_000.0),
+    # Conteo
+    'u': ('conteo', 1.0), 'un': ('conteo', 1.0), 'und': ('conteo', 1.0), 'uds': ('conteo', 1.0),
+    'unidad': ('conteo', 1.0), 'unidades': ('conteo', 1.0),
+    'docena': ('conteo', 12.0), 'docenas': ('conteo', 12.0),
+}
+
+# Cantidad: entero o decimal ("25", "0,5", "1.5"); las fracciones y palabras se reemplazan antes
+_QTY = r'\d+(?:[.,]\d+)?'
+# Fracciones, con entero opcional delante: "1/2", "1/4", "1 1/2"
+_FRACTION_RE = re.compile(r'(?:\b(\d+)\s+)?\b(\d+)\s*/\s*(\d+)\b')
+# Cantidades en palabras ("Media docena", "Medio kilo", "Un cuarto kg")
+_WORD_QTY = [(re.compile(r'\b(?:un )?cuarto\b'), '0.25'), (re.compile(r'\bmedi[ao]\b'), '0.5')]
+# "[conteos x] cantidad unidad": "25kg", "1 L", "0,5 kg", "12 x 1L", "6x500ml", "2 x 6 x 330 ml",
+# "Pack 6 latas x 330ml" (cada conteo puede llevar un sustantivo antes de la x)
+_QTY_UNIT_RE = re.compile(
+    rf'((?:{_QTY}\s*(?:[a-z]+\s*)?[x*]\s*)*)({_QTY})\s*([a-z]+\d?)\b'
+)
+_PACK_COUNT_RE = re.compile(rf'({_QTY})\s*([a-z]+)?\s*[x*]')
+
+
+def _number(text):
+    return float(text.replace(',', '.'))
+
+
+def _replace_fractions(text):
+    """'1/2 kg' -> '0.5 kg', '1 1/2 l' -> '1.5 l'. None si hay una fracción con denominador 0."""
+    failed = []
+
+    def repl(m):
+        whole, num, den = m.group(1), int(m.group(2)), int(m.group(3))
+        if den == 0:
+            failed.append(m.group(0))
+            return m.group(0)
+        return repr((int(whole) if whole else 0) + num / den)
+
+    text = _FRACTION_RE.sub(repl, text)
+    return None if failed else text
+
+
+def _normalize(text):
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(text.lower().split())
+
+
+@lru_cache(maxsize=4096)
+def parse_unit(text):
+    """
+    Convierte un texto de unidad en (dimensión, cantidad en unidad base).
+
+    Ejemplos: 'Bolsa 25kg' -> ('masa', 25000.0), 'Botella 1L' -> ('volumen', 1000.0),
+    'Paquete 100u' -> ('conteo', 100.0), 'g' -> ('masa', 1.0), 'Pote 1/2 kg' -> ('masa', 500.0),
+    'Media docena' -> ('conteo', 6.0), 'Caja 12 x 1L' -> ('volumen', 12000.0),
+    'Pack 6 latas x 330ml' -> ('volumen', 1980.0) (los conteos "N x" del multipack se multiplican).
+    Las palabras de envase (Bolsa, Lata, Horma...) se ignoran. Devuelve None si no se reconoce
+    o si es ambiguo: más de una cantidad con unidad (ej: 'Caja 12u 1L'), números sueltos que no
+    forman parte de la cantidad (ej: 'Pack 6 latas de 330ml') o cantidades en cero. Mejor que
+    quede sin convertir (y aparezca en el log) que costearlo mal.
+    El resultado se memoiza: cada texto distinto se parsea una sola vez por proceso.
+    """
+    if text is None or (isinstance(text, float) and np.isnan(text)):
+        return None
+    norm = _normalize(text)
+    if not norm:
+        return None
+    if norm in UNIT_REGISTRY:
+        return UNIT_REGISTRY[norm]
+    norm = _replace_fractions(norm)
+    if norm is None:
+        return None
+    for pattern, value in _WORD_QTY:
+        norm = pattern.sub(value, norm)
+
+    found = [m for m in _QTY_UNIT_RE.finditer(norm) if m.group(3) in UNIT_REGISTRY]
+    if len(found) > 1:
+        return None
+    if found:
+        m = found[0]
+        rest = norm[:m.start()] + ' ' + norm[m.end():]
+        if re.search(r'\d', rest):
+            return None  # otro número sin relación clara con la cantidad
+        count = 1.0
+        for n, noun in _PACK_COUNT_RE.findall(m.group(1)):
+            if noun and noun in UNIT_REGISTRY and UNIT_REGISTRY[noun][0] != 'conteo':
+                return None  # "2 kg x 3 l": no es un conteo
+            count *= _number(n)
+        dimension, factor = UNIT_REGISTRY[m.group(3)]
+        quantity = count * _number(m.group(2)) * factor
+        return (dimension, float(quantity)) if quantity > 0 else None
+    if re.search(r'\d', norm):
+        return None  # números sin unidad reconocida
+
+    # Sin cantidad explícita: buscar una unidad suelta o compuesta ("Paquete kg", "Metro Cubico")
+    words = norm.split()
+    for size in (2, 1):
+        for i in range(len(words) - size, -1, -1):
+            candidate = ' '.join(words[i:i + size])
+            if candidate in UNIT_REGISTRY:
+                return UNIT_REGISTRY[candidate]
+    return None
+
+
+def conversion_factor(unidad_compra, unidad_uso):
+    """Cantidad de unidades de uso contenidas en una unidad de compra (NaN si no son compatibles)."""
+    compra = parse_unit(unidad_compra)
+    uso = parse_unit(unidad_uso)
+    if compra is None or uso is None or compra[0] != uso[0] or uso[1] == 0:
+        return np.nan
+    return compra[1] / uso[1]
+
+
+def compute_costo_por_unidad_uso(df, costo_col='Costo_Compra',
+                                 compra_col='Unidad_Medida_Compra', uso_col='Unidad_Medida_Uso'):
+    """
+    Calcula Costo_Por_Unidad_Uso para todo el DataFrame en una pasada vectorizada.
+    Solo se parsean los pares de unidades distintos; el resto es una división de arrays.
+    Devuelve una Serie float alineada con df (NaN donde las unidades no se reconocen o no son compatibles).
+    """
+    if df.empty:
+        return pd.Series(dtype='float64', index=df.index)
+
+    pairs = pd.MultiIndex.from_arrays([df[compra_col].astype(object), df[uso_col].astype(object)])
+    codes, uniques = pairs.factorize()
+    factors = np.array([conversion_factor(compra, uso) for compra, uso in uniques], dtype='float64')
+    row_factors = factors[codes] if len(factors) else np.full(len(df), np.nan)
+
+    costos = pd.to_numeric(df[costo_col], errors='coerce').to_numpy(dtype='float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = costos / row_factors
+
+    unresolved = [f"{compra!r} -> {uso!r}" for (compra, uso), f in zip(uniques, factors) if np.isnan(f)]
+    if unresolved:
+        logging.warning(f"Unidades no convertibles (Costo_Por_Unidad_Uso quedará NULL): {unresolved[:20]}")
+    return pd.Series(result, index=df.index, name='Costo_Por_Unidad_Uso')